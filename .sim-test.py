@@ -1,37 +1,96 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
+import json
+import shlex
 import pexpect
+import statistics
+import subprocess
 import time
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 
 
 parser = ArgumentParser()
-parser.add_argument("--sdram-module", type=str)
+parser.add_argument("--sdram-module", type=str, nargs="+", default=[],
+    help="SDRAM modules to simulate (one configuration per module)")
+parser.add_argument("--config", type=str, action="append", default=[],
+    help="additional configuration: ID=SIM_ARGS (ex: eth=--with-ethernet)")
+parser.add_argument("--sim-args", type=str, default="",
+    help="arguments passed to every sim.py run")
+parser.add_argument("--jobs", type=int, default=1,
+    help="number of concurrent simulations")
+parser.add_argument("--output-dir", type=str, default="build/sim-test",
+    help="isolated build directories and logs of the simulations")
+parser.add_argument("--report", type=str, default=None,
+    help="JSON report of the checkpoints times (default=<output-dir>/report.json)")
+parser.add_argument("--benchmark", action="store_true",
+    help="boot up to the login prompt (userspace phase, simulated time)")
+parser.add_argument("--history", type=str, default=None,
+    help="boot times history (JSON lines, keyed on commit and configuration)")
+parser.add_argument("--threshold", type=float, default=0.2,
+    help="fail when the simulated cycles of a phase exceed the history baseline by this ratio (default=0.2)")
+parser.add_argument("--baseline", type=int, default=5,
+    help="number of previous runs of the history the baseline (median) is computed on")
 args = parser.parse_args()
 
 
+configs = [(module, f'--with-sdram --sdram-module {module}') for module in args.sdram_module]
+for config in args.config:
+    id, _, sim_args = config.partition('=')
+    configs.append((id, sim_args))
+if not configs:
+    parser.error('no configuration to simulate: use --sdram-module and/or --config')
+
+# Simulated time: sim.py prints the cycles since reset when the marker of a checkpoint (end of its
+# pattern) is written to the console (--console-cycles).
+checkpoints = [
+    { 'name': 'bios',     'timeout': 240,  'good': [b'\n\\s*BIOS built on'], 'marker': 'BIOS built on' },
+    { 'name': 'emulator', 'timeout': 60,   'good': [b'\n\\s*VexRiscv Machine Mode software'], 'marker': 'Machine Mode software' },
+    { 'name': 'kernel',   'timeout': 240,  'good': [b'Memory: \\d+K/\\d+K available'], 'marker': 'K available' },
+]
+if args.benchmark:
+    checkpoints.append({ 'name': 'userspace', 'timeout': 1200, 'good': [b'login:'], 'marker': 'login:' })
+
+console_cycles = re.compile(rb'CONSOLE_CYCLES (\d+): (\d+)')
+
 tests = [
     {
-        'id':      'linux-on-litex-vexriscv',
-        'command': f'./sim.py --with-sdram --sdram-module {args.sdram_module}',
+        'id':      id,
+        'command': ' '.join(filter(None, ['./sim.py', sim_args, args.sim_args,
+            f'--output-dir {shlex.quote(os.path.join(args.output_dir, id))}'] +
+            [f'--console-cycles {shlex.quote(cp["marker"])}' for cp in checkpoints])),
         'cwd':     os.getcwd(),
-        'checkpoints': [
-            { 'timeout': 240,  'good': [b'\n\\s*BIOS built on'] },
-            { 'timeout': 60,   'good': [b'\n\\s*VexRiscv Machine Mode software'] },
-            { 'timeout': 240,  'good': [b'Memory: \\d+K/\\d+K available'] },
-        ]
+        'checkpoints': checkpoints,
     }
+    for id, sim_args in configs
 ]
 
 
-def run_test(id, command, cwd, checkpoints):
+def get_cycles(p, checkpoint_id):
+    """Simulated cycles of a checkpoint: printed with the marker (before or after it in the output)."""
+    for n, cycles in console_cycles.findall(p.before + p.after):
+        if int(n) == checkpoint_id:
+            return int(cycles)
+    try:
+        p.expect(rb'CONSOLE_CYCLES %d: (\d+)' % checkpoint_id, timeout=10)
+    except (pexpect.EOF, pexpect.TIMEOUT):
+        return None
+    return int(p.match.group(1))
+
+
+def run_test(id, command, cwd, checkpoints, logfile=None):
     print(f'*** Test ID: {id}')
     print(f'*** CWD:     {cwd}')
     print(f'*** Command: {command}')
-    os.chdir(cwd)
-    p = pexpect.spawn(command, timeout=None, logfile=sys.stdout.buffer)
+    sys.stdout.flush()
+    log = sys.stdout.buffer if logfile is None else open(logfile, 'wb')
+    p = pexpect.spawn(command, cwd=cwd, timeout=None, logfile=log)
 
+    result = {'id': id, 'command': command, 'success': False, 'checkpoints': [], 'error': None,
+        'sim_cycles': None}
+    start = time.time()
     checkpoint_id = 0
     for cp in checkpoints:
         good = cp.get('good', [])
@@ -44,35 +103,146 @@ def run_test(id, command, cwd, checkpoints):
             match_id = p.expect(patterns, timeout=timeout)
         except pexpect.EOF:
             print(f'\n*** {id}: premature termination')
-            return False;
+            result['error'] = 'premature termination'
+            break
         except pexpect.TIMEOUT:
             timediff = time.time() - timediff
             print(f'\n*** {id}: timeout (checkpoint {checkpoint_id}: +{int(timediff)}s)')
-            return False;
+            result['error'] = f'timeout (checkpoint {checkpoint_id})'
+            break
         timediff = time.time() - timediff
 
         if match_id >= len(good):
+            result['error'] = f'bad pattern (checkpoint {checkpoint_id})'
             break
 
-        sys.stdout.buffer.write(b'<<checkpoint %d: +%ds>>' % (checkpoint_id, int(timediff)))
+        cycles = get_cycles(p, checkpoint_id)
+        if cycles is not None:
+            result['sim_cycles'] = cycles
+
+        log.write(b'<<checkpoint %d: +%ds>>' % (checkpoint_id, int(timediff)))
+        result['checkpoints'].append({'name': cp.get('name', str(checkpoint_id)), 'elapsed': round(timediff, 3),
+            'cycles': cycles})
         checkpoint_id += 1
 
     is_success = checkpoint_id == len(checkpoints)
-
-    # Let it print rest of line
-    match_id = p.expect_exact([b'\n', pexpect.TIMEOUT, pexpect.EOF], timeout=1)
+    result['success'] = is_success
+    result['elapsed'] = round(time.time() - start, 3)
+
+    if result['error'] is None:
+        # Let it print rest of line
+        match_id = p.expect_exact([b'\n', pexpect.TIMEOUT, pexpect.EOF], timeout=1)
+        line_break = '\n' if match_id != 0 else ''
+    else:
+        line_break = ''
     p.terminate(force=True)
 
-    line_break = '\n' if match_id != 0 else ''
-    print(f'{line_break}*** {id}: {"success" if is_success else "failure"}')
+    print(f'{line_break}*** {id}: {"success" if is_success else "failure"} (+{int(result["elapsed"])}s)')
+    sys.stdout.flush()
+    if logfile is not None:
+        log.close()
 
-    return is_success
+    return result
 
 
-for test in tests:
-    success = run_test(**test)
-    if not success:
-        sys.exit(1)
+def get_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+dirty' if dirty else '')
+
+
+def get_measures(result):
+    measures = {cp['name']: cp['elapsed'] for cp in result['checkpoints']}
+    measures['host_seconds'] = result['elapsed']
+    # Simulated cycles of each phase (since the previous checkpoint, bios: since reset) and total.
+    previous = 0
+    for cp in result['checkpoints']:
+        if cp['cycles'] is None:
+            break
+        measures[cp['name'] + '_cycles'] = cp['cycles'] - previous
+        previous = cp['cycles']
+    if result['sim_cycles'] is not None:
+        measures['sim_cycles'] = result['sim_cycles']
+    return measures
+
+
+# Measures gating the regressions: simulated cycles of each phase and total. Host times (checkpoints,
+# host_seconds) are noisy (concurrent --jobs, the bios phase includes the build) and only recorded.
+gated_measures = [cp['name'] + '_cycles' for cp in checkpoints] + ['sim_cycles']
+
+# Runs only compare to the runs of the same configuration, command and phases (--benchmark).
+history_key = ['config', 'command', 'benchmark', 'phases']
+
+
+def get_history_record(result):
+    return {
+        'config':    result['id'],
+        'command':   result['command'],
+        'benchmark': args.benchmark,
+        'phases':    [cp['name'] for cp in checkpoints],
+    }
 
-sys.exit(0)
 
+def check_history(history, result):
+    """Regressions of result against the median of the previous runs of the same configuration."""
+    record = get_history_record(result)
+    runs = [run for run in history
+        if all(run.get(k) == record[k] for k in history_key) and run['success']]
+    runs = runs[-args.baseline:]
+    regressions = []
+    for name, value in get_measures(result).items():
+        if name not in gated_measures:
+            continue
+        values = [run['measures'][name] for run in runs if name in run['measures']]
+        if not values:
+            continue
+        baseline = statistics.median(values)
+        if baseline <= 0:
+            # No reference to compare to (ratio undefined).
+            continue
+        if value > baseline*(1 + args.threshold):
+            regressions.append(f'{name}: {value} vs {baseline} (+{100*(value - baseline)/baseline:.0f}%)')
+    return regressions
+
+
+os.makedirs(args.output_dir, exist_ok=True)
+if args.jobs > 1:
+    # Concurrent simulations: console outputs go to <output-dir>/<id>.log.
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_test, **test, logfile=os.path.join(args.output_dir, f'{test["id"]}.log'))
+            for test in tests]
+        results = [future.result() for future in futures]
+else:
+    results = [run_test(**test) for test in tests]
+
+report = args.report or os.path.join(args.output_dir, 'report.json')
+with open(report, 'w') as f:
+    json.dump(results, f, indent=4)
+print(f'*** Report:  {report}')
+
+success = all(result['success'] for result in results)
+if args.history is not None:
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = [json.loads(line) for line in f if line.strip()]
+    commit = get_commit()
+    with open(args.history, 'a') as f:
+        for result in results:
+            if result['success']:
+                for regression in check_history(history, result):
+                    print(f'*** {result["id"]}: regression, {regression}')
+                    success = False
+            f.write(json.dumps({
+                'commit':   commit,
+                **get_history_record(result),
+                'date':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'success':  result['success'],
+                'measures': get_measures(result),
+            }) + '\n')
+    print(f'*** History: {args.history}')
+
+sys.exit(0 if success else 1)
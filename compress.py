@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import struct
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Compressed boot images: the kernel Image is compressed in LZ4 legacy format (decompressed by the
+# machine mode emulator), the rootfs in gzip (decompressed by the kernel, CONFIG_RD_GZIP).
+
+chunk_size = 1024*1024
+
+# LZ4 legacy format: magic, then blocks of (LE32 compressed size, block) of 8MB of uncompressed
+# data (only the last block is shorter), a zero size ends the stream.
+lz4_legacy_magic      = 0x184c2102
+lz4_legacy_block_size = 8*1024*1024
+
+# Compression --------------------------------------------------------------------------------------
+
+def lz4_compress(src, dst):
+    try:
+        import lz4.block
+    except ImportError:
+        raise ImportError("LZ4 compression requires the lz4 python package (pip3 install lz4)")
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        fo.write(struct.pack("<I", lz4_legacy_magic))
+        while True:
+            data = fi.read(lz4_legacy_block_size)
+            if not data:
+                break
+            block = lz4.block.compress(data, mode="high_compression", compression=12, store_size=False)
+            fo.write(struct.pack("<I", len(block)))
+            fo.write(block)
+        fo.write(struct.pack("<I", 0))
+
+def gzip_compress(src, dst):
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        # mtime=0/no filename: reproducible output.
+        with gzip.GzipFile(filename="", mode="wb", fileobj=fo, compresslevel=9, mtime=0) as fz:
+            shutil.copyfileobj(fi, fz, chunk_size)
+
+compressors = {
+    ".lz4": lz4_compress,
+    ".gz":  gzip_compress,
+}
+
+def compress_image(src, dst):
+    """Compress src to dst (compression from dst extension) when dst is missing or older than src."""
+    if not os.path.exists(src):
+        print("{} not found, skipping compression".format(src))
+        return False
+    if os.path.exists(dst) and os.stat(dst).st_mtime_ns >= os.stat(src).st_mtime_ns:
+        return False
+    compress = compressors[os.path.splitext(dst)[1]]
+    tmp = dst + ".tmp"
+    compress(src, tmp)
+    os.replace(tmp, dst)
+    print("{} --> {} ({} --> {} bytes, {:.1f}%)".format(src, dst,
+        os.path.getsize(src), os.path.getsize(dst), 100*os.path.getsize(dst)/max(os.path.getsize(src), 1)))
+    return True
+
+def get_compressed_images(images_dir="buildroot"):
+    return {
+        os.path.join("buildroot", "Image"):       os.path.join(images_dir, "Image.lz4"),
+        os.path.join("buildroot", "rootfs.cpio"): os.path.join(images_dir, "rootfs.cpio.gz"),
+    }
+
+def compress_images(images_dir="buildroot"):
+    os.makedirs(images_dir, exist_ok=True)
+    images = get_compressed_images(images_dir)
+    with ThreadPoolExecutor(max_workers=len(images)) as executor:
+        for future in [executor.submit(compress_image, src, dst) for src, dst in images.items()]:
+            future.result()
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed Linux images generator")
+    parser.add_argument("--output-dir", default="buildroot", help="Output directory of the compressed images")
+    args = parser.parse_args()
+    compress_images(args.output_dir)
+
+if __name__ == "__main__":
+    main()
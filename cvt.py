@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import re
+import json
+import argparse
+
+# VESA Coordinated Video Timings (CVT 1.2) for any WxH@Hz (progressive, no margins): standard CVT
+# (CRT-like blanking) and CVT-RB (reduced blanking, for digital displays: lower pixel clock and
+# DRAM scan-out bandwidth for the same visible resolution). Settings use the SoCLinux.add_framebuffer
+# format (blanking = front porch + sync + back porch).
+
+cvt_cell_gran     = 8       # Horizontal granularity (pixels).
+cvt_clock_step    = 0.25e6  # Pixel clock granularity (Hz).
+cvt_min_v_porch   = 3       # Vertical front porch (lines).
+cvt_min_v_bporch  = 6       # Minimum vertical back porch (lines).
+
+# Standard CVT.
+cvt_min_vsync_bp  = 550e-6  # Minimum vertical sync + back porch time (s).
+cvt_h_sync_per    = 0.08    # Horizontal sync (ratio of the total line).
+cvt_c_prime       = 30      # Blanking formula gradient/offset (C', M').
+cvt_m_prime       = 300
+
+# CVT-RB.
+cvt_rb_min_v_blank = 460e-6 # Minimum vertical blanking time (s).
+cvt_rb_h_blank     = 160
+cvt_rb_h_sync      = 32
+cvt_rb_h_fporch    = 48
+
+def cvt_vsync(h_active, v_active):
+    # Vertical sync width encodes the aspect ratio.
+    for (w, h), vsync in [((4, 3), 4), ((16, 9), 5), ((16, 10), 6), ((5, 4), 7), ((15, 9), 7)]:
+        if h_active == cvt_cell_gran*((v_active*w//h)//cvt_cell_gran):
+            return vsync
+    return 10
+
+def cvt_timings(h_active, v_active, refresh=60, reduced_blanking=False):
+    """Video settings of h_active x v_active @ refresh Hz."""
+    if h_active % cvt_cell_gran:
+        # CVT timings are in character cells: the width would be silently truncated.
+        raise ValueError("Width {} is not a multiple of {} (CVT character cell), use {} or {}".format(
+            h_active, cvt_cell_gran, cvt_cell_gran*(h_active//cvt_cell_gran), cvt_cell_gran*(h_active//cvt_cell_gran + 1)))
+    v_sync   = cvt_vsync(h_active, v_active)
+    if reduced_blanking:
+        h_period      = (1/refresh - cvt_rb_min_v_blank)/v_active
+        v_blanking    = max(int(cvt_rb_min_v_blank/h_period) + 1, cvt_min_v_porch + v_sync + cvt_min_v_bporch)
+        h_blanking    = cvt_rb_h_blank
+        h_sync        = cvt_rb_h_sync
+        h_front_porch = cvt_rb_h_fporch
+        h_total       = h_active + h_blanking
+        pix_clk       = refresh*(v_active + v_blanking)*h_total
+    else:
+        h_period      = (1/refresh - cvt_min_vsync_bp)/(v_active + cvt_min_v_porch)
+        v_sync_bp     = max(int(cvt_min_vsync_bp/h_period) + 1, v_sync + cvt_min_v_bporch)
+        v_blanking    = v_sync_bp + cvt_min_v_porch
+        duty_cycle    = max(cvt_c_prime - cvt_m_prime*h_period*1e3, 20)
+        h_blanking    = 2*cvt_cell_gran*int(h_active*duty_cycle/(100 - duty_cycle)/(2*cvt_cell_gran))
+        h_total       = h_active + h_blanking
+        h_sync        = cvt_cell_gran*int(cvt_h_sync_per*h_total/cvt_cell_gran)
+        h_front_porch = h_blanking//2 - h_sync
+        pix_clk       = h_total/h_period
+    pix_clk = cvt_clock_step*int(pix_clk/cvt_clock_step)
+    return {
+        "pix_clk"        : pix_clk,
+        "h-active"       : h_active,
+        "h-blanking"     : h_blanking,
+        "h-sync"         : h_sync,
+        "h-front-porch"  : h_front_porch,
+        "v-active"       : v_active,
+        "v-blanking"     : v_blanking,
+        "v-sync"         : v_sync,
+        "v-front-porch"  : cvt_min_v_porch,
+    }
+
+def parse_video_mode(video):
+    """Video settings of a WxH@Hz (CVT) or WxH@HzR (CVT-RB) mode (ex: 1280x800@60R)."""
+    m = re.fullmatch(r"(\d+)x(\d+)@(\d+(?:\.\d+)?)(R?)", video)
+    if m is None:
+        raise ValueError("Invalid video mode {} (expected WxH@Hz or WxH@HzR)".format(video))
+    h_active, v_active, refresh, reduced = m.groups()
+    return cvt_timings(int(h_active), int(v_active), float(refresh), reduced_blanking=(reduced == "R"))
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="CVT/CVT-RB video timings generator")
+    parser.add_argument("video",                       help="Video mode: WxH@Hz (CVT) or WxH@HzR (CVT-RB)")
+    parser.add_argument("--bpp",  default=32, type=int, help="Bits per pixel (scan-out bandwidth)")
+    args = parser.parse_args()
+    try:
+        settings = parse_video_mode(args.video)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(settings, indent=4))
+    h_total = settings["h-active"] + settings["h-blanking"]
+    v_total = settings["v-active"] + settings["v-blanking"]
+    bandwidth = settings["pix_clk"]*settings["h-active"]*settings["v-active"]/(h_total*v_total)*args.bpp/8
+    print("Scan-out bandwidth: {:.1f}MB/s".format(bandwidth/1e6))
+
+if __name__ == "__main__":
+    main()
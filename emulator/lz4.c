@@ -0,0 +1,98 @@
+/* LZ4 legacy format decompression (kernel Image compressed by compress.py) */
+
+#include "lz4.h"
+
+/* Bytewise accesses: the emulator traps (and emulates) misaligned accesses for Linux. */
+static uint32_t get_le32(const uint8_t *p)
+{
+	return p[0] | (p[1] << 8) | (p[2] << 16) | ((uint32_t) p[3] << 24);
+}
+
+static int lz4_block_decompress(const uint8_t *src, uint32_t src_len, uint8_t *dst, uint8_t *dst_end)
+{
+	const uint8_t *ip = src;
+	const uint8_t *ip_end = src + src_len;
+	const uint8_t *match;
+	uint8_t *op = dst;
+	uint32_t token, len, offset;
+	uint8_t b;
+
+	while(ip < ip_end) {
+		/* Literals */
+		token = *ip++;
+		len = token >> 4;
+		if(len == 15) {
+			do {
+				if(ip >= ip_end)
+					return -1;
+				b = *ip++;
+				len += b;
+			} while(b == 255);
+		}
+		if((len > (uint32_t) (ip_end - ip)) || (len > (uint32_t) (dst_end - op)))
+			return -1;
+		while(len--)
+			*op++ = *ip++;
+		/* Last sequence only has literals */
+		if(ip >= ip_end)
+			break;
+
+		/* Match (blocks are independent: offsets stay within the block) */
+		if(ip_end - ip < 2)
+			return -1;
+		offset = ip[0] | (ip[1] << 8);
+		ip += 2;
+		if((offset == 0) || (offset > (uint32_t) (op - dst)))
+			return -1;
+		len = token & 15;
+		if(len == 15) {
+			do {
+				if(ip >= ip_end)
+					return -1;
+				b = *ip++;
+				len += b;
+			} while(b == 255);
+		}
+		len += 4;
+		if(len > (uint32_t) (dst_end - op))
+			return -1;
+		/* Bytewise copy: matches can overlap the output */
+		match = op - offset;
+		while(len--)
+			*op++ = *match++;
+	}
+	return op - dst;
+}
+
+int lz4_legacy_is_compressed(const uint8_t *src)
+{
+	return get_le32(src) == LZ4_LEGACY_MAGIC;
+}
+
+/* Returns the decompressed size, -1 on error */
+int lz4_legacy_decompress(const uint8_t *src, uint8_t *dst, uint8_t *dst_end)
+{
+	const uint8_t *ip = src + 4;
+	uint8_t *op = dst;
+	uint32_t block_len;
+	int len;
+
+	if(!lz4_legacy_is_compressed(src))
+		return -1;
+	for(;;) {
+		block_len = get_le32(ip);
+		/* End of stream: zero size, concatenated stream or garbage */
+		if((block_len == 0) || (block_len == LZ4_LEGACY_MAGIC) || (block_len > 2*LZ4_LEGACY_BLOCK_SIZE))
+			break;
+		ip += 4;
+		len = lz4_block_decompress(ip, block_len, op, dst_end);
+		if(len < 0)
+			return -1;
+		ip += block_len;
+		op += len;
+		/* Only the last block is shorter than the block size */
+		if(len < LZ4_LEGACY_BLOCK_SIZE)
+			break;
+	}
+	return op - dst;
+}
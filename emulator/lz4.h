@@ -0,0 +1,12 @@
+#ifndef LZ4_H
+#define LZ4_H
+
+#include <stdint.h>
+
+#define LZ4_LEGACY_MAGIC      0x184c2102
+#define LZ4_LEGACY_BLOCK_SIZE (8 << 20)
+
+int lz4_legacy_is_compressed(const uint8_t *src);
+int lz4_legacy_decompress(const uint8_t *src, uint8_t *dst, uint8_t *dst_end);
+
+#endif /* LZ4_H */
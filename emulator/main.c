@@ -7,15 +7,38 @@
 #include <irq.h>
 #include <uart.h>
 #include <console.h>
+#include <system.h>
 
 #include <hw/flags.h>
 #include <generated/csr.h>
 #include <generated/mem.h>
+#include <generated/soc.h>
 
 #include "riscv.h"
+#include "lz4.h"
+#ifdef EMULATOR_STATS
+#include "stats.h"
+#endif
+
+/* Images offsets from the packed RAM layout (layout.py), BIOS fixed layout otherwise */
+#ifndef KERNEL_IMAGE_RAM_OFFSET
+#define KERNEL_IMAGE_RAM_OFFSET      0x00000000
+#endif
+#ifndef ROOTFS_IMAGE_RAM_OFFSET
+#define ROOTFS_IMAGE_RAM_OFFSET      0x00800000
+#endif
+#ifndef DEVICE_TREE_IMAGE_RAM_OFFSET
+#define DEVICE_TREE_IMAGE_RAM_OFFSET 0x01000000
+#endif
+#ifndef CONFIG_CLOCK_FREQUENCY
+#define CONFIG_CLOCK_FREQUENCY       0
+#endif
 
-#define LINUX_IMAGE_BASE MAIN_RAM_BASE + 0x00000000
-#define LINUX_DTB_BASE   MAIN_RAM_BASE + 0x01000000
+/* Linux runs from the base of the RAM, the kernel Image is loaded there or LZ4 compressed after it */
+#define LINUX_IMAGE_BASE  MAIN_RAM_BASE + 0x00000000
+#define KERNEL_IMAGE_BASE MAIN_RAM_BASE + KERNEL_IMAGE_RAM_OFFSET
+#define KERNEL_IMAGE_END  MAIN_RAM_BASE + ROOTFS_IMAGE_RAM_OFFSET
+#define LINUX_DTB_BASE    MAIN_RAM_BASE + DEVICE_TREE_IMAGE_RAM_OFFSET
 
 #define max(a,b) \
   ({ __typeof__ (a) _a = (a); \
@@ -30,6 +53,15 @@
 
 extern const uint32_t _sp;
 
+#ifdef EMULATOR_STATS
+struct emulator_stats emulator_stats = {
+	.magic    = EMULATOR_STATS_MAGIC,
+	.version  = EMULATOR_STATS_VERSION,
+	.size     = sizeof(struct emulator_stats),
+	.clk_freq = CONFIG_CLOCK_FREQUENCY,
+};
+#endif
+
 void vexriscv_machine_mode_trap(void);
 
 /* LiteX peripherals access functions */
@@ -351,7 +383,11 @@ static uint32_t vexriscv_read_instruction(uint32_t pc){
 }
 
 
-__attribute__((used)) void vexriscv_machine_mode_trap(void) {
+#ifdef EMULATOR_STATS
+static void vexriscv_machine_mode_stats_dump(void);
+#endif
+
+static void vexriscv_machine_mode_emulate(void) {
 	int32_t cause = csr_read(mcause);
 
 	/* Interrupt */
@@ -518,6 +554,12 @@ __attribute__((used)) void vexriscv_machine_mode_trap(void) {
 						csr_clear(sip, MIP_STIP);
 						csr_write(mepc, csr_read(mepc) + 4);
 					} break;
+					case SBI_SHUTDOWN: {
+#ifdef EMULATOR_STATS
+						vexriscv_machine_mode_stats_dump();
+#endif
+						litex_stop();
+					} break;
 					default: litex_stop(); break;
 				}
 			} break;
@@ -526,6 +568,79 @@ __attribute__((used)) void vexriscv_machine_mode_trap(void) {
 	}
 }
 
+/* Trap statistics (built with EMULATOR_STATS=1) */
+
+#ifdef EMULATOR_STATS
+static struct emulator_stats_entry *vexriscv_machine_mode_stats_entry(int32_t cause, struct emulator_stats_entry **detail) {
+	*detail = NULL;
+	/* Interrupt */
+	if(cause < 0)
+		return &emulator_stats.causes[(cause & 0xff) == CAUSE_MACHINE_TIMER ? STATS_TIMER : STATS_OTHER];
+	/* Exception */
+	switch(cause){
+		case CAUSE_UNALIGNED_LOAD:  return &emulator_stats.causes[STATS_UNALIGNED_LOAD];
+		case CAUSE_UNALIGNED_STORE: return &emulator_stats.causes[STATS_UNALIGNED_STORE];
+		case CAUSE_ILLEGAL_INSTRUCTION: {
+			uint32_t instr = csr_read(mbadaddr);
+			switch(instr & 0x7f){
+				case 0x2f:
+					*detail = &emulator_stats.amo[instr >> 27];
+					return &emulator_stats.causes[STATS_AMO];
+				case 0x73: {
+					uint32_t csrAddress = instr >> 20;
+					if((csrAddress & ~0x83) == 0xc00 && (csrAddress & 0x3) != 0x3)
+						*detail = &emulator_stats.csr[(csrAddress & 0x3) + ((csrAddress & 0x80) ? 3 : 0)];
+					return &emulator_stats.causes[STATS_CSR];
+				}
+			}
+		} break;
+		case CAUSE_SCALL: {
+			uint32_t which = vexriscv_read_register(17);
+			if(which < STATS_SBI_FUNCTIONS)
+				*detail = &emulator_stats.sbi[which];
+			return &emulator_stats.causes[STATS_SBI];
+		}
+	}
+	return &emulator_stats.causes[STATS_OTHER];
+}
+
+static void vexriscv_machine_mode_stats_dump(void) {
+	const uint8_t *data = (const uint8_t *) &emulator_stats;
+	const char *hex = "0123456789abcdef";
+	const char *prefix = "\nEMULATOR_STATS: ";
+	uint32_t i;
+	while(*prefix)
+		litex_putchar(*prefix++);
+	for(i = 0; i < sizeof(emulator_stats); i++) {
+		litex_putchar(hex[data[i] >> 4]);
+		litex_putchar(hex[data[i] & 0xf]);
+	}
+	litex_putchar('\n');
+}
+
+__attribute__((used)) void vexriscv_machine_mode_trap(void) {
+	struct emulator_stats_entry *entry, *detail;
+	uint32_t start, cycles;
+	start = litex_read_cpu_timer_lsb();
+	entry = vexriscv_machine_mode_stats_entry(csr_read(mcause), &detail);
+	vexriscv_machine_mode_emulate();
+	/* Timer LSBs: wraps after 2^32 cycles, longer than any trap */
+	cycles = litex_read_cpu_timer_lsb() - start;
+	emulator_stats.total.count++;
+	emulator_stats.total.cycles += cycles;
+	entry->count++;
+	entry->cycles += cycles;
+	if(detail) {
+		detail->count++;
+		detail->cycles += cycles;
+	}
+}
+#else
+__attribute__((used)) void vexriscv_machine_mode_trap(void) {
+	vexriscv_machine_mode_emulate();
+}
+#endif
+
 static void vexriscv_machine_mode_boot(void) {
 	__asm__ __volatile__ (
 		" li a0, 0\n"
@@ -535,6 +650,37 @@ static void vexriscv_machine_mode_boot(void) {
 	);
 }
 
+static void vexriscv_machine_mode_decompress(void) {
+	uint8_t *src, *dst_end;
+	int len;
+	if(!lz4_legacy_is_compressed((uint8_t *) (KERNEL_IMAGE_BASE)))
+		return;
+	printf("Decompressing Linux Image...\n");
+	/* Packed layout: the compressed Image is loaded after the Linux area, don't overwrite it */
+	src     = (uint8_t *) (KERNEL_IMAGE_BASE);
+	dst_end = (uint8_t *) (KERNEL_IMAGE_BASE);
+	if(KERNEL_IMAGE_RAM_OFFSET == 0) {
+		/* BIOS fixed layout: the compressed Image is loaded at the base of the RAM, move its
+		   region to the top of the RAM (above the emulator) and decompress it to the base */
+		len = KERNEL_IMAGE_END - KERNEL_IMAGE_BASE;
+		src = (uint8_t *) (MAIN_RAM_BASE + MAIN_RAM_SIZE - len);
+		if(src < (uint8_t *) (EMULATOR_BASE + EMULATOR_SIZE)) {
+			printf("Not enough RAM to decompress the Linux Image\n");
+			while(1);
+		}
+		memcpy(src, (uint8_t *) (KERNEL_IMAGE_BASE), len);
+		dst_end = (uint8_t *) (KERNEL_IMAGE_END);
+	}
+	len = lz4_legacy_decompress(src, (uint8_t *) (LINUX_IMAGE_BASE), dst_end);
+	if(len < 0) {
+		printf("Linux Image decompression failed\n");
+		while(1);
+	}
+	printf("Linux Image: %d bytes\n", len);
+	flush_cpu_dcache();
+	flush_cpu_icache();
+}
+
 /* Main */
 
 int main(void)
@@ -544,6 +690,7 @@ int main(void)
 	uart_init();
 	puts("VexRiscv Machine Mode software built "__DATE__" "__TIME__"");
 	printf("--========== \e[1mBooting Linux\e[0m =============--\n");
+	vexriscv_machine_mode_decompress();
 	uart_sync();
 	vexriscv_machine_mode_init();
 	vexriscv_machine_mode_boot();
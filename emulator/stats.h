@@ -0,0 +1,45 @@
+#ifndef STATS_H
+#define STATS_H
+
+#include <stdint.h>
+
+/* Trap statistics of the emulator, kept in its RAM region: located by its magic from Linux
+   (/dev/mem) or dumped on the console on SBI shutdown (parsed by emulator_stats.py). */
+
+#define EMULATOR_STATS_MAGIC   "EMUSTATS"
+#define EMULATOR_STATS_VERSION 1
+
+enum {
+	STATS_UNALIGNED_LOAD,
+	STATS_UNALIGNED_STORE,
+	STATS_AMO,
+	STATS_CSR,
+	STATS_SBI,
+	STATS_TIMER,
+	STATS_OTHER,
+	STATS_CAUSES
+};
+
+#define STATS_AMO_OPS       32 /* funct5 */
+#define STATS_CSRS          6  /* cycle, time, instret, cycleh, timeh, instreth */
+#define STATS_SBI_FUNCTIONS 9
+
+struct emulator_stats_entry {
+	uint64_t count;
+	uint64_t cycles;
+};
+
+struct emulator_stats {
+	char     magic[8];
+	uint32_t version;
+	uint32_t size;
+	uint32_t clk_freq;
+	uint32_t reserved;
+	struct emulator_stats_entry total;
+	struct emulator_stats_entry causes[STATS_CAUSES];
+	struct emulator_stats_entry amo[STATS_AMO_OPS];
+	struct emulator_stats_entry csr[STATS_CSRS];
+	struct emulator_stats_entry sbi[STATS_SBI_FUNCTIONS];
+};
+
+#endif /* STATS_H */
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import re
+import json
+import struct
+import argparse
+
+# Trap statistics of the machine mode emulator (emulator/stats.h): read from a dump of the emulator
+# RAM region (ex: from Linux through /dev/mem) or from a console log (dumped on SBI shutdown).
+
+stats_magic   = b"EMUSTATS"
+stats_version = 1
+stats_header  = struct.Struct("<8sIIII")
+stats_entry   = struct.Struct("<QQ")
+
+stats_causes = ["unaligned_load", "unaligned_store", "amo", "csr", "sbi", "timer", "other"]
+stats_amo_ops = {
+    0x00: "amoadd",  0x01: "amoswap", 0x02: "lr",      0x03: "sc",
+    0x04: "amoxor",  0x08: "amoor",   0x0c: "amoand",  0x10: "amomin",
+    0x14: "amomax",  0x18: "amominu", 0x1c: "amomaxu",
+}
+stats_csrs = ["rdcycle", "rdtime", "rdinstret", "rdcycleh", "rdtimeh", "rdinstreth"]
+stats_sbi_functions = [
+    "set_timer", "console_putchar", "console_getchar", "clear_ipi", "send_ipi",
+    "remote_fence_i", "remote_sfence_vma", "remote_sfence_vma_asid", "shutdown",
+]
+
+# Parsing ------------------------------------------------------------------------------------------
+
+def get_stats_data(data):
+    """Statistics structure from a console log (last dump) or a memory dump (magic)."""
+    dumps = re.findall(rb"EMULATOR_STATS: ([0-9a-f]+)", data)
+    if dumps:
+        return bytes.fromhex(dumps[-1].decode())
+    offset = data.find(stats_magic)
+    if offset < 0:
+        raise ValueError("No emulator statistics found")
+    return data[offset:]
+
+def parse_stats(data):
+    data = get_stats_data(data)
+    magic, version, size, clk_freq, _ = stats_header.unpack_from(data)
+    if magic != stats_magic or version != stats_version:
+        raise ValueError("Unsupported emulator statistics (version {})".format(version))
+    if len(data) < size:
+        raise ValueError("Truncated emulator statistics ({}/{} bytes)".format(len(data), size))
+    entries = [stats_entry.unpack_from(data, offset)
+        for offset in range(stats_header.size, size, stats_entry.size)]
+    def get_entries(names):
+        r = {}
+        for i, name in names:
+            count, cycles = entries.pop(0)
+            if count:
+                r[name] = {"count": count, "cycles": cycles}
+        return r
+    stats = {"clk_freq": clk_freq}
+    stats["total"]  = get_entries([(0, "total")]).get("total", {"count": 0, "cycles": 0})
+    stats["causes"] = get_entries(enumerate(stats_causes))
+    stats["amo"]    = get_entries((i, stats_amo_ops.get(i, "amo_{:02x}".format(i))) for i in range(32))
+    stats["csr"]    = get_entries(enumerate(stats_csrs))
+    stats["sbi"]    = get_entries(enumerate(stats_sbi_functions))
+    return stats
+
+# Report -------------------------------------------------------------------------------------------
+
+def print_report(stats):
+    total = stats["total"]
+    clk_freq = stats["clk_freq"]
+    print("Emulator traps: {} ({} cycles{})".format(total["count"], total["cycles"],
+        ", {:.3f}s".format(total["cycles"]/clk_freq) if clk_freq else ""))
+    for group in ["causes", "amo", "csr", "sbi"]:
+        if not stats[group]:
+            continue
+        print("\n{:24s} {:>12s} {:>14s} {:>10s} {:>8s}".format(group, "count", "cycles", "cycles/trap", "%cycles"))
+        for name, entry in sorted(stats[group].items(), key=lambda e: -e[1]["cycles"]):
+            print("{:24s} {:12d} {:14d} {:10.1f} {:7.1f}%".format(name, entry["count"], entry["cycles"],
+                entry["cycles"]/entry["count"], 100*entry["cycles"]/max(total["cycles"], 1)))
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Machine mode emulator trap statistics")
+    parser.add_argument("filename",                    help="Emulator RAM dump or console log")
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args()
+    with open(args.filename, "rb") as f:
+        stats = parse_stats(f.read())
+    if args.json:
+        print(json.dumps(stats, indent=4))
+    else:
+        print_report(stats)
+
+if __name__ == "__main__":
+    main()
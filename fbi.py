@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# FBI images (Flash Boot Images): [length (LE32)][CRC32 (LE32)][data], as generated by LiteX's mkmscimg
+# with --fbi --little and copied from SPI Flash to RAM by the BIOS.
+
+chunk_size = 1024*1024
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def map_file(f):
+    # Zero-copy view of the file (mmap can't map empty files).
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def get_image_hashes(filename):
+    # Single streaming pass over the memory-mapped image: CRC32 for the header, SHA256 as content key.
+    crc    = 0
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        data = map_file(f)
+        view = memoryview(data)
+        for i in range(0, len(view), chunk_size):
+            crc = zlib.crc32(view[i:i+chunk_size], crc)
+            sha256.update(view[i:i+chunk_size])
+        view.release()
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return crc & 0xffffffff, sha256.hexdigest()
+
+def write_fbi(src, dst, crc):
+    tmp = dst + ".tmp"
+    with open(src, "rb") as fi, open(tmp, "wb") as fo:
+        data = map_file(fi)
+        fo.write(struct.pack("<II", len(data), crc))
+        view = memoryview(data)
+        for i in range(0, len(view), chunk_size):
+            fo.write(view[i:i+chunk_size])
+        view.release()
+        if isinstance(data, mmap.mmap):
+            data.close()
+    os.replace(tmp, dst)
+
+# FBI generation -----------------------------------------------------------------------------------
+
+def generate_fbi(src, dst, entry=None):
+    """Generate dst from src unless unchanged since entry (cache entry of the previous generation).
+
+    Returns (new cache entry, status) with status in "generated", "unchanged".
+    """
+    stat  = os.stat(src)
+    valid = (entry is not None and
+        entry.get("src") == src and
+        os.path.exists(dst) and
+        os.stat(dst).st_mtime_ns == entry.get("dst_mtime_ns") and
+        os.path.getsize(dst) == stat.st_size + 8)
+    # Same size/mtime: skip without reading the input.
+    if valid and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry, "unchanged"
+    crc, sha256 = get_image_hashes(src)
+    status = "unchanged"
+    if not (valid and entry["sha256"] == sha256):
+        write_fbi(src, dst, crc)
+        status = "generated"
+    entry = {
+        "src":          src,
+        "size":         stat.st_size,
+        "mtime_ns":     stat.st_mtime_ns,
+        "crc":          crc,
+        "sha256":       sha256,
+        "dst_mtime_ns": os.stat(dst).st_mtime_ns,
+    }
+    return entry, status
+
+def generate_fbis(images, cache_file=None, jobs=None):
+    """Generate the fbi images {src: dst} concurrently, skipping images whose content is unchanged."""
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}
+
+    with ThreadPoolExecutor(max_workers=jobs or len(images) or 1) as executor:
+        futures = {dst: executor.submit(generate_fbi, src, dst, cache.get(dst)) for src, dst in images.items()}
+        for dst, future in futures.items():
+            cache[dst], status = future.result()
+            print("{} --> {} (0x{:08x}, {})".format(cache[dst]["src"], dst, cache[dst]["crc"], status))
+
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump(cache, f, indent=4, sort_keys=True)
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="FBI (Flash Boot Image) generator")
+    parser.add_argument("images", nargs="+",                    help="Input images (output: <image>.fbi)")
+    parser.add_argument("--cache", default="build/fbi_cache.json", help="Cache file used to skip unchanged images")
+    parser.add_argument("--no-cache", action="store_true",     help="Always regenerate the images")
+    args = parser.parse_args()
+
+    for image in args.images:
+        if not os.path.isfile(image):
+            print("{} not found".format(image))
+            sys.exit(1)
+    generate_fbis({image: image + ".fbi" for image in args.images},
+        cache_file = None if args.no_cache else args.cache)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import mmap
+import hashlib
+import tempfile
+import subprocess
+
+# Sector-level delta flashing: a per-board manifest records the hash of each SPI Flash sector last
+# written; only the runs of sectors whose content differs are erased/programmed.
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def get_sector_hashes(filename, sector_size):
+    """SHA256 of each sector of the image, the last one padded with 0xff (erased Flash content)."""
+    hashes = []
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashes
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset in range(0, len(data), sector_size):
+                sector = data[offset:offset + sector_size]
+                sector += b"\xff"*(sector_size - len(sector))
+                hashes.append(hashlib.sha256(sector).hexdigest())
+    return hashes
+
+def load_manifest(filename, sector_size):
+    try:
+        with open(filename) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("sector_size") != sector_size:
+        return {}
+    return manifest.get("sectors", {})
+
+def save_manifest(filename, sector_size, sectors):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"sector_size": sector_size, "sectors": sectors}, f, indent=4, sort_keys=True)
+    os.replace(tmp, filename)
+
+# Flashers -----------------------------------------------------------------------------------------
+
+class OpenOCDFlasher:
+    """Programs a list of (address, filename) in a single OpenOCD session (one JTAG/proxy init)."""
+    def __init__(self, config, flash_proxy_basename, flash_proxy_dir="."):
+        from litex.build.openocd import OpenOCD
+        self.prog = OpenOCD(config, flash_proxy_basename=flash_proxy_basename)
+        self.prog.set_flash_proxy_dir(flash_proxy_dir)
+
+    def program(self, writes):
+        script = ["init", "jtagspi_init 0 {{{}}}".format(self.prog.find_flash_proxy())]
+        for address, filename in writes:
+            # jtagspi_program erases the sectors covered by the file then writes/verifies it.
+            script.append("jtagspi_program {{{}}} 0x{:x}".format(filename, address))
+        script += ["fpga_program", "exit"]
+        subprocess.run(["openocd", "-f", self.prog.config, "-c", "; ".join(script)], check=True)
+
+class RecordingFlasher:
+    """OpenOCD stand-in: records the erase/write commands instead of accessing the hardware."""
+    def __init__(self, sector_size, log=None):
+        self.sector_size = sector_size
+        self.log         = log
+        self.commands    = []
+
+    def program(self, writes):
+        commands = []
+        for address, filename in writes:
+            length = os.path.getsize(filename)
+            erase  = (length + self.sector_size - 1)//self.sector_size*self.sector_size
+            commands.append({"cmd": "erase", "address": address, "length": erase})
+            commands.append({"cmd": "write", "address": address, "length": length})
+        for command in commands:
+            print("[dry-run] {:5s} 0x{:08x} (0x{:08x} bytes)".format(
+                command["cmd"], command["address"], command["length"]))
+        self.commands += commands
+        if self.log is not None:
+            with open(self.log, "a") as f:
+                for command in commands:
+                    f.write(json.dumps(command) + "\n")
+
+# Delta flashing -----------------------------------------------------------------------------------
+
+def flash_images(flasher, regions, sector_size, manifest_file, full=False):
+    """Flash the images {filename: base} programming only the sectors that changed since the last
+    call recorded in manifest_file (or all of them when full). Returns the number of sectors
+    programmed."""
+    sectors = {} if full else load_manifest(manifest_file, sector_size)
+    total   = 0
+    runs    = [] # (address, filename, offset, length)
+    updates = {}
+    for filename, base in regions.items():
+        if base % sector_size:
+            raise ValueError("{} base 0x{:08x} is not sector aligned".format(filename, base))
+        hashes = get_sector_hashes(filename, sector_size)
+        total += len(hashes)
+        run = None
+        for n, h in enumerate(hashes):
+            address = base + n*sector_size
+            updates["0x{:08x}".format(address)] = h
+            if sectors.get("0x{:08x}".format(address)) == h:
+                run = None
+                continue
+            if run is None:
+                run = [address, filename, n*sector_size, 0]
+                runs.append(run)
+            run[3] += sector_size
+
+    programmed = sum(run[3] for run in runs)//sector_size
+    print("Flashing {}/{} sectors in {} run(s)".format(programmed, total, len(runs)))
+    if runs:
+        with tempfile.TemporaryDirectory() as tmp:
+            writes = []
+            for n, (address, filename, offset, length) in enumerate(runs):
+                run_filename = os.path.join(tmp, "run{}.bin".format(n))
+                with open(filename, "rb") as fi, open(run_filename, "wb") as fo:
+                    fi.seek(offset)
+                    fo.write(fi.read(length))
+                print("Flashing {} [0x{:08x}:0x{:08x}] at 0x{:08x}".format(
+                    filename, offset, offset + os.path.getsize(run_filename), address))
+                writes.append((address, run_filename))
+            flasher.program(writes)
+    # Only record the new Flash content once programmed successfully.
+    sectors.update(updates)
+    save_manifest(manifest_file, sector_size, sectors)
+    return programmed
@@ -1,23 +1,41 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import json
+import struct
 import argparse
 
-parser = argparse.ArgumentParser(description="LiteX's CSR JSON to Linux DTS generator")
-parser.add_argument("csr_json", help="CSR JSON file")
-args = parser.parse_args()
-
-d = json.load(open(args.csr_json))
-
 kB = 1024
 mB = kB*1024
 
-aliases = {}
+# Helpers ------------------------------------------------------------------------------------------
+
+def add_clkout(clkout_nr, clk_f, clk_p, clk_dn, clk_dd, clk_margin, clk_margin_exp):
+
+	return """	CLKOUT{clkout_nr}: CLKOUT{clkout_nr} {{
+				compatible = "litex,clk";
+				#clock-cells =	<0>;
+				clock-output-names = "CLKOUT{clkout_nr}";
+				reg = <{clkout_nr}>;
+				litex,clock-frequency = <{clk_f}>;
+				litex,clock-phase = <{clk_p}>;
+				litex,clock-duty-num = <{clk_dn}>;
+				litex,clock-duty-den = <{clk_dd}>;
+				litex,clock-margin = <{clk_margin}>;
+				litex,clock-margin-exp = <{clk_margin_exp}>;
+			}};
+		""".format(clkout_nr=clkout_nr, clk_f=clk_f, clk_p=clk_p, clk_dn=clk_dn, clk_dd=clk_dd, clk_margin=clk_margin, clk_margin_exp=clk_margin_exp)
+
+# DTS generation -----------------------------------------------------------------------------------
+
+def generate_dts(d, initrd=None):
 
-# Header -------------------------------------------------------------------------------------------
+	aliases = {}
 
-dts = """
+	# Header -------------------------------------------------------------------------------------------
+
+	dts = """
 /dts-v1/;
 
 / {
@@ -27,25 +45,28 @@ dts = """
 	model = "VexRiscv SoCLinux";
 """
 
-# Boot Arguments -----------------------------------------------------------------------------------
+	# Boot Arguments -----------------------------------------------------------------------------------
+
+	# Initrd location: (offset, size) from the RAM layout (default: BIOS region, 8MB..16MB).
+	initrd_offset, initrd_size = (8*mB, 8*mB) if initrd is None else initrd
 
-dts += """
+	dts += """
 	chosen {{
 		bootargs = "mem={main_ram_size_mb}M@0x{main_ram_base:x} rootwait console=liteuart earlycon=sbi root=/dev/ram0 init=/sbin/init swiotlb=32";
 		linux,initrd-start = <0x{linux_initrd_start:x}>;
 		linux,initrd-end   = <0x{linux_initrd_end:x}>;
 	}};
 """.format(
-		main_ram_base=d["memories"]["main_ram"]["base"],
-		main_ram_size=d["memories"]["main_ram"]["size"],
-		main_ram_size_mb=d["memories"]["main_ram"]["size"]//mB,
+			main_ram_base=d["memories"]["main_ram"]["base"],
+			main_ram_size=d["memories"]["main_ram"]["size"],
+			main_ram_size_mb=d["memories"]["main_ram"]["size"]//mB,
 
-		linux_initrd_start=d["memories"]["main_ram"]["base"] + 8*mB,
-		linux_initrd_end=d["memories"]["main_ram"]["base"] + 16*mB)
+			linux_initrd_start=d["memories"]["main_ram"]["base"] + initrd_offset,
+			linux_initrd_end=d["memories"]["main_ram"]["base"] + initrd_offset + initrd_size)
 
-# CPU ----------------------------------------------------------------------------------------------
+	# CPU ----------------------------------------------------------------------------------------------
 
-dts += """
+	dts += """
 	cpus {{
 		#address-cells = <0x1>;
 		#size-cells = <0x0>;
@@ -75,19 +96,19 @@ dts += """
 	}};
 """.format(sys_clk_freq=int(50e6) if "sim" in d["constants"] else d["constants"]["config_clock_frequency"])
 
-# Memory -------------------------------------------------------------------------------------------
+	# Memory -------------------------------------------------------------------------------------------
 
-dts += """
+	dts += """
 	memory@{main_ram_base:x} {{
 		device_type = "memory";
 		reg = <0x0 0x{main_ram_base:x} 0x1 0x{main_ram_size:x}>;
 	}};
 """.format(main_ram_base=d["memories"]["main_ram"]["base"],
-		   main_ram_size=d["memories"]["main_ram"]["size"])
+			   main_ram_size=d["memories"]["main_ram"]["size"])
 
-# SoC ----------------------------------------------------------------------------------------------
+	# SoC ----------------------------------------------------------------------------------------------
 
-dts += """
+	dts += """
 	soc {
 		#address-cells = <0x2>;
 		#size-cells = <0x2>;
@@ -95,9 +116,9 @@ dts += """
 		ranges;
 """
 
-# Interrupt controller
+	# Interrupt controller
 
-dts += """
+	dts += """
 		intc0: interrupt-controller {
 			interrupt-controller;
 			#interrupt-cells = <1>;
@@ -106,9 +127,9 @@ dts += """
 		};
 """
 
-	# SoC Controller -----------------------------------------------------------------------------------
+		# SoC Controller -----------------------------------------------------------------------------------
 
-dts += """
+	dts += """
 		soc_ctrl0: soc_controller@{soc_ctrl_csr_base:x} {{
 			compatible = "litex,soc_controller";
 			reg = <0x0 0x{soc_ctrl_csr_base:x} 0x0 0xc>;
@@ -116,11 +137,11 @@ dts += """
 		}};
 	""".format(soc_ctrl_csr_base=d["csr_bases"]["ctrl"])
 
-	# UART -----------------------------------------------------------------------------------------
+		# UART -----------------------------------------------------------------------------------------
 
-if "uart" in d["csr_bases"]:
-	aliases["serial0"] = "liteuart0"
-	dts += """
+	if "uart" in d["csr_bases"]:
+		aliases["serial0"] = "liteuart0"
+		dts += """
 		liteuart0: serial@{uart_csr_base:x} {{
 			device_type = "serial";
 			compatible = "litex,liteuart";
@@ -129,12 +150,12 @@ if "uart" in d["csr_bases"]:
 		}};
 	""".format(uart_csr_base=d["csr_bases"]["uart"])
 
-	# Ethernet MAC ---------------------------------------------------------------------------------
-if "ethphy" in d["csr_bases"] and "ethmac" not in d["csr_bases"]:
-		pass
+		# Ethernet MAC ---------------------------------------------------------------------------------
+	if "ethphy" in d["csr_bases"] and "ethmac" not in d["csr_bases"]:
+			pass
 
-if "ethphy" in d["csr_bases"] and "ethmac" in d["csr_bases"]:
-	dts += """
+	if "ethphy" in d["csr_bases"] and "ethmac" in d["csr_bases"]:
+		dts += """
 		mac0: mac@{ethmac_csr_base:x} {{
 			compatible = "litex,liteeth";
 			reg = <0x0 0x{ethmac_csr_base:x} 0x0 0x7c
@@ -144,15 +165,15 @@ if "ethphy" in d["csr_bases"] and "ethmac" in d["csr_bases"]:
 			rx-fifo-depth = <{ethmac_rx_slots}>;
 		}};
 	""".format(ethphy_csr_base=d["csr_bases"]["ethphy"],
-			   ethmac_csr_base=d["csr_bases"]["ethmac"],
-			   ethmac_mem_base=d["memories"]["ethmac"]["base"],
-			   ethmac_tx_slots=d["constants"]["ethmac_tx_slots"],
-			   ethmac_rx_slots=d["constants"]["ethmac_rx_slots"])
+				   ethmac_csr_base=d["csr_bases"]["ethmac"],
+				   ethmac_mem_base=d["memories"]["ethmac"]["base"],
+				   ethmac_tx_slots=d["constants"]["ethmac_tx_slots"],
+				   ethmac_rx_slots=d["constants"]["ethmac_rx_slots"])
 
-	# Leds -----------------------------------------------------------------------------------------
+		# Leds -----------------------------------------------------------------------------------------
 
-if "leds" in d["csr_bases"]:
-	dts += """
+	if "leds" in d["csr_bases"]:
+		dts += """
 		leds: gpio@{leds_csr_base:x} {{
 			compatible = "litex,gpio";
 			reg = <0x0 0x{leds_csr_base:x} 0x0 0x4>;
@@ -161,11 +182,11 @@ if "leds" in d["csr_bases"]:
 		}};
 	""".format(leds_csr_base=d["csr_bases"]["leds"])
 
-	# RGB Led --------------------------------------------------------------------------------------
+		# RGB Led --------------------------------------------------------------------------------------
 
-for name in ["rgb_led_r0", "rgb_led_g0", "rgb_led_b0"]:
-	if name in d["csr_bases"]:
-		dts += """
+	for name in ["rgb_led_r0", "rgb_led_g0", "rgb_led_b0"]:
+		if name in d["csr_bases"]:
+			dts += """
 		{pwm_name}: pwm@{pwm_csr_base:x} {{
 			compatible = "litex,pwm";
 			reg = <0x0 0x{pwm_csr_base:x} 0x0 0x24>;
@@ -174,12 +195,12 @@ for name in ["rgb_led_r0", "rgb_led_g0", "rgb_led_b0"]:
 			status = "okay";
 		}};
 	""".format(pwm_name=name,
-			   pwm_csr_base=d["csr_bases"][name])
+				   pwm_csr_base=d["csr_bases"][name])
 
-	# Switches -------------------------------------------------------------------------------------
+		# Switches -------------------------------------------------------------------------------------
 
-if "switches" in d["csr_bases"]:
-	dts += """
+	if "switches" in d["csr_bases"]:
+		dts += """
 		switches: gpio@{switches_csr_base:x} {{
 			compatible = "litex,gpio";
 			reg = <0x0 0x{switches_csr_base:x} 0x0 0x4>;
@@ -188,12 +209,12 @@ if "switches" in d["csr_bases"]:
 		}};
 	""".format(switches_csr_base=d["csr_bases"]["switches"])
 
-	# SPI ------------------------------------------------------------------------------------------
+		# SPI ------------------------------------------------------------------------------------------
 
-if "spi" in d["csr_bases"]:
-	aliases["spi0"] = "litespi0"
+	if "spi" in d["csr_bases"]:
+		aliases["spi0"] = "litespi0"
 
-	dts += """
+		dts += """
 		litespi0: spi@{spi_csr_base:x} {{
 			compatible = "litex,litespi";
 			reg = <0x0 0x{spi_csr_base:x} 0x0 0x100>;
@@ -215,12 +236,12 @@ if "spi" in d["csr_bases"]:
 		}};
 	""".format(spi_csr_base=d["csr_bases"]["spi"])
 
-	# SPIFLASH ---------------------------------------------------------------------------------------
+		# SPIFLASH ---------------------------------------------------------------------------------------
 
-if "spiflash" in d["csr_bases"]:
-	aliases["spiflash"] = "litespiflash"
+	if "spiflash" in d["csr_bases"]:
+		aliases["spiflash"] = "litespiflash"
 
-	dts += """
+		dts += """
 		litespiflash: spiflash@{spiflash_csr_base:x} {{
 			compatible = "litex,spiflash";
 			reg = <0x0 0x{spiflash_csr_base:x} 0x0 0x100>;
@@ -232,13 +253,13 @@ if "spiflash" in d["csr_bases"]:
 		}};
 	""".format(spiflash_csr_base=d["csr_bases"]["spiflash"], spiflash_size=d["memories"]["spiflash"]["size"])
 
-	# SPISDCARD ------------------------------------------------------------------------------------
+		# SPISDCARD ------------------------------------------------------------------------------------
 
-if False: # FIXME: Disable it for now.
-#if "spisdcard" in d["csr_bases"]:
-	aliases["sdcard0"] = "litespisdcard0"
+	if False: # FIXME: Disable it for now.
+	#if "spisdcard" in d["csr_bases"]:
+		aliases["sdcard0"] = "litespisdcard0"
 
-	dts += """
+		dts += """
 		litespisdcard0: spi@{spisdcard_csr_base:x} {{
 			compatible = "litex,litespi";
 			reg = <0x0 0x{spisdcard_csr_base:x} 0x0 0x100>;
@@ -257,10 +278,10 @@ if False: # FIXME: Disable it for now.
 		}};
 	""".format(spisdcard_csr_base=d["csr_bases"]["spisdcard"])
 
-	# I2C ------------------------------------------------------------------------------------------
+		# I2C ------------------------------------------------------------------------------------------
 
-if "i2c0" in d["csr_bases"]:
-	dts += """
+	if "i2c0" in d["csr_bases"]:
+		dts += """
 		i2c0: i2c@{i2c0_csr_base:x} {{
 			compatible = "litex,i2c";
 			reg = <0x0 0x{i2c0_csr_base:x} 0x0 0x5>;
@@ -268,10 +289,10 @@ if "i2c0" in d["csr_bases"]:
 		}};
 """.format(i2c0_csr_base=d["csr_bases"]["i2c0"])
 
-	# XADC -----------------------------------------------------------------------------------------
+		# XADC -----------------------------------------------------------------------------------------
 
-if "xadc" in d["csr_bases"]:
-	dts += """
+	if "xadc" in d["csr_bases"]:
+		dts += """
 		hwmon0: xadc@{xadc_csr_base:x} {{
 			compatible = "litex,hwmon-xadc";
 			reg = <0x0 0x{xadc_csr_base:x} 0x0 0x20>;
@@ -279,30 +300,33 @@ if "xadc" in d["csr_bases"]:
 		}};
 """.format(xadc_csr_base=d["csr_bases"]["xadc"])
 
-	# Framebuffer ----------------------------------------------------------------------------------
+		# Framebuffer ----------------------------------------------------------------------------------
 
-if "framebuffer" in d["csr_bases"]:
-	# FIXME: dynamic framebuffer base and size
-	framebuffer_base   = 0xc8000000
-	framebuffer_width  = d["constants"]["litevideo_h_active"]
-	framebuffer_height = d["constants"]["litevideo_v_active"]
-	dts += """
+	if "framebuffer" in d["csr_bases"]:
+		# FIXME: dynamic framebuffer base and size
+		framebuffer_base   = 0xc8000000
+		framebuffer_width  = d["constants"]["litevideo_h_active"]
+		framebuffer_height = d["constants"]["litevideo_v_active"]
+		framebuffer_bpp    = d["constants"].get("litevideo_bpp", 32)
+		framebuffer_format = {32: "a8b8g8r8", 16: "r5g6b5"}[framebuffer_bpp]
+		dts += """
 		framebuffer0: framebuffer@f0000000 {{
 			compatible = "simple-framebuffer";
 			reg = <0x0 0x{framebuffer_base:x} 0x0 0x{framebuffer_size:x}>;
 			width = <{framebuffer_width}>;
 			height = <{framebuffer_height}>;
 			stride = <{framebuffer_stride}>;
-			format = "a8b8g8r8";
+			format = "{framebuffer_format}";
 		}};
 	""".format(framebuffer_base=framebuffer_base,
-			   framebuffer_width=framebuffer_width,
-			   framebuffer_height=framebuffer_height,
-			   framebuffer_size=framebuffer_width*framebuffer_height*4,
-			   framebuffer_stride=framebuffer_width*4)
+				   framebuffer_width=framebuffer_width,
+				   framebuffer_height=framebuffer_height,
+				   framebuffer_format=framebuffer_format,
+				   framebuffer_size=framebuffer_width*framebuffer_height*framebuffer_bpp//8,
+				   framebuffer_stride=framebuffer_width*framebuffer_bpp//8)
 
-	dma_offset = framebuffer_base - d["memories"]["main_ram"]["base"]
-	dts += """
+		dma_offset = framebuffer_base - d["memories"]["main_ram"]["base"]
+		dts += """
 		litevideo0: gpu@{litevideo_base:x} {{
 			compatible = "litex,litevideo";
 			reg = <0x0 0x{litevideo_base:x} 0x0 0x100>;
@@ -319,22 +343,22 @@ if "framebuffer" in d["csr_bases"]:
 			litevideo,dma-length = <0x{litevideo_dma_length:x}>;
 		}};
 	""".format(litevideo_base=d["csr_bases"]["framebuffer"],
-			   litevideo_pixel_clock=int(d["constants"]["litevideo_pix_clk"] / 1e3),
-			   litevideo_h_active=d["constants"]["litevideo_h_active"],
-			   litevideo_h_blanking=d["constants"]["litevideo_h_blanking"],
-			   litevideo_h_sync=d["constants"]["litevideo_h_sync"],
-			   litevideo_h_front_porch=d["constants"]["litevideo_h_front_porch"],
-			   litevideo_v_active=d["constants"]["litevideo_v_active"],
-			   litevideo_v_blanking=d["constants"]["litevideo_v_blanking"],
-			   litevideo_v_sync=d["constants"]["litevideo_v_sync"],
-			   litevideo_v_front_porch=d["constants"]["litevideo_v_front_porch"],
-			   litevideo_dma_offset=dma_offset,
-			   litevideo_dma_length=4*framebuffer_width*framebuffer_height)
-
-	#·ICAPBitstream --------------------------------------------------------------------------------
-
-if "icap_bit" in d["csr_bases"]:
-	dts += """
+				   litevideo_pixel_clock=int(d["constants"]["litevideo_pix_clk"] / 1e3),
+				   litevideo_h_active=d["constants"]["litevideo_h_active"],
+				   litevideo_h_blanking=d["constants"]["litevideo_h_blanking"],
+				   litevideo_h_sync=d["constants"]["litevideo_h_sync"],
+				   litevideo_h_front_porch=d["constants"]["litevideo_h_front_porch"],
+				   litevideo_v_active=d["constants"]["litevideo_v_active"],
+				   litevideo_v_blanking=d["constants"]["litevideo_v_blanking"],
+				   litevideo_v_sync=d["constants"]["litevideo_v_sync"],
+				   litevideo_v_front_porch=d["constants"]["litevideo_v_front_porch"],
+				   litevideo_dma_offset=dma_offset,
+				   litevideo_dma_length=framebuffer_width*framebuffer_height*framebuffer_bpp//8)
+
+		#·ICAPBitstream --------------------------------------------------------------------------------
+
+	if "icap_bit" in d["csr_bases"]:
+		dts += """
 		fpga0: icap@{icap_csr_base:x} {{
 			compatible = "litex,fpga-icap";
 			reg = <0x0 0x{icap_csr_base:x} 0x0 0x14>;
@@ -342,42 +366,26 @@ if "icap_bit" in d["csr_bases"]:
 		}};
 """.format(icap_csr_base=d["csr_bases"]["icap_bit"])
 
-	# CLK ----------------------------------------------------------------------------------
-
-def add_clkout(clkout_nr, clk_f, clk_p, clk_dn, clk_dd, clk_margin, clk_margin_exp):
-
-	return """	CLKOUT{clkout_nr}: CLKOUT{clkout_nr} {{
-				compatible = "litex,clk";
-				#clock-cells =	<0>;
-				clock-output-names = "CLKOUT{clkout_nr}";
-				reg = <{clkout_nr}>;
-				litex,clock-frequency = <{clk_f}>;
-				litex,clock-phase = <{clk_p}>;
-				litex,clock-duty-num = <{clk_dn}>;
-				litex,clock-duty-den = <{clk_dd}>;
-				litex,clock-margin = <{clk_margin}>;
-				litex,clock-margin-exp = <{clk_margin_exp}>;
-			}};
-		""".format(clkout_nr=clkout_nr, clk_f=clk_f, clk_p=clk_p, clk_dn=clk_dn, clk_dd=clk_dd, clk_margin=clk_margin, clk_margin_exp=clk_margin_exp)
-
-if "mmcm" in d["csr_bases"]:
-	nclkout = d["constants"]["nclkout"]
-	clkout_def_freq = d["constants"]["clkout_def_freq"]
-	clkout_def_phase = d["constants"]["clkout_def_phase"]
-	clkout_def_duty_num = d["constants"]["clkout_def_duty_num"]
-	clkout_def_duty_den = d["constants"]["clkout_def_duty_den"]
-	clkout_margin = d["constants"]["clkout_margin"]
-	clkout_margin_exp = d["constants"]["clkout_margin_exp"]
-	mmcm_lock_timeout = d["constants"]["mmcm_lock_timeout"]
-	mmcm_drdy_timeout = d["constants"]["mmcm_drdy_timeout"]
-	sys_clk = d["constants"]["config_clock_frequency"]
-	divclk_divide_range = (d["constants"]["divclk_divide_range_min"], d["constants"]["divclk_divide_range_max"])
-	clkfbout_mult_frange = (d["constants"]["clkfbout_mult_frange_min"], d["constants"]["clkfbout_mult_frange_max"])
-	vco_freq_range = (d["constants"]["vco_freq_range_min"], d["constants"]["vco_freq_range_max"])
-	clkout_divide_range = (d["constants"]["clkout_divide_range_min"], d["constants"]["clkout_divide_range_max"])
-	vco_margin = d["constants"]["vco_margin"]
+		# CLK ----------------------------------------------------------------------------------
+
+	if "mmcm" in d["csr_bases"]:
+		nclkout = d["constants"]["nclkout"]
+		clkout_def_freq = d["constants"]["clkout_def_freq"]
+		clkout_def_phase = d["constants"]["clkout_def_phase"]
+		clkout_def_duty_num = d["constants"]["clkout_def_duty_num"]
+		clkout_def_duty_den = d["constants"]["clkout_def_duty_den"]
+		clkout_margin = d["constants"]["clkout_margin"]
+		clkout_margin_exp = d["constants"]["clkout_margin_exp"]
+		mmcm_lock_timeout = d["constants"]["mmcm_lock_timeout"]
+		mmcm_drdy_timeout = d["constants"]["mmcm_drdy_timeout"]
+		sys_clk = d["constants"]["config_clock_frequency"]
+		divclk_divide_range = (d["constants"]["divclk_divide_range_min"], d["constants"]["divclk_divide_range_max"])
+		clkfbout_mult_frange = (d["constants"]["clkfbout_mult_frange_min"], d["constants"]["clkfbout_mult_frange_max"])
+		vco_freq_range = (d["constants"]["vco_freq_range_min"], d["constants"]["vco_freq_range_max"])
+		clkout_divide_range = (d["constants"]["clkout_divide_range_min"], d["constants"]["clkout_divide_range_max"])
+		vco_margin = d["constants"]["vco_margin"]
 
-	dts += """
+		dts += """
 		clk0: clk@{mmcm_csr_base:x} {{
 			compatible = "litex,clk";
 			reg = <0x0 0x{mmcm_csr_base:x} 0x0 0x100>;
@@ -386,12 +394,12 @@ if "mmcm" in d["csr_bases"]:
 			#size-cells = <0>;
 			clock-output-names =
 """.format(mmcm_csr_base = d["csr_bases"]["mmcm"])
-	for clkout_nr in range(nclkout-1):
-		dts += """					"CLKOUT{clkout_nr}",
+		for clkout_nr in range(nclkout-1):
+			dts += """					"CLKOUT{clkout_nr}",
 """.format(clkout_nr = clkout_nr)
-	dts += """					"CLKOUT{nclkout}";
+		dts += """					"CLKOUT{nclkout}";
 """.format(nclkout = (nclkout - 1))
-	dts += """
+		dts += """
 			litex,lock-timeout = <{mmcm_lock_timeout}>;
 			litex,drdy-timeout = <{mmcm_drdy_timeout}>;
 			litex,sys-clock-frequency = <{sys_clk}>;
@@ -406,56 +414,448 @@ if "mmcm" in d["csr_bases"]:
 			litex,vco-margin = <{vco_margin}>;
 
 		""".format(mmcm_lock_timeout = mmcm_lock_timeout,
-			   mmcm_drdy_timeout = mmcm_drdy_timeout,
-			   sys_clk = sys_clk,
-			   divclk_divide_range = divclk_divide_range,
-			   clkfbout_mult_frange = clkfbout_mult_frange,
-			   vco_freq_range = vco_freq_range,
-			   clkout_divide_range = clkout_divide_range,
-			   vco_margin = vco_margin)
-	for clkout_nr in range(nclkout):
-		dts += add_clkout(clkout_nr, clkout_def_freq, clkout_def_phase,
-				  clkout_def_duty_num, clkout_def_duty_den,
-				  clkout_margin, clkout_margin_exp)
-	dts += """
+				   mmcm_drdy_timeout = mmcm_drdy_timeout,
+				   sys_clk = sys_clk,
+				   divclk_divide_range = divclk_divide_range,
+				   clkfbout_mult_frange = clkfbout_mult_frange,
+				   vco_freq_range = vco_freq_range,
+				   clkout_divide_range = clkout_divide_range,
+				   vco_margin = vco_margin)
+		for clkout_nr in range(nclkout):
+			dts += add_clkout(clkout_nr, clkout_def_freq, clkout_def_phase,
+					  clkout_def_duty_num, clkout_def_duty_den,
+					  clkout_margin, clkout_margin_exp)
+		dts += """
 		};"""
-dts += """
+	dts += """
 	};"""
 
-# Aliases -----------------------------------------------------------------------------------------
+	# Aliases -----------------------------------------------------------------------------------------
 
-if aliases:
-	dts += """
+	if aliases:
+		dts += """
 	aliases {
 """
-	for alias in aliases:
-		dts += """
+		for alias in aliases:
+			dts += """
 	   {} = &{};
 """.format(alias, aliases[alias])
-	dts += """
+		dts += """
 	};
 """
 
-dts += """
+	dts += """
 };
 """
 
-# --------------------------------------------------------------------------------------------------
+	# --------------------------------------------------------------------------------------------------
 
-if "leds" in d["csr_bases"]:
-	dts += """
+	if "leds" in d["csr_bases"]:
+		dts += """
 &leds {
 	litex,ngpio = <4>;
 	status = "okay";
 };
 	"""
 
-if "switches" in d["csr_bases"]:
-	dts += """
+	if "switches" in d["csr_bases"]:
+		dts += """
 &switches {
 	litex,ngpio = <4>;
 	status = "okay";
 };
 	"""
 
-print(dts)
+	return dts
+
+# Device Tree model --------------------------------------------------------------------------------
+
+FDT_MAGIC             = 0xd00dfeed
+FDT_BEGIN_NODE        = 0x1
+FDT_END_NODE          = 0x2
+FDT_PROP              = 0x3
+FDT_END               = 0x9
+FDT_VERSION           = 17
+FDT_LAST_COMP_VERSION = 16
+
+class DTProperty:
+	def __init__(self, name, value=b"", refs=None):
+		self.name  = name
+		self.value = value      # Raw property bytes.
+		self.refs  = refs or [] # (offset, kind, target) with kind: "phandle" (placeholder cell) or "path".
+
+class DTNode:
+	def __init__(self, name, parent=None):
+		self.name       = name
+		self.parent     = parent
+		self.labels     = []
+		self.properties = []
+		self.children   = []
+		self.phandle    = None
+
+	@property
+	def path(self):
+		if self.parent is None:
+			return "/"
+		return self.parent.path.rstrip("/") + "/" + self.name
+
+	def get_property(self, name):
+		for prop in self.properties:
+			if prop.name == name:
+				return prop
+		return None
+
+	def set_property(self, prop):
+		# Like dtc when merging nodes: existing properties are updated in place, new ones appended.
+		for i, p in enumerate(self.properties):
+			if p.name == prop.name:
+				self.properties[i] = prop
+				return
+		self.properties.append(prop)
+
+	def get_child(self, name):
+		for child in self.children:
+			if child.name == name:
+				return child
+		child = DTNode(name, self)
+		self.children.append(child)
+		return child
+
+	def walk(self):
+		yield self
+		for child in self.children:
+			yield from child.walk()
+
+class DeviceTree:
+	"""Device tree node model, built from DTS text and serialized to a flattened device tree.
+
+	Supports the DTS subset used by json2dts (memory reservations, nodes, labels, strings, cells, byte
+	strings, phandle and path references, &label overrides). The blob matches the output of
+	`dtc -O dtb` for the same input.
+	"""
+	def __init__(self, dts):
+		self.root       = DTNode("")
+		self.memreserve = [] # (address, size).
+		self._dts = dts
+		self._pos = 0
+		self._parse()
+
+	# Parser ---------------------------------------------------------------------------------------
+
+	_name_chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789,._+*#?@-"
+
+	def _error(self, msg):
+		line = self._dts.count("\n", 0, self._pos) + 1
+		raise ValueError("DTS parse error line {}: {}".format(line, msg))
+
+	def _skip(self):
+		while self._pos < len(self._dts):
+			if self._dts[self._pos].isspace():
+				self._pos += 1
+			elif self._dts.startswith("//", self._pos):
+				end = self._dts.find("\n", self._pos)
+				self._pos = len(self._dts) if end < 0 else end
+			elif self._dts.startswith("/*", self._pos):
+				end = self._dts.find("*/", self._pos)
+				if end < 0:
+					self._error("unterminated comment")
+				self._pos = end + 2
+			else:
+				break
+
+	def _peek(self):
+		self._skip()
+		return self._dts[self._pos:self._pos+1]
+
+	def _expect(self, s):
+		self._skip()
+		if not self._dts.startswith(s, self._pos):
+			self._error("expected '{}'".format(s))
+		self._pos += len(s)
+
+	def _read_name(self):
+		self._skip()
+		start = self._pos
+		while self._pos < len(self._dts) and self._dts[self._pos] in self._name_chars:
+			self._pos += 1
+		if start == self._pos:
+			self._error("expected a name")
+		return self._dts[start:self._pos]
+
+	def _read_reference(self):
+		self._expect("&")
+		if self._dts.startswith("{", self._pos):
+			end = self._dts.index("}", self._pos)
+			path = self._dts[self._pos+1:end]
+			self._pos = end + 1
+			return path
+		return self._read_name()
+
+	def _read_string(self):
+		self._expect("\"")
+		data = bytearray()
+		escapes = {"a": 7, "b": 8, "t": 9, "n": 10, "v": 11, "f": 12, "r": 13}
+		while True:
+			if self._pos >= len(self._dts):
+				self._error("unterminated string")
+			c = self._dts[self._pos]
+			self._pos += 1
+			if c == "\"":
+				break
+			if c != "\\":
+				data += c.encode()
+				continue
+			c = self._dts[self._pos]
+			self._pos += 1
+			if c in escapes:
+				data.append(escapes[c])
+			elif c == "x":
+				digits = ""
+				while len(digits) < 2 and self._dts[self._pos] in "0123456789abcdefABCDEF":
+					digits += self._dts[self._pos]
+					self._pos += 1
+				data.append(int(digits, 16))
+			elif c in "01234567":
+				digits = c
+				while len(digits) < 3 and self._dts[self._pos] in "01234567":
+					digits += self._dts[self._pos]
+					self._pos += 1
+				data.append(int(digits, 8))
+			else:
+				data += c.encode()
+		return bytes(data) + b"\0"
+
+	def _read_integer(self):
+		token = self._read_name().rstrip("ULul")
+		if token.lower().startswith("0x"):
+			return int(token, 16)
+		if len(token) > 1 and token.startswith("0"):
+			return int(token, 8)
+		return int(token, 10)
+
+	def _read_value(self, prop):
+		self._skip()
+		c = self._peek()
+		if c == "\"":
+			prop.value += self._read_string()
+		elif c == "<":
+			self._expect("<")
+			while self._peek() != ">":
+				if self._peek() == "&":
+					prop.refs.append((len(prop.value), "phandle", self._read_reference()))
+					prop.value += bytes(4)
+				elif self._peek() == "'":
+					prop.value += struct.pack(">I", ord(self._dts[self._pos+1]))
+					self._pos += 3
+				else:
+					prop.value += struct.pack(">I", self._read_integer() & 0xffffffff)
+			self._expect(">")
+		elif c == "[":
+			self._expect("[")
+			digits = ""
+			while self._peek() != "]":
+				digits += self._read_name()
+			self._expect("]")
+			prop.value += bytes.fromhex(digits)
+		elif c == "&":
+			prop.refs.append((len(prop.value), "path", self._read_reference()))
+		else:
+			self._error("unexpected property value")
+
+	def _parse_node_body(self, node):
+		self._expect("{")
+		while self._peek() != "}":
+			if self._peek() == "":
+				self._error("unterminated node")
+			labels = []
+			name   = self._read_name()
+			while self._dts.startswith(":", self._pos):
+				self._pos += 1
+				labels.append(name)
+				name = self._read_name()
+			c = self._peek()
+			if c == "{":
+				child = node.get_child(name)
+				child.labels += labels
+				self._parse_node_body(child)
+				self._expect(";")
+			else:
+				prop = DTProperty(name)
+				if c == "=":
+					self._expect("=")
+					self._read_value(prop)
+					while self._peek() == ",":
+						self._expect(",")
+						self._read_value(prop)
+				self._expect(";")
+				node.set_property(prop)
+		self._expect("}")
+
+	def _parse(self):
+		self._expect("/dts-v1/")
+		self._expect(";")
+		self._skip()
+		while self._dts.startswith("/memreserve/", self._pos):
+			self._expect("/memreserve/")
+			self.memreserve.append((self._read_integer(), self._read_integer()))
+			self._expect(";")
+			self._skip()
+		while self._peek() != "":
+			if self._peek() == "&":
+				self._parse_node_body(self.get_node(self._read_reference()))
+			else:
+				self._expect("/")
+				self._parse_node_body(self.root)
+			self._expect(";")
+
+	# Accessors ------------------------------------------------------------------------------------
+
+	def get_node(self, ref):
+		# Reference is either a label or a full path.
+		for node in self.root.walk():
+			if ref in node.labels or node.path == ref:
+				return node
+		raise ValueError("Reference to non-existent node or label '{}'".format(ref))
+
+	# FDT serialization ----------------------------------------------------------------------------
+
+	def _get_explicit_phandle(self, node):
+		prop = node.get_property("phandle")
+		return struct.unpack(">I", prop.value[:4])[0] if prop is not None else None
+
+	def _get_phandle(self, node):
+		if node.phandle is None:
+			node.phandle = self._get_explicit_phandle(node)
+		if node.phandle is None:
+			# Like dtc, skip the phandles already used (allocated or explicit, in any node).
+			used = {n.phandle or self._get_explicit_phandle(n) for n in self.root.walk()}
+			node.phandle = 1
+			while node.phandle in used:
+				node.phandle += 1
+			node.properties.append(DTProperty("phandle", struct.pack(">I", node.phandle)))
+		return node.phandle
+
+	def _resolve_references(self):
+		# Same order as dtc: phandles are allocated while walking the tree, then paths are inserted.
+		for node in self.root.walk():
+			for prop in node.properties:
+				for offset, kind, target in prop.refs:
+					if kind == "phandle":
+						phandle = self._get_phandle(self.get_node(target))
+						prop.value = prop.value[:offset] + struct.pack(">I", phandle) + prop.value[offset+4:]
+		for node in self.root.walk():
+			for prop in node.properties:
+				shift = 0
+				for offset, kind, target in prop.refs:
+					if kind == "path":
+						path = self.get_node(target).path.encode() + b"\0"
+						prop.value = prop.value[:offset+shift] + path + prop.value[offset+shift:]
+						shift += len(path)
+				prop.refs = []
+
+	def _get_boot_cpuid(self):
+		for node in self.root.children:
+			if node.name == "cpus" and node.children:
+				reg = node.children[0].get_property("reg")
+				if reg is not None and len(reg.value) == 4:
+					return struct.unpack(">I", reg.value)[0]
+		return 0
+
+	def to_dtb(self):
+		self._resolve_references()
+
+		dt_struct  = bytearray()
+		dt_strings = bytearray()
+
+		def align(data):
+			data += bytes(-len(data) % 4)
+
+		def string_offset(name):
+			# Like dtc, reuse any matching string (or string suffix) already in the table.
+			s = name.encode() + b"\0"
+			offset = dt_strings.find(s)
+			if offset < 0:
+				offset = len(dt_strings)
+				dt_strings.extend(s)
+			return offset
+
+		def flatten(node):
+			dt_struct.extend(struct.pack(">I", FDT_BEGIN_NODE))
+			dt_struct.extend(node.name.encode() + b"\0")
+			align(dt_struct)
+			for prop in node.properties:
+				dt_struct.extend(struct.pack(">III", FDT_PROP, len(prop.value), string_offset(prop.name)))
+				dt_struct.extend(prop.value)
+				align(dt_struct)
+			for child in node.children:
+				flatten(child)
+			dt_struct.extend(struct.pack(">I", FDT_END_NODE))
+
+		flatten(self.root)
+		dt_struct.extend(struct.pack(">I", FDT_END))
+
+		header_size     = 40
+		mem_rsvmap      = b"".join(struct.pack(">QQ", address, size) for address, size in self.memreserve)
+		mem_rsvmap     += bytes(16) # Terminating entry.
+		off_mem_rsvmap  = header_size
+		off_dt_struct   = off_mem_rsvmap + len(mem_rsvmap)
+		off_dt_strings  = off_dt_struct + len(dt_struct)
+		totalsize       = off_dt_strings + len(dt_strings)
+		header = struct.pack(">10I",
+			FDT_MAGIC,
+			totalsize,
+			off_dt_struct,
+			off_dt_strings,
+			off_mem_rsvmap,
+			FDT_VERSION,
+			FDT_LAST_COMP_VERSION,
+			self._get_boot_cpuid(),
+			len(dt_strings),
+			len(dt_struct))
+		return header + mem_rsvmap + bytes(dt_struct) + bytes(dt_strings)
+
+# DTB generation -----------------------------------------------------------------------------------
+
+def dts_to_dtb(dts):
+	return DeviceTree(dts).to_dtb()
+
+def generate_dtb(d):
+	return dts_to_dtb(generate_dts(d))
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="LiteX's CSR JSON to Linux DTS/DTB generator")
+	parser.add_argument("csr_json",  nargs="+",                              help="CSR JSON file(s)")
+	parser.add_argument("-o", "--output",                                    help="Output file (single CSR JSON file, default=stdout)")
+	parser.add_argument("--format",  default="dts", choices=["dts", "dtb"], help="Output format (dtb: flattened device tree, no dtc needed)")
+	args = parser.parse_args()
+
+	def generate(csr_json):
+		d = json.load(open(csr_json))
+		if args.format == "dtb":
+			return generate_dtb(d)
+		return (generate_dts(d) + "\n").encode()
+
+	# Single mode: csr.json --> stdout or --output.
+	if len(args.csr_json) == 1:
+		data = generate(args.csr_json[0])
+		if args.output is None:
+			sys.stdout.buffer.write(data)
+		else:
+			with open(args.output, "wb") as f:
+				f.write(data)
+		return
+
+	# Batch mode: build/<board>/csr.json --> build/<board>/<board>.dts (or .dtb), in a single process.
+	if args.output is not None:
+		parser.error("--output is only supported with a single CSR JSON file")
+	for csr_json in args.csr_json:
+		directory = os.path.dirname(os.path.abspath(csr_json))
+		filename  = os.path.join(directory, "{}.{}".format(os.path.basename(directory), args.format))
+		with open(filename, "wb") as f:
+			f.write(generate(csr_json))
+		print("{} --> {}".format(csr_json, filename))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+# Boot images layout planner, single source for the images json files, Board.flash regions, DTS
+# and emulator. Two policies: "fixed" (default) uses the offsets hardcoded in the LiteX BIOS
+# (flashboot/netboot), "packed" places the images from their actual sizes and passes the offsets
+# to the BIOS as *_IMAGE_*_OFFSET constants (only read by BIOSes that support them, see
+# bios_reads_layout_constants).
+
+kB = 1024
+mB = 1024*kB
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def align(value, alignment):
+    return (value + alignment - 1)//alignment*alignment
+
+# Flash layout -------------------------------------------------------------------------------------
+
+# FBI header: length (32-bit) + CRC32 (32-bit).
+fbi_header_size = 8
+
+# Images stored in SPI Flash: (BIOS constant prefix, image, fbi image, reserved size). Small images
+# with a fixed upper bound (the DTB and the emulator are built after the SoC) go first so that
+# growing the kernel/rootfs doesn't move them, the rootfs goes last so it can use the rest of the
+# Flash.
+def get_flash_images(images_dir="buildroot", emulator_dir="emulator", compressed=False):
+    if compressed:
+        kernel = os.path.join(images_dir, "Image.lz4")
+        rootfs = os.path.join(images_dir, "rootfs.cpio.gz")
+    else:
+        kernel = os.path.join("buildroot", "Image")
+        rootfs = os.path.join("buildroot", "rootfs.cpio")
+    return [
+        ("DEVICE_TREE", os.path.join(images_dir, "rv32.dtb"),       os.path.join(images_dir,   "rv32.dtb.fbi"),     64*kB),
+        ("EMULATOR",    os.path.join(emulator_dir, "emulator.bin"), os.path.join(emulator_dir, "emulator.bin.fbi"), 16*kB + fbi_header_size),
+        ("KERNEL",      kernel, os.path.join(images_dir, os.path.basename(kernel) + ".fbi"), None),
+        ("ROOTFS",      rootfs, os.path.join(images_dir, os.path.basename(rootfs) + ".fbi"), None),
+    ]
+
+# Fixed layout of the BIOS flashboot: {name: (offset, size)}.
+flash_fixed_layout = {
+    "KERNEL":      (0x00000000, 5*mB),
+    "ROOTFS":      (0x00500000, 8*mB),
+    "DEVICE_TREE": (0x00d00000, 1*mB),
+    "EMULATOR":    (0x00e00000, 1*mB),
+}
+
+# Sizes reserved for images not available yet (previous fixed layout).
+flash_default_sizes = {
+    "KERNEL": 5*mB,
+    "ROOTFS": 8*mB,
+}
+
+def plan_flash_layout(images, sector_size, flash_size=None, offset=0, policy="fixed"):
+    """Place the images in SPI Flash.
+
+    images is a list of (name, image, fbi image, reserved size). With the "fixed" policy, the
+    images use the BIOS regions; with "packed", they are packed on sector boundaries from offset:
+    the reserved size is used when set, the size of the fbi image otherwise. Returns the layout as
+    a list of regions (dicts with name, filename, offset and size).
+    """
+    if policy == "fixed":
+        regions = [{"name": name, "filename": filename, "offset": flash_fixed_layout[name][0],
+            "size": flash_fixed_layout[name][1]} for name, image, filename, size in images]
+        return sorted(regions, key=lambda region: region["offset"])
+    regions = []
+    for name, image, filename, size in images:
+        if size is None:
+            if os.path.exists(image):
+                size = os.path.getsize(image) + fbi_header_size
+            else:
+                size = flash_default_sizes[name]
+                print("{} not found, reserving 0x{:x} bytes in SPI Flash".format(image, size))
+        size = align(size, sector_size)
+        regions.append({"name": name, "filename": filename, "offset": offset, "size": size})
+        offset += size
+    if flash_size is not None and offset > flash_size:
+        raise ValueError("Images don't fit in SPI Flash: 0x{:08x} bytes needed, 0x{:08x} available".format(
+            offset, flash_size))
+    return regions
+
+def check_flash_layout(regions):
+    """Check the images still fit in the regions they were planned for (BIOS constants are only
+    updated when the SoC is rebuilt)."""
+    for region in regions:
+        size = os.path.getsize(region["filename"])
+        if size > region["size"]:
+            raise ValueError("{} (0x{:x} bytes) doesn't fit in its 0x{:x} bytes Flash region, rebuild the SoC".format(
+                region["filename"], size, region["size"]))
+
+def get_flash_regions(regions):
+    """{filename: offset} regions used by Board.flash."""
+    return {region["filename"]: region["offset"] for region in regions}
+
+def get_flash_constants(regions):
+    """BIOS constants: offsets of the images in SPI Flash."""
+    return {"{}_IMAGE_FLASH_OFFSET".format(region["name"]): region["offset"] for region in regions}
+
+def write_flash_layout(regions, filename):
+    with open(filename, "w") as f:
+        json.dump(regions, f, indent=4)
+
+def read_flash_layout(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def write_images_json(images, filename):
+    """images json file ({filename: address}) in the format of images.json/images.fbi.json.
+
+    The filenames are written relative to the directory of the json file (as resolved by
+    litex_term/read_images_json)."""
+    json_dir = os.path.dirname(filename) or "."
+    images   = {os.path.relpath(k, json_dir): v for k, v in images.items()}
+    with open(filename, "w") as f:
+        f.write("{\n")
+        width = max(len(k) for k in images) + 5
+        f.write(",\n".join("\t{:{}}\"0x{:08x}\"".format("\"{}\":".format(k), width, v) for k, v in images.items()))
+        f.write("\n}\n")
+
+def read_images_json(filename):
+    """{filename: address} of an images json file, filenames resolved from its directory."""
+    json_dir = os.path.dirname(filename)
+    with open(filename) as f:
+        return {os.path.normpath(os.path.join(json_dir, k)): int(v, 0) for k, v in json.load(f).items()}
+
+# RAM layout ---------------------------------------------------------------------------------------
+
+# Images loaded in RAM: (BIOS constant prefix, image, reserved size). The kernel runs from the base
+# of the RAM, its .bss/early allocations use the kernel margin after the Image. With compressed
+# images, the LZ4 kernel Image is loaded after this LINUX area and decompressed to it by the
+# emulator.
+def get_ram_images(images_dir="buildroot", emulator_dir="emulator", compressed=False):
+    if compressed:
+        kernel = [
+            ("LINUX",   os.path.join("buildroot", "Image"),           None),
+            ("KERNEL",  os.path.join(images_dir, "Image.lz4"),        None),
+            ("ROOTFS",  os.path.join(images_dir, "rootfs.cpio.gz"),   None),
+        ]
+    else:
+        kernel = [
+            ("KERNEL",  os.path.join("buildroot", "Image"),           None),
+            ("ROOTFS",  os.path.join("buildroot", "rootfs.cpio"),     None),
+        ]
+    return kernel + [
+        ("DEVICE_TREE", os.path.join(images_dir,   "rv32.dtb"),       64*kB),
+        ("EMULATOR",    os.path.join(emulator_dir, "emulator.bin"),   16*kB),
+    ]
+
+# Fixed layout of the BIOS flashboot/netboot: {name: (offset, size)}. With compressed images, the
+# LZ4 kernel is loaded at the base of the RAM and moved by the emulator before decompression.
+ram_fixed_layout = {
+    "KERNEL":      (0x00000000, 8*mB),
+    "ROOTFS":      (0x00800000, 8*mB),
+    "DEVICE_TREE": (0x01000000, 1*mB),
+    "EMULATOR":    (0x01100000, 16*kB),
+}
+
+# Sizes reserved for images not available yet (previous fixed layout).
+ram_default_sizes = {
+    "LINUX":  8*mB,
+    "KERNEL": 8*mB,
+    "ROOTFS": 8*mB,
+}
+
+def plan_ram_layout(images, ram_size=None, kernel_margin=1*mB, alignment=4*kB, policy="fixed"):
+    """Place the images in RAM (offsets from the RAM base).
+
+    images is a list of (name, image, reserved size). With the "fixed" policy, the images use the
+    BIOS regions (the LINUX area is the KERNEL region). With "packed", they are placed back to back
+    on alignment boundaries: the reserved size is used when set, the actual image size otherwise
+    (+ kernel_margin for the first one, the kernel running from the base of the RAM). Returns the
+    layout as a list of regions (dicts with name, filename, offset, size, image_size and load:
+    False for the LINUX area that is not loaded but decompressed).
+    """
+    regions = []
+    offset  = 0
+    if policy == "fixed":
+        for name, image, size in images:
+            if name not in ram_fixed_layout:
+                continue
+            offset, size = ram_fixed_layout[name]
+            image_size = os.path.getsize(image) if os.path.exists(image) else size
+            if image_size > size:
+                raise ValueError("{} (0x{:x} bytes) doesn't fit in its 0x{:x} bytes BIOS RAM region, "
+                    "use the packed layout".format(image, image_size, size))
+            regions.append({
+                "name":       name,
+                "filename":   image,
+                "offset":     offset,
+                "size":       size,
+                "image_size": image_size,
+                "load":       True,
+            })
+        if ram_size is not None:
+            check_ram_layout(regions, ram_size)
+        return regions
+    for name, image, size in images:
+        if size is None:
+            if os.path.exists(image):
+                size = os.path.getsize(image)
+                image_size = size
+                if offset == 0:
+                    size += kernel_margin
+            else:
+                size = ram_default_sizes[name]
+                image_size = size
+                print("{} not found, reserving 0x{:x} bytes in RAM".format(image, size))
+        else:
+            image_size = size
+        regions.append({
+            "name":       name,
+            "filename":   image,
+            "offset":     offset,
+            "size":       align(size, alignment),
+            "image_size": image_size,
+            "load":       name != "LINUX",
+        })
+        offset += align(size, alignment)
+    if ram_size is not None:
+        check_ram_layout(regions, ram_size)
+    return regions
+
+def check_ram_layout(regions, ram_size):
+    end = max(region["offset"] + region["size"] for region in regions)
+    if end > ram_size:
+        raise ValueError("Images don't fit in RAM: 0x{:08x} bytes needed, 0x{:08x} available".format(
+            end, ram_size))
+
+def get_ram_region(regions, name):
+    for region in regions:
+        if region["name"] == name:
+            return region
+    raise KeyError(name)
+
+def get_ram_constants(regions):
+    """Boot constants: offsets of the images in RAM."""
+    return {"{}_IMAGE_RAM_OFFSET".format(region["name"]): region["offset"] for region in regions}
+
+def get_initrd(regions):
+    """(offset, size) of the initrd in RAM (DTS chosen node)."""
+    rootfs = get_ram_region(regions, "ROOTFS")
+    return rootfs["offset"], rootfs["image_size"]
+
+def bios_reads_layout_constants():
+    """Whether the installed LiteX BIOS takes the *_IMAGE_*_OFFSET constants from soc.h (the
+    BIOS of older LiteX versions defines its own fixed offsets)."""
+    import importlib.util
+    spec = importlib.util.find_spec("litex")
+    if spec is None or spec.origin is None:
+        return False
+    boot_c = os.path.join(os.path.dirname(spec.origin), "soc", "software", "bios", "boot.c")
+    try:
+        with open(boot_c) as f:
+            src = f.read()
+    except OSError:
+        return False
+    return "#ifndef KERNEL_IMAGE_FLASH_OFFSET" in src
+
+def get_ram_images_map(regions, base=0):
+    """{filename: address} of the images to load (images.json)."""
+    return {region["filename"]: base + region["offset"] for region in regions if region["load"]}
+
+def get_mem_map(regions):
+    """{filename: offset} map of the images (sim RAM initialization)."""
+    return {k: "0x{:08x}".format(v) for k, v in get_ram_images_map(regions).items()}
@@ -3,56 +3,138 @@
 import sys
 import argparse
 import os
-
-from litex.soc.integration.builder import Builder
-
-from soc_linux import SoCLinux, video_resolutions
+import json
+import time
+import errno
+import tempfile
+import hashlib
+import importlib
+import subprocess
+import traceback
+
+from fbi import generate_fbis
+from layout import get_flash_images, plan_flash_layout, check_flash_layout, get_flash_regions
+from layout import get_flash_constants, write_flash_layout, read_flash_layout, write_images_json
+from layout import get_ram_images, plan_ram_layout, get_ram_images_map, get_initrd, bios_reads_layout_constants
+from layout import get_ram_constants
+from compress import compress_images
+from software import generate_dts, compile_dts, compile_emulator
 
 kB = 1024
+mB = 1024*kB
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def load_svf(bitstream, command, chunk_size=64*1024):
+    # Convert the bitstream to SVF on the fly and stream it to the programmer: through a FIFO when
+    # command has a {svf} placeholder, through its stdin otherwise. JTAG shifting starts with the
+    # first generated rows and no intermediate SVF file is written.
+    from prog.bit_to_svf import generate_svf
+    svf = generate_svf(bitstream, chunk_size=chunk_size)
+    with tempfile.TemporaryDirectory() as tmp:
+        if "{svf}" in command:
+            fifo = os.path.join(tmp, "top.svf")
+            os.mkfifo(fifo)
+            p = subprocess.Popen(command.format(svf=fifo), shell=True)
+            # Wait for the programmer to open the FIFO (or to exit on error).
+            while True:
+                try:
+                    fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+                    break
+                except OSError as e:
+                    if e.errno != errno.ENXIO:
+                        raise
+                    if p.poll() is not None:
+                        return p.returncode
+                    time.sleep(0.01)
+            os.set_blocking(fd, True)
+            f = os.fdopen(fd, "w")
+        else:
+            p = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, universal_newlines=True)
+            f = p.stdin
+        try:
+            with f:
+                for chunk in svf:
+                    f.write(chunk)
+        except BrokenPipeError:
+            pass # Programmer exited early, report its return code.
+        return p.wait()
+
+def get_third_party(name, url, branch, third_party_dir=os.path.join("build", "third_party")):
+    # Cloned once: later builds reuse the checkout.
+    path = os.path.join(third_party_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(third_party_dir, exist_ok=True)
+        subprocess.check_call(["git", "clone", url, "-b", branch, path + ".tmp"])
+        os.rename(path + ".tmp", path)
+    return os.path.abspath(path)
 
 # Board definition----------------------------------------------------------------------------------
 
 class Board:
-    def __init__(self, soc_cls, soc_capabilities):
-        self.soc_cls = soc_cls
-        self.soc_capabilities = soc_capabilities
+    soc_target       = None      # Module of litex_boards.targets.
+    soc_name         = "BaseSoC" # SoC class of the target.
+    soc_capabilities = set()
+    programmer       = None      # Used by load().
+
+    @property
+    def soc_cls_name(self):
+        return "litex_boards.targets.{}.{}".format(self.soc_target, self.soc_name)
+
+    @property
+    def soc_cls(self):
+        # Imported on use: the boards registry (--help, --list-boards, --describe) doesn't import LiteX.
+        return getattr(importlib.import_module("litex_boards.targets." + self.soc_target), self.soc_name)
+
+    def describe(self):
+        description = {
+            "soc_cls":          self.soc_cls_name,
+            "soc_capabilities": sorted(self.soc_capabilities),
+            "programmer":       self.programmer,
+            "spiflash":         None,
+        }
+        if "framebuffer" in self.soc_capabilities:
+            description["video_max_pix_clk"] = getattr(self, "VIDEO_MAX_PIX_CLK", None)
+        if "spiflash" in self.soc_capabilities:
+            description["spiflash"] = {
+                "size":         getattr(self, "SPIFLASH_SIZE", None),
+                "page_size":    self.SPIFLASH_PAGE_SIZE,
+                "sector_size":  self.SPIFLASH_SECTOR_SIZE,
+                "dummy_cycles": self.SPIFLASH_DUMMY_CYCLES,
+            }
+        return description
 
     def load(self):
         raise NotImplementedError
 
-    def flash(self):
+    def flash(self, flash_regions, manifest, full=False, dry_run=False):
         raise NotImplementedError
 
 # Arty support -------------------------------------------------------------------------------------
 
 class Arty(Board):
+    SPIFLASH_SIZE         = 16*mB
     SPIFLASH_PAGE_SIZE    = 256
     SPIFLASH_SECTOR_SIZE  = 64*kB
     SPIFLASH_DUMMY_CYCLES = 11
-    def __init__(self):
-        from litex_boards.targets import arty
-        Board.__init__(self, arty.BaseSoC, {"serial", "ethernet", "spiflash", "leds", "rgb_led",
-            "switches", "spi", "i2c", "xadc", "icap_bitstream", "mmcm"})
+    soc_target       = "arty"
+    soc_capabilities = {"serial", "ethernet", "spiflash", "leds", "rgb_led", "switches", "spi",
+                        "i2c", "xadc", "icap_bitstream", "mmcm"}
+    programmer       = "OpenOCD (prog/openocd_xilinx.cfg)"
 
     def load(self):
         from litex.build.openocd import OpenOCD
         prog = OpenOCD("prog/openocd_xilinx.cfg")
         prog.load_bitstream("build/arty/gateware/top.bit")
 
-    def flash(self):
-        flash_regions = {
-            "buildroot/Image.fbi":             "0x00000000", # Linux Image: copied to 0xc0000000 by bios
-            "buildroot/rootfs.cpio.fbi":       "0x00500000", # File System: copied to 0xc0800000 by bios
-            "buildroot/rv32.dtb.fbi":          "0x00d00000", # Device tree: copied to 0xc1000000 by bios
-            "emulator/emulator.bin.fbi":       "0x00e00000", # MM Emulator: copied to 0xc1100000 by bios
-        }
-        from litex.build.openocd import OpenOCD
-        prog = OpenOCD("prog/openocd_xilinx.cfg", flash_proxy_basename="bscan_spi_xc7a35t.bit")
-        prog.set_flash_proxy_dir(".")
-        for filename, base in flash_regions.items():
-            base = int(base, 16)
-            print("Flashing {} at 0x{:08x}".format(filename, base))
-            prog.flash(base, filename)
+    def flash(self, flash_regions, manifest, full=False, dry_run=False):
+        from flash import OpenOCDFlasher, RecordingFlasher, flash_images
+        if dry_run:
+            manifest = manifest.replace(".json", ".dry_run.json")
+            flasher  = RecordingFlasher(self.SPIFLASH_SECTOR_SIZE, log=manifest.replace(".json", ".log"))
+        else:
+            flasher = OpenOCDFlasher("prog/openocd_xilinx.cfg", flash_proxy_basename="bscan_spi_xc7a35t.bit")
+        flash_images(flasher, flash_regions, self.SPIFLASH_SECTOR_SIZE, manifest, full=full)
 
 class ArtyA7(Arty):
     SPIFLASH_DUMMY_CYCLES = 7
@@ -63,10 +145,9 @@ class ArtyA7(Arty):
         prog.load_bitstream("build/arty_a7/gateware/top.bit")
 
 class ArtyS7(Arty):
-    def __init__(self):
-        from litex_boards.targets import arty_s7
-        Board.__init__(self, arty_s7.BaseSoC, {"serial", "spiflash", "leds", "rgb_led", "switches",
-            "spi", "i2c", "xadc", "icap_bit", "mmcm"})
+    soc_target       = "arty_s7"
+    soc_capabilities = {"serial", "spiflash", "leds", "rgb_led", "switches", "spi", "i2c", "xadc",
+                        "icap_bit", "mmcm"}
 
     def load(self):
         from litex.build.openocd import OpenOCD
@@ -79,9 +160,10 @@ class NeTV2(Board):
     SPIFLASH_PAGE_SIZE    = 256
     SPIFLASH_SECTOR_SIZE  = 64*kB
     SPIFLASH_DUMMY_CYCLES = 11
-    def __init__(self):
-        from litex_boards.targets import netv2
-        Board.__init__(self, netv2.BaseSoC, {"serial", "ethernet", "framebuffer", "spiflash", "leds", "xadc"})
+    VIDEO_MAX_PIX_CLK     = 148.5e6 # 1920x1080@60Hz.
+    soc_target       = "netv2"
+    soc_capabilities = {"serial", "ethernet", "framebuffer", "spiflash", "leds", "xadc"}
+    programmer       = "OpenOCD (prog/openocd_netv2_rpi.cfg)"
 
     def load(self):
         from litex.build.openocd import OpenOCD
@@ -91,9 +173,9 @@ class NeTV2(Board):
 # Genesys2 support ---------------------------------------------------------------------------------
 
 class Genesys2(Board):
-    def __init__(self):
-        from litex_boards.targets import genesys2
-        Board.__init__(self, genesys2.BaseSoC, {"serial", "ethernet"})
+    soc_target       = "genesys2"
+    soc_capabilities = {"serial", "ethernet"}
+    programmer       = "Vivado"
 
     def load(self):
         from litex.build.xilinx import VivadoProgrammer
@@ -103,9 +185,9 @@ class Genesys2(Board):
 # KC705 support ---------------------------------------------------------------------------------
 
 class KC705(Board):
-    def __init__(self):
-        from litex_boards.targets import kc705
-        Board.__init__(self, kc705.BaseSoC, {"serial", "ethernet", "leds", "xadc"})
+    soc_target       = "kc705"
+    soc_capabilities = {"serial", "ethernet", "leds", "xadc"}
+    programmer       = "Vivado"
 
     def load(self):
         from litex.build.xilinx import VivadoProgrammer
@@ -116,9 +198,9 @@ class KC705(Board):
 # KCU105 support -----------------------------------------------------------------------------------
 
 class KCU105(Board):
-    def __init__(self):
-        from litex_boards.targets import kcu105
-        Board.__init__(self, kcu105.BaseSoC, {"serial", "ethernet"})
+    soc_target       = "kcu105"
+    soc_capabilities = {"serial", "ethernet"}
+    programmer       = "Vivado"
 
     def load(self):
         from litex.build.xilinx import VivadoProgrammer
@@ -129,9 +211,9 @@ class KCU105(Board):
 # ZCU104 support -----------------------------------------------------------------------------------
 
 class ZCU104(Board):
-    def __init__(self):
-        from litex_boards.targets import zcu104
-        Board.__init__(self, zcu104.BaseSoC, {"serial"})
+    soc_target       = "zcu104"
+    soc_capabilities = {"serial"}
+    programmer       = "Vivado"
 
     def load(self):
         from litex.build.xilinx import VivadoProgrammer
@@ -142,9 +224,9 @@ class ZCU104(Board):
 # Nexys4DDR support --------------------------------------------------------------------------------
 
 class Nexys4DDR(Board):
-    def __init__(self):
-        from litex_boards.targets import nexys4ddr
-        Board.__init__(self, nexys4ddr.BaseSoC, {"serial", "spisdcard", "ethernet"})
+    soc_target       = "nexys4ddr"
+    soc_capabilities = {"serial", "spisdcard", "ethernet"}
+    programmer       = "Vivado"
 
     def load(self):
         from litex.build.xilinx import VivadoProgrammer
@@ -154,9 +236,10 @@ class Nexys4DDR(Board):
 # NexysVideo support -------------------------------------------------------------------------------
 
 class NexysVideo(Board):
-    def __init__(self):
-        from litex_boards.targets import nexys_video
-        Board.__init__(self, nexys_video.BaseSoC, {"serial", "framebuffer"})
+    VIDEO_MAX_PIX_CLK = 148.5e6 # 1920x1080@60Hz.
+    soc_target       = "nexys_video"
+    soc_capabilities = {"serial", "framebuffer"}
+    programmer       = "Vivado"
 
     def load(self):
         from litex.build.xilinx import VivadoProgrammer
@@ -166,9 +249,9 @@ class NexysVideo(Board):
 # MiniSpartan6 support -----------------------------------------------------------------------------
 
 class MiniSpartan6(Board):
-    def __init__(self):
-        from litex_boards.targets import minispartan6
-        Board.__init__(self, minispartan6.BaseSoC, {"usb_fifo", "spisdcard"})
+    soc_target       = "minispartan6"
+    soc_capabilities = {"usb_fifo", "spisdcard"}
+    programmer       = "xc3sprog"
 
     def load(self):
         os.system("xc3sprog -c ftdi build/minispartan6/gateware/top.bit")
@@ -177,9 +260,9 @@ class MiniSpartan6(Board):
 # Pipistrello support ------------------------------------------------------------------------------
 
 class Pipistrello(Board):
-    def __init__(self):
-        from litex_boards.targets import pipistrello
-        Board.__init__(self, pipistrello.BaseSoC, {"serial"})
+    soc_target       = "pipistrello"
+    soc_capabilities = {"serial"}
+    programmer       = "fpgaprog"
 
     def load(self):
         os.system("fpgaprog -f build/pipistrello/gateware/top.bit")
@@ -191,23 +274,23 @@ class VersaECP5(Board):
     SPIFLASH_PAGE_SIZE    = 256
     SPIFLASH_SECTOR_SIZE  = 64*kB
     SPIFLASH_DUMMY_CYCLES = 11
-    def __init__(self):
-        from litex_boards.targets import versa_ecp5
-        Board.__init__(self, versa_ecp5.BaseSoC, {"serial", "ethernet", "spiflash"})
+    soc_target       = "versa_ecp5"
+    soc_capabilities = {"serial", "ethernet", "spiflash"}
+    programmer       = "OpenOCD (prog/ecp5-versa5g.cfg)"
 
     def load(self):
-        os.system("openocd -f prog/ecp5-versa5g.cfg -c \"transport select jtag; init;" +
-            " svf build/versa_ecp5/gateware/top.svf; exit\"")
+        load_svf("build/versa_ecp5/gateware/top.bit", "openocd -f prog/ecp5-versa5g.cfg -c \"transport select jtag; init;" +
+            " svf {svf}; exit\"")
 
 # ULX3S support ------------------------------------------------------------------------------------
 
 class ULX3S(Board):
-    def __init__(self):
-        from litex_boards.targets import ulx3s
-        Board.__init__(self, ulx3s.BaseSoC, {"serial", "spisdcard"})
+    soc_target       = "ulx3s"
+    soc_capabilities = {"serial", "spisdcard"}
+    programmer       = "ujprog"
 
     def load(self):
-        os.system("ujprog build/ulx3s/gateware/top.svf")
+        load_svf("build/ulx3s/gateware/top.bit", "ujprog {svf}")
 
 # HADBadge support ---------------------------------------------------------------------------------
 
@@ -215,9 +298,9 @@ class HADBadge(Board):
     SPIFLASH_PAGE_SIZE    = 256
     SPIFLASH_SECTOR_SIZE  = 64*kB
     SPIFLASH_DUMMY_CYCLES = 8
-    def __init__(self):
-        from litex_boards.targets import hadbadge
-        Board.__init__(self, hadbadge.BaseSoC, {"serial", "spiflash"})
+    soc_target       = "hadbadge"
+    soc_capabilities = {"serial", "spiflash"}
+    programmer       = "dfu-util"
 
     def load(self):
         os.system("dfu-util --alt 2 --download build/hadbadge/gateware/top.bit --reset")
@@ -225,14 +308,20 @@ class HADBadge(Board):
 # OrangeCrab support -------------------------------------------------------------------------------
 
 class OrangeCrab(Board):
+    soc_target       = "orangecrab"
+    programmer       = "OpenOCD (openocd/ecp5-versa5g.cfg)"
     def __init__(self, uart_name="usb_cdc"):
-        from litex_boards.targets import orangecrab
-        if uart_name == "usb_cdc": # FIXME: do proper install of ValentyUSB.
-            os.system("git clone https://github.com/gregdavill/valentyusb -b hw_cdc_eptri")
-            sys.path.append("valentyusb")
-            Board.__init__(self, orangecrab.BaseSoC, {"usb_cdc", "spisdcard"})
+        self.uart_name = uart_name
+        if uart_name == "usb_cdc":
+            self.soc_capabilities = {"usb_cdc", "spisdcard"}
         else:
-            Board.__init__(self, orangecrab.BaseSoC, {"serial", "spisdcard"})
+            self.soc_capabilities = {"serial", "spisdcard"}
+
+    @property
+    def soc_cls(self):
+        if self.uart_name == "usb_cdc": # FIXME: do proper install of ValentyUSB.
+            sys.path.append(get_third_party("valentyusb", "https://github.com/gregdavill/valentyusb", "hw_cdc_eptri"))
+        return Board.soc_cls.fget(self)
 
     def load(self):
         os.system("openocd -f openocd/ecp5-versa5g.cfg -c \"transport select jtag; init;" +
@@ -241,9 +330,9 @@ class OrangeCrab(Board):
 # Cam Link 4K support ------------------------------------------------------------------------------
 
 class CamLink4K(Board):
-    def __init__(self):
-        from litex_boards.targets import camlink_4k
-        Board.__init__(self, camlink_4k.BaseSoC, {"serial"})
+    soc_target       = "camlink_4k"
+    soc_capabilities = {"serial"}
+    programmer       = "camlink"
 
     def load(self):
         os.system("camlink configure build/gateware/top.bit")
@@ -251,20 +340,20 @@ class CamLink4K(Board):
 # TrellisBoard support -----------------------------------------------------------------------------
 
 class TrellisBoard(Board):
-    def __init__(self):
-        from litex_boards.targets import trellisboard
-        Board.__init__(self, trellisboard.BaseSoC, {"serial"})
+    soc_target       = "trellisboard"
+    soc_capabilities = {"serial"}
+    programmer       = "OpenOCD (prog/trellisboard.cfg)"
 
     def load(self):
-        os.system("openocd -f prog/trellisboard.cfg -c \"transport select jtag; init;" +
-            " svf build/trellisboard/gateware/top.svf; exit\"")
+        load_svf("build/trellisboard/gateware/top.bit", "openocd -f prog/trellisboard.cfg -c \"transport select jtag; init;" +
+            " svf {svf}; exit\"")
 
 # De10Lite support ---------------------------------------------------------------------------------
 
 class De10Lite(Board):
-    def __init__(self):
-        from litex_boards.targets import de10lite
-        Board.__init__(self, de10lite.BaseSoC, {"serial"})
+    soc_target       = "de10lite"
+    soc_capabilities = {"serial"}
+    programmer       = "USBBlaster"
 
     def load(self):
         from litex.build.altera import USBBlaster
@@ -274,9 +363,10 @@ class De10Lite(Board):
 # De10Nano support ----------------------------------------------------------------------------------
 
 class De10Nano(Board):
-    def __init__(self):
-        from litex_boards.targets import de10nano
-        Board.__init__(self, de10nano.MiSTerSDRAMSoC, {"serial", "spisdcard", "leds", "switches"})
+    soc_target       = "de10nano"
+    soc_name         = "MiSTerSDRAMSoC"
+    soc_capabilities = {"serial", "spisdcard", "leds", "switches"}
+    programmer       = "USBBlaster"
 
     def load(self):
         from litex.build.altera import USBBlaster
@@ -286,16 +376,16 @@ class De10Nano(Board):
 # De0Nano support ----------------------------------------------------------------------------------
 
 class De0Nano(Board):
-    def __init__(self):
-        from litex_boards.targets import de0nano
-        Board.__init__(self, de0nano.BaseSoC, {"serial"})
+    soc_target       = "de0nano"
+    soc_capabilities = {"serial"}
+    programmer       = "USBBlaster"
 
     def load(self):
         from litex.build.altera import USBBlaster
         prog = USBBlaster()
         prog.load_bitstream("build/de0nano/gateware/top.sof")
 
-# Main ---------------------------------------------------------------------------------------------
+# Supported boards ---------------------------------------------------------------------------------
 
 supported_boards = {
     # Xilinx
@@ -326,25 +416,348 @@ supported_boards = {
     "de10nano":     De10Nano,
 }
 
+# SoC creation -------------------------------------------------------------------------------------
+
+def get_soc_kwargs(board_name, board):
+    # SoC parameters (and override for boards that don't support default parameters)
+    soc_kwargs = {}
+    soc_kwargs.update(integrated_rom_size=0x8000)
+    if board_name in ["de0nano"]:
+        soc_kwargs.update(l2_size=2048) # Not enough blockrams for default l2_size of 8192
+    if board_name in ["kc705"]:
+        soc_kwargs.update(uart_baudrate=500e3) # Set UART baudrate to 500KBauds since 1Mbauds not supported
+    if "usb_fifo" in board.soc_capabilities:
+        soc_kwargs.update(uart_name="usb_fifo")
+    if "usb_cdc" in board.soc_capabilities:
+        soc_kwargs.update(uart_name="usb_cdc")
+    if "ethernet" in board.soc_capabilities:
+        soc_kwargs.update(with_ethernet=True)
+    return soc_kwargs
+
+def create_soc(board, soc_kwargs, args, flash_layout=None, ram_layout=None):
+    from soc_linux import SoCLinux, get_video_settings, video_formats, video_max_pix_clk
+
+    # SoC creation ---------------------------------------------------------------------------------
+    soc = SoCLinux(board.soc_cls, **soc_kwargs)
+
+    # SoC peripherals ------------------------------------------------------------------------------
+    if "spiflash" in board.soc_capabilities:
+        soc.add_spi_flash(dummy_cycles=board.SPIFLASH_DUMMY_CYCLES)
+        soc.add_constant("SPIFLASH_PAGE_SIZE", board.SPIFLASH_PAGE_SIZE)
+        soc.add_constant("SPIFLASH_SECTOR_SIZE", board.SPIFLASH_SECTOR_SIZE)
+    if "spisdcard" in board.soc_capabilities:
+        soc.add_spi_sdcard()
+    if "ethernet" in board.soc_capabilities:
+        soc.configure_ethernet(local_ip=args.local_ip, remote_ip=args.remote_ip)
+    if "leds" in board.soc_capabilities:
+        soc.add_leds()
+    if "rgb_led" in board.soc_capabilities:
+        soc.add_rgb_led()
+    if "switches" in board.soc_capabilities:
+        soc.add_switches()
+    if "spi" in board.soc_capabilities:
+        soc.add_spi(args.spi_data_width, args.spi_clk_freq)
+    if "i2c" in board.soc_capabilities:
+        soc.add_i2c()
+    if "xadc" in board.soc_capabilities:
+        soc.add_xadc()
+    if "framebuffer" in board.soc_capabilities:
+        assert args.video_format in video_formats.keys(), "Unsupported video format"
+        video_settings = get_video_settings(args.video)
+        soc.add_framebuffer(video_settings, args.video_format,
+            max_pix_clk=getattr(board, "VIDEO_MAX_PIX_CLK", video_max_pix_clk))
+    if "icap_bitstream" in board.soc_capabilities:
+        soc.add_icap_bitstream()
+    if "mmcm" in board.soc_capabilities:
+        soc.add_mmcm(2)
+    if args.layout == "packed":
+        soc.configure_boot(get_flash_constants(flash_layout) if flash_layout is not None else None, ram_layout)
+    else:
+        soc.configure_boot()
+    return soc
+
+# Build cache --------------------------------------------------------------------------------------
+
+def get_file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def get_package_version(name):
+    # Prefer the git revision (+ local changes) of development installs, fallback to package version.
+    from importlib import metadata as importlib_metadata
+    module = importlib.import_module(name)
+    path   = os.path.dirname(os.path.abspath(module.__file__))
+    try:
+        describe = subprocess.check_output(["git", "-C", path, "describe", "--always", "--dirty"],
+            stderr=subprocess.DEVNULL).decode().strip()
+        if describe.endswith("-dirty"):
+            diff = subprocess.check_output(["git", "-C", path, "diff", "HEAD"], stderr=subprocess.DEVNULL)
+            describe += "-" + hashlib.sha256(diff).hexdigest()[:16]
+        return describe
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    try:
+        return importlib_metadata.version(name.replace("_", "-"))
+    except importlib_metadata.PackageNotFoundError:
+        return getattr(module, "__version__", "unknown")
+
+def get_layout_config(policy, flash_layout=None, ram_layout=None):
+    # Only what ends up in the gateware: the fixed layout does not depend on the images, a packed
+    # layout adds the images offsets (not their exact sizes) as boot constants.
+    config = {"policy": policy}
+    if policy == "packed":
+        config["ram"] = get_ram_constants(ram_layout)
+        if flash_layout is not None:
+            config["flash"] = get_flash_constants(flash_layout)
+    return config
+
+def get_build_config(board_name, board, soc_kwargs, args, flash_layout=None, ram_layout=None):
+    config = {
+        "board":            board_name,
+        "soc_cls":          board.soc_cls_name,
+        "soc_capabilities": sorted(board.soc_capabilities),
+        "soc_kwargs":       soc_kwargs,
+        "options": {
+            "local_ip":       args.local_ip,
+            "remote_ip":      args.remote_ip,
+            "spi_data_width": args.spi_data_width,
+            "spi_clk_freq":   args.spi_clk_freq,
+            "video":          args.video,
+            "video_format":   args.video_format,
+        },
+        "layout":           get_layout_config(args.layout, flash_layout, ram_layout),
+        "sources": {
+            "make.py":      get_file_hash("make.py"),
+            "soc_linux.py": get_file_hash("soc_linux.py"),
+            "cvt.py":       get_file_hash("cvt.py"),
+        },
+        "versions": {name: get_package_version(name) for name in ["migen", "litex", "litex_boards", "litevideo"]},
+    }
+    if "spiflash" in board.soc_capabilities:
+        config["spiflash"] = {
+            "page_size":    board.SPIFLASH_PAGE_SIZE,
+            "sector_size":  board.SPIFLASH_SECTOR_SIZE,
+            "dummy_cycles": board.SPIFLASH_DUMMY_CYCLES,
+        }
+    return config
+
+def get_build_key(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def build_cache_hit(build_dir, key, build):
+    # Cached outputs are reused when the key matches and they cover the requested build (a cache
+    # entry with a built bitstream also covers a run that only generates the SoC).
+    try:
+        with open(os.path.join(build_dir, "build_cache.json")) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if cache.get("key") != key:
+        return False
+    if build and not cache.get("build", False):
+        return False
+    return os.path.exists(os.path.join(build_dir, "csr.json"))
+
+def build_cache_update(build_dir, key, config, build):
+    with open(os.path.join(build_dir, "build_cache.json"), "w") as f:
+        json.dump({"key": key, "build": build, "config": config}, f, indent=4, sort_keys=True)
+
+# Build --------------------------------------------------------------------------------------------
+
+def build_board(board_name, args, isolated=False):
+    board = supported_boards[board_name]()
+
+    # Output directories (isolated builds keep every per-board output under build/<board>) ---------
+    build_dir = os.path.join("build", board_name)
+    if isolated:
+        images_dir   = build_dir
+        emulator_dir = os.path.join(build_dir, "emulator")
+    else:
+        images_dir   = "buildroot"
+        emulator_dir = "emulator"
+
+    # Compressed images (LZ4 kernel decompressed by the emulator, gzip rootfs) ---------------------
+    if args.compress:
+        compress_images(images_dir)
+
+    # RAM/Flash layouts (BIOS fixed offsets or packed from the images sizes) ----------------------
+    if args.layout == "packed" and not bios_reads_layout_constants():
+        if args.fbi or args.flash:
+            raise ValueError("The LiteX BIOS uses fixed images offsets, the packed layout can't be used "
+                "for SPI Flash boot (use --layout=fixed).")
+        print("Warning: the LiteX BIOS uses fixed images offsets, the packed layout is only usable "
+            "for serial boot (images.json).")
+    ram_layout   = plan_ram_layout(get_ram_images(images_dir, emulator_dir, args.compress),
+        kernel_margin=args.kernel_margin, policy=args.layout)
+    flash_images = get_flash_images(images_dir, emulator_dir, args.compress)
+    flash_layout = None
+    if "spiflash" in board.soc_capabilities:
+        flash_layout = plan_flash_layout(flash_images, board.SPIFLASH_SECTOR_SIZE,
+            flash_size=getattr(board, "SPIFLASH_SIZE", None), policy=args.layout)
+
+    # SoC / Build (skipped when the cached outputs match the SoC configuration) --------------------
+    soc_kwargs = get_soc_kwargs(board_name, board)
+    use_cache  = not (args.no_cache or args.doc)
+    if use_cache:
+        build_config = get_build_config(board_name, board, soc_kwargs, args, flash_layout, ram_layout)
+        build_key    = get_build_key(build_config)
+    if use_cache and build_cache_hit(build_dir, build_key, args.build):
+        print("Build cache hit for {} ({}), reusing {}.".format(board_name, build_key[:16], build_dir))
+    else:
+        from litex.soc.integration.builder import Builder
+        soc     = create_soc(board, soc_kwargs, args, flash_layout, ram_layout)
+        builder = Builder(soc, output_dir=build_dir, csr_json=os.path.join(build_dir, "csr.json"))
+        builder.build(run=args.build)
+        if use_cache:
+            build_cache_update(build_dir, build_key, build_config, args.build)
+    if flash_layout is not None:
+        write_flash_layout(flash_layout, os.path.join(build_dir, "flash_layout.json"))
+    with open(os.path.join(build_dir, "csr.json")) as f:
+        main_ram_base = json.load(f)["memories"]["main_ram"]["base"]
+    write_images_json(get_ram_images_map(ram_layout, main_ram_base), os.path.join(build_dir, "images.json"))
+
+    # DTS ------------------------------------------------------------------------------------------
+    generate_dts(build_dir, board_name, get_initrd(ram_layout))
+    compile_dts(build_dir, board_name, os.path.join(images_dir, "rv32.dtb"))
+
+    # Machine Mode Emulator ------------------------------------------------------------------------
+    compile_emulator(build_dir, emulator_dir, args.emulator_stats)
+
+    # Flash Linux images ---------------------------------------------------------------------------
+    if args.fbi:
+        fbi_images = {image: fbi for _, image, fbi, _ in flash_images}
+        generate_fbis(fbi_images, cache_file=os.path.join(build_dir, "fbi_cache.json"))
+        if flash_layout is not None:
+            check_flash_layout(flash_layout)
+            with open(os.path.join(build_dir, "csr.json")) as f:
+                flash_base = json.load(f)["memories"]["spiflash"]["base"]
+            write_images_json({region["filename"]: flash_base + region["offset"] for region in flash_layout},
+                os.path.join(build_dir, "images.fbi.json"))
+
+    # Load FPGA bitstream --------------------------------------------------------------------------
+    if args.load:
+        board.load()
+
+    # Flash FPGA bitstream -------------------------------------------------------------------------
+    if args.flash:
+        flash_layout = read_flash_layout(os.path.join(build_dir, "flash_layout.json"))
+        check_flash_layout(flash_layout)
+        board.flash(get_flash_regions(flash_layout), os.path.join(build_dir, "flash_manifest.json"),
+            full    = args.flash_full,
+            dry_run = args.flash_dry_run)
+
+    # Generate SoC documentation -------------------------------------------------------------------
+    if args.doc:
+        soc.generate_doc(board_name)
+
+def build_board_worker(board_name, args):
+    # Run in a worker process: redirect all output (including toolchains) to build/<board>/make.log.
+    build_dir = os.path.join("build", board_name)
+    os.makedirs(build_dir, exist_ok=True)
+    log = os.path.join(build_dir, "make.log")
+    start = time.time()
+    with open(log, "w") as f:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            build_board(board_name, args, isolated=True)
+            success = True
+        except BaseException:
+            traceback.print_exc()
+            success = False
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return success, time.time() - start, log
+
+def build_boards_parallel(board_names, args):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(build_board_worker, name, args): name for name in board_names}
+        for future in as_completed(futures):
+            board_name = futures[future]
+            try:
+                results[board_name] = future.result()
+            except Exception as e: # Worker process died.
+                results[board_name] = (False, 0.0, str(e))
+            success, elapsed, log = results[board_name]
+            print("[{}/{}] {:<14} {} ({:.0f}s)".format(len(results), len(board_names),
+                board_name, "PASS" if success else "FAIL", elapsed))
+    return build_summary(board_names, results)
+
+def build_boards_sequential(board_names, args):
+    # Same collect-and-summarize as the parallel builds, outputs kept on the console.
+    results = {}
+    for board_name in board_names:
+        start = time.time()
+        try:
+            build_board(board_name, args)
+            success = True
+        except Exception:
+            traceback.print_exc()
+            success = False
+        results[board_name] = (success, time.time() - start, "-")
+        print("[{}/{}] {:<14} {} ({:.0f}s)".format(len(results), len(board_names),
+            board_name, "PASS" if success else "FAIL", results[board_name][1]))
+    return build_summary(board_names, results)
+
+def build_summary(board_names, results):
+    print("\nBuild summary:")
+    for board_name in board_names:
+        success, elapsed, log = results[board_name]
+        print("- {:<14} {}  {:6.0f}s  {}".format(board_name, "PASS" if success else "FAIL", elapsed, log))
+    failures = [name for name in board_names if not results[name][0]]
+    print("{}/{} boards passed.".format(len(board_names) - len(failures), len(board_names)))
+    return len(failures) == 0
+
+# Main ---------------------------------------------------------------------------------------------
+
 def main():
     description = "Linux on LiteX-VexRiscv\n\n"
     description += "Available boards:\n"
     for name in supported_boards.keys():
         description += "- " + name + "\n"
     parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument("--board",          required=True,            help="FPGA board")
+    parser.add_argument("--board",          default=None,             help="FPGA board")
+    parser.add_argument("--list-boards",    action="store_true",      help="List the supported boards")
+    parser.add_argument("--describe",       default=None,             help="Describe a board (capabilities, SPI Flash, programmer) as JSON")
     parser.add_argument("--build",          action="store_true",      help="Build bitstream")
     parser.add_argument("--load",           action="store_true",      help="Load bitstream (to SRAM)")
     parser.add_argument("--flash",          action="store_true",      help="Flash bitstream/images (to SPI Flash)")
+    parser.add_argument("--flash-full",     action="store_true",      help="Flash all sectors (ignore the flash manifest)")
+    parser.add_argument("--flash-dry-run",  action="store_true",      help="Record the flash erase/write commands instead of flashing")
     parser.add_argument("--doc",            action="store_true",      help="Build documentation")
     parser.add_argument("--local-ip",       default="192.168.1.50",   help="Local IP address")
     parser.add_argument("--remote-ip",      default="192.168.1.100",  help="Remote IP address of TFTP server")
     parser.add_argument("--spi-data-width", type=int, default=8,      help="SPI data width (maximum transfered bits per xfer)")
     parser.add_argument("--spi-clk-freq",   type=int, default=1e6,    help="SPI clock frequency")
-    parser.add_argument("--video",          default="1920x1080_60Hz", help="Video configuration")
+    parser.add_argument("--video",          default="1920x1080_60Hz", help="Video configuration (1920x1080_60Hz..., CVT: WxH@Hz, CVT-RB: WxH@HzR)")
+    parser.add_argument("--video-format",   default="a8b8g8r8",       help="Framebuffer pixel format (a8b8g8r8 or r5g6b5: half the DRAM bandwidth)")
     parser.add_argument("--fbi",            action="store_true",      help="Generate fbi images")
+    parser.add_argument("--compress",       action="store_true",      help="Use compressed images (LZ4 kernel, gzip rootfs)")
+    parser.add_argument("--emulator-stats", action="store_true",      help="Build the emulator with trap statistics (emulator_stats.py)")
+    parser.add_argument("--layout",         default="fixed",          choices=["fixed", "packed"], help="Images layout: BIOS fixed offsets or packed from the images sizes (BIOS with *_IMAGE_*_OFFSET support)")
+    parser.add_argument("--kernel-margin",  type=lambda x: int(x, 0), default=0x100000, help="RAM reserved after the kernel Image (.bss, early allocations, packed layout)")
+    parser.add_argument("--no-cache",       action="store_true",      help="Always rebuild the SoC (ignore build/<board>/build_cache.json)")
+    parser.add_argument("--jobs",           type=int, default=1,      help="Number of boards built in parallel (outputs in build/<board>)")
     args = parser.parse_args()
 
+    # Boards registry (no LiteX import) ------------------------------------------------------------
+    if args.list_boards:
+        for name in supported_boards.keys():
+            print(name)
+        return
+    if args.describe is not None:
+        name = args.describe.lower().replace(" ", "_")
+        if name not in supported_boards:
+            parser.error("unknown board {}".format(args.describe))
+        print(json.dumps({"board": name, **supported_boards[name]().describe()}, indent=4))
+        return
+    if args.board is None:
+        parser.error("--board is required")
+
     # Board(s) selection ---------------------------------------------------------------------------
     if args.board == "all":
         board_names = list(supported_boards.keys())
@@ -354,87 +767,16 @@ def main():
         board_names = [args.board]
 
     # Board(s) iteration ---------------------------------------------------------------------------
-    for board_name in board_names:
-        board = supported_boards[board_name]()
-
-        # SoC parameters (and override for boards that don't support default parameters) -----------
-        soc_kwargs = {}
-        soc_kwargs.update(integrated_rom_size=0x8000)
-        if board_name in ["de0nano"]:
-            soc_kwargs.update(l2_size=2048) # Not enough blockrams for default l2_size of 8192
-        if board_name in ["kc705"]:
-            soc_kwargs.update(uart_baudrate=500e3) # Set UART baudrate to 500KBauds since 1Mbauds not supported
-        if "usb_fifo" in board.soc_capabilities:
-            soc_kwargs.update(uart_name="usb_fifo")
-        if "usb_cdc" in board.soc_capabilities:
-            soc_kwargs.update(uart_name="usb_cdc")
-        if "ethernet" in board.soc_capabilities:
-            soc_kwargs.update(with_ethernet=True)
-
-        # SoC creation -----------------------------------------------------------------------------
-        soc = SoCLinux(board.soc_cls, **soc_kwargs)
-
-        # SoC peripherals --------------------------------------------------------------------------
-        if "spiflash" in board.soc_capabilities:
-            soc.add_spi_flash(dummy_cycles=board.SPIFLASH_DUMMY_CYCLES)
-            soc.add_constant("SPIFLASH_PAGE_SIZE", board.SPIFLASH_PAGE_SIZE)
-            soc.add_constant("SPIFLASH_SECTOR_SIZE", board.SPIFLASH_SECTOR_SIZE)
-        if "spisdcard" in board.soc_capabilities:
-            soc.add_spi_sdcard()
-        if "ethernet" in board.soc_capabilities:
-            soc.configure_ethernet(local_ip=args.local_ip, remote_ip=args.remote_ip)
-        if "leds" in board.soc_capabilities:
-            soc.add_leds()
-        if "rgb_led" in board.soc_capabilities:
-            soc.add_rgb_led()
-        if "switches" in board.soc_capabilities:
-            soc.add_switches()
-        if "spi" in board.soc_capabilities:
-            soc.add_spi(args.spi_data_width, args.spi_clk_freq)
-        if "i2c" in board.soc_capabilities:
-            soc.add_i2c()
-        if "xadc" in board.soc_capabilities:
-            soc.add_xadc()
-        if "framebuffer" in board.soc_capabilities:
-            assert args.video in video_resolutions.keys(), "Unsupported video resolution"
-            video_settings = video_resolutions[args.video]
-            soc.add_framebuffer(video_settings)
-        if "icap_bitstream" in board.soc_capabilities:
-            soc.add_icap_bitstream()
-        if "mmcm" in board.soc_capabilities:
-            soc.add_mmcm(2)
-        soc.configure_boot()
-
-        # Build ------------------------------------------------------------------------------------
-        build_dir = os.path.join("build", board_name)
-        builder   = Builder(soc, output_dir=build_dir, csr_json=os.path.join(build_dir, "csr.json"))
-        builder.build(run=args.build)
-
-        # DTS --------------------------------------------------------------------------------------
-        soc.generate_dts(board_name)
-        soc.compile_dts(board_name)
-
-        # Machine Mode Emulator --------------------------------------------------------------------
-        soc.compile_emulator(board_name)
-
-        # Flash Linux images -----------------------------------------------------------------------
-        if args.fbi:
-            os.system("python3 -m litex.soc.software.mkmscimg buildroot/Image -o buildroot/Image.fbi --fbi --little")
-            os.system("python3 -m litex.soc.software.mkmscimg buildroot/rootfs.cpio -o buildroot/rootfs.cpio.fbi --fbi --little")
-            os.system("python3 -m litex.soc.software.mkmscimg buildroot/rv32.dtb -o buildroot/rv32.dtb.fbi --fbi --little")
-            os.system("python3 -m litex.soc.software.mkmscimg emulator/emulator.bin -o emulator/emulator.bin.fbi --fbi --little")
-
-        # Load FPGA bitstream ----------------------------------------------------------------------
-        if args.load:
-            board.load()
-
-        # Flash FPGA bitstream ---------------------------------------------------------------------
-        if args.flash:
-            board.flash()
-
-        # Generate SoC documentation ---------------------------------------------------------------
-        if args.doc:
-            soc.generate_doc(board_name)
+    if args.jobs > 1:
+        if args.load or args.flash:
+            parser.error("--load/--flash can't be combined with --jobs")
+        if not build_boards_parallel(board_names, args):
+            sys.exit(1)
+    elif len(board_names) > 1:
+        if not build_boards_sequential(board_names, args):
+            sys.exit(1)
+    else:
+        build_board(board_names[0], args)
 
 if __name__ == "__main__":
     main()
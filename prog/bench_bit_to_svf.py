@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Benchmark of bit_to_svf.py against the original (byte-by-byte) converter.
+
+import os
+import sys
+import time
+import textwrap
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bit_to_svf
+
+# Original converter -------------------------------------------------------------------------------
+
+# Original bit_to_svf.py script, verbatim (filenames/row size as arguments).
+
+def bitreverse(x):
+    y = 0
+    for i in range(8):
+        if (x >> (7 - i)) & 1 == 1:
+            y |= (1 << i)
+    return y
+
+def legacy_bit_to_svf(bit_filename, svf_filename, max_row_size=bit_to_svf.max_row_size):
+    with open(bit_filename, 'rb') as bitf:
+        bs = bitf.read()
+        # Autodetect IDCODE from bitstream
+        idcode_cmd = bytes([0xE2, 0x00, 0x00, 0x00])
+        idcode = None
+        for i in range(len(bs) - 4):
+            if bs[i:i+4] == idcode_cmd:
+                idcode = bs[i+4] << 24
+                idcode |= bs[i+5] << 16
+                idcode |= bs[i+6] << 8
+                idcode |= bs[i+7]
+                break
+        if idcode is None:
+            print("Failed to find IDCODE in bitstream, check bitstream is valid")
+            sys.exit(1)
+        print("IDCODE in bitstream is 0x%08x" % idcode)
+        bitf.seek(0)
+        with open(svf_filename, 'w') as svf:
+            print("""
+HDR	0;
+HIR	0;
+TDR	0;
+TIR	0;
+ENDDR	DRPAUSE;
+ENDIR	IRPAUSE;
+STATE	IDLE;
+        """, file=svf)
+            print("""
+SIR	8	TDI  (E0);
+SDR	32	TDI  (00000000)
+        TDO  ({:08X})
+        MASK (FFFFFFFF);
+        """.format(idcode), file=svf)
+            print("""
+SIR	8	TDI  (1C);
+SDR	510	TDI  (3FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+             FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF);
+
+SIR	8	TDI  (C6);
+SDR	8	TDI  (00);
+RUNTEST	IDLE	2 TCK	1.00E-02 SEC;
+
+SIR	8	TDI  (3C);
+SDR	32	TDI  (00000000)
+        TDO  (00000000)
+        MASK (0000B000);
+
+SIR	8	TDI  (46);
+SDR	8	TDI  (01);
+RUNTEST	IDLE	2 TCK	1.00E-02 SEC;
+
+SIR	8	TDI  (7A);
+RUNTEST	IDLE	2 TCK	1.00E-02 SEC;
+
+        """, file=svf)
+            while True:
+                chunk = bitf.read(max_row_size//8)
+                if not chunk:
+                    break
+                # Convert chunk to bit-reversed hex
+                br_chunk = [bitreverse(x) for x in chunk]
+                hex_chunk = ["{:02X}".format(x) for x in reversed(br_chunk)]
+                print("\n".join(textwrap.wrap("SDR {} TDI ({});".format(8*len(chunk), "".join(hex_chunk)), 100)), file=svf)
+
+            print("""
+SIR	8	TDI  (FF);
+RUNTEST	IDLE	100 TCK	1.00E-02 SEC;
+
+
+SIR	8	TDI  (C0);
+RUNTEST	IDLE	2 TCK	1.00E-03 SEC;
+SDR	32	TDI  (00000000)
+        TDO  (00000000)
+        MASK (FFFFFFFF);
+
+! Shift in ISC DISABLE(0x26) instruction
+SIR	8	TDI  (26);
+RUNTEST	IDLE	2 TCK	2.00E-01 SEC;
+! Shift in BYPASS(0xFF) instruction
+SIR	8	TDI  (FF);
+RUNTEST	IDLE	2 TCK	1.00E-03 SEC;
+
+! Shift in LSC_READ_STATUS(0x3C) instruction
+SIR	8	TDI  (3C);
+SDR	32	TDI  (00000000)
+        TDO  (00000100)
+        MASK (00002100);
+        """, file=svf)
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="bit_to_svf benchmark")
+    parser.add_argument("--size",     type=int, default=8*1024*1024,             help="Size of the generated bitstream in bytes")
+    parser.add_argument("--row-size", type=int, default=bit_to_svf.max_row_size, help="SDR row size in bits")
+    parser.add_argument("bitstream",  nargs="?",                                 help="Bitstream to use instead of a generated one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bit_filename = args.bitstream
+        if bit_filename is None:
+            # Random payload with the VERIFY_ID command/IDCODE of a LFE5U-45F near the start.
+            bit_filename = os.path.join(tmp, "top.bit")
+            with open(bit_filename, "wb") as f:
+                f.write(b"\xff"*16 + b"\xe2\x00\x00\x00\x41\x11\x20\x43" + os.urandom(args.size))
+        size = os.path.getsize(bit_filename)
+
+        results = {}
+        for name, converter in [("legacy", legacy_bit_to_svf), ("bit_to_svf", bit_to_svf.bit_to_svf)]:
+            svf_filename = os.path.join(tmp, name + ".svf")
+            start = time.perf_counter()
+            converter(bit_filename, svf_filename, args.row_size)
+            results[name] = time.perf_counter() - start
+            print("{:<12} {:8.3f}s {:8.2f} MB/s".format(name, results[name], size/results[name]/1e6))
+
+        with open(os.path.join(tmp, "legacy.svf"), "rb") as a, open(os.path.join(tmp, "bit_to_svf.svf"), "rb") as b:
+            identical = a.read() == b.read()
+        print("Speedup: {:.1f}x, outputs {}".format(results["legacy"]/results["bit_to_svf"],
+            "identical" if identical else "DIFFER"))
+        if not identical:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,18 @@
 #!/usr/bin/env python3
 
 import sys
-import textwrap
+import mmap
+import argparse
 
 # Very basic bitstream to SVF converter, tested with the ULX3S WiFi interface
 
-max_row_size = 8000 # needed for ULX3S Wifi
-
-
-def bitreverse(x):
-    y = 0
-    for i in range(8):
-        if (x >> (7 - i)) & 1 == 1:
-            y |= (1 << i)
-    return y
-
-with open(sys.argv[1], 'rb') as bitf:
-    bs = bitf.read()
-    # Autodetect IDCODE from bitstream
-    idcode_cmd = bytes([0xE2, 0x00, 0x00, 0x00])
-    idcode = None
-    for i in range(len(bs) - 4):
-        if bs[i:i+4] == idcode_cmd:
-            idcode = bs[i+4] << 24
-            idcode |= bs[i+5] << 16
-            idcode |= bs[i+6] << 8
-            idcode |= bs[i+7]
-            break
-    if idcode is None:
-        print("Failed to find IDCODE in bitstream, check bitstream is valid")
-        sys.exit(1)
-    print("IDCODE in bitstream is 0x%08x" % idcode)
-    bitf.seek(0)
-    with open(sys.argv[2], 'w') as svf:
-        print("""
+max_row_size = 8000 # needed for ULX3S Wifi (in bits)
+
+svf_line_width = 100
+
+bitreverse_table = bytes(int("{:08b}".format(i)[::-1], 2) for i in range(256))
+
+svf_header = """
 HDR	0;
 HIR	0;
 TDR	0;
@@ -41,14 +20,18 @@ TIR	0;
 ENDDR	DRPAUSE;
 ENDIR	IRPAUSE;
 STATE	IDLE;
-        """, file=svf)
-        print("""
+        
+"""
+
+svf_idcode = """
 SIR	8	TDI  (E0);
 SDR	32	TDI  (00000000)
         TDO  ({:08X})
         MASK (FFFFFFFF);
-        """.format(idcode), file=svf)
-        print("""
+        
+"""
+
+svf_prologue = """
 SIR	8	TDI  (1C);
 SDR	510	TDI  (3FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
              FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF);
@@ -69,17 +52,10 @@ RUNTEST	IDLE	2 TCK	1.00E-02 SEC;
 SIR	8	TDI  (7A);
 RUNTEST	IDLE	2 TCK	1.00E-02 SEC;
 
-        """, file=svf)
-        while True:
-            chunk = bitf.read(max_row_size//8)
-            if not chunk:
-                break
-            # Convert chunk to bit-reversed hex
-            br_chunk = [bitreverse(x) for x in chunk]
-            hex_chunk = ["{:02X}".format(x) for x in reversed(br_chunk)]
-            print("\n".join(textwrap.wrap("SDR {} TDI ({});".format(8*len(chunk), "".join(hex_chunk)), 100)), file=svf)
-
-        print("""
+        
+"""
+
+svf_epilogue = """
 SIR	8	TDI  (FF);
 RUNTEST	IDLE	100 TCK	1.00E-02 SEC;
 
@@ -102,4 +78,84 @@ SIR	8	TDI  (3C);
 SDR	32	TDI  (00000000)
         TDO  (00000100)
         MASK (00002100);
-        """, file=svf)
+        
+"""
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def find_idcode(bs):
+    # IDCODE follows the VERIFY_ID (0xE2) command and its 3 padding bytes.
+    i = bs.find(b"\xe2\x00\x00\x00")
+    if i < 0 or i + 8 > len(bs):
+        return None
+    return int.from_bytes(bs[i+4:i+8], "big")
+
+def format_sdr(chunk):
+    # Bits are shifted LSB first: bit-reverse each byte and reverse the byte order.
+    tdi = chunk.translate(bitreverse_table)[::-1].hex().upper()
+    cmd = "SDR {} TDI ".format(8*len(chunk))
+    arg = "(" + tdi + ");"
+    # Wrap lines at svf_line_width (as textwrap.wrap would do).
+    if len(arg) <= svf_line_width:
+        if len(cmd) + len(arg) <= svf_line_width:
+            return cmd + arg + "\n"
+        return cmd.rstrip() + "\n" + arg + "\n"
+    first = svf_line_width - len(cmd)
+    lines = [cmd + arg[:first]]
+    lines += [arg[i:i+svf_line_width] for i in range(first, len(arg), svf_line_width)]
+    return "\n".join(lines) + "\n"
+
+# Converter ----------------------------------------------------------------------------------------
+
+def generate_svf(bit_filename, row_size=max_row_size, chunk_size=1024*1024):
+    """Generate the SVF for bit_filename incrementally, yielding chunks of ~chunk_size characters."""
+    with open(bit_filename, "rb") as bitf:
+        with mmap.mmap(bitf.fileno(), 0, access=mmap.ACCESS_READ) as bs:
+            # Autodetect IDCODE from bitstream
+            idcode = find_idcode(bs)
+            if idcode is None:
+                raise ValueError("Failed to find IDCODE in bitstream, check bitstream is valid")
+            print("IDCODE in bitstream is 0x%08x" % idcode)
+
+            yield svf_header + svf_idcode.format(idcode) + svf_prologue
+            row_bytes = row_size//8
+            buf       = []
+            buf_len   = 0
+            view      = memoryview(bs)
+            try:
+                for i in range(0, len(bs), row_bytes):
+                    row = format_sdr(bytes(view[i:i+row_bytes]))
+                    buf.append(row)
+                    buf_len += len(row)
+                    if buf_len >= chunk_size:
+                        yield "".join(buf)
+                        buf     = []
+                        buf_len = 0
+            finally:
+                view.release()
+            yield "".join(buf) + svf_epilogue
+
+def bit_to_svf(bit_filename, svf_filename, row_size=max_row_size):
+    with open(svf_filename, "w") as svf:
+        for chunk in generate_svf(bit_filename, row_size):
+            svf.write(chunk)
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="ECP5 bitstream to SVF converter")
+    parser.add_argument("bitstream",                                   help="Input bitstream (.bit)")
+    parser.add_argument("svf",                                         help="Output SVF file (.svf)")
+    parser.add_argument("--row-size", type=int, default=max_row_size, help="Maximum SDR row size in bits (multiple of 8)")
+    args = parser.parse_args()
+
+    if args.row_size <= 0 or args.row_size % 8:
+        parser.error("--row-size must be a positive multiple of 8")
+    try:
+        bit_to_svf(args.bitstream, args.svf, args.row_size)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import mmap
+
+from layout import get_ram_images_map
+
+# Runtime RAM init of the simulation: RAM contents are not part of the gateware, memories get
+# numbered 32-bit placeholder words that are located in the generated init files ($readmemh) and
+# replaced with the images before running.
+#
+# The memories of the SDRAM model (one per bank) use words of dfi_databits*nphases bits: the 32-bit
+# init words are packed in them (first word in the LSBs) or, for narrower memories, split in them
+# (LSBs first). Placeholders are decoded/images are encoded per 32-bit sub-word.
+
+ram_init_marker = 0xf1a50000
+
+def get_ram_init_placeholder(period):
+    return [ram_init_marker | i for i in range(period)]
+
+def get_sdram_init_period(geom_settings, databits):
+    """32-bit words of one row of all the banks: the SDRAM model splits the init data in banks per
+    row (ROW_BANK_COL), a period of placeholders gives each bank the same indexes on every row."""
+    return (2**(geom_settings.bankbits + geom_settings.colbits)*databits)//32
+
+def decode_ram_init_words(words, word_bits):
+    """32-bit sub-words of the init words of a word_bits memory."""
+    if word_bits >= 32:
+        return [(word >> (32*i)) & 0xffffffff for word in words for i in range(word_bits//32)]
+    ratio = 32//word_bits
+    if len(words)%ratio:
+        return None
+    return [sum(words[i + j] << (word_bits*j) for j in range(ratio)) for i in range(0, len(words), ratio)]
+
+def find_ram_init_files(gateware_dir):
+    """{filename: (word bytes, placeholder indexes)} of the RAM init files."""
+    init_files = {}
+    for filename in sorted(glob.glob(os.path.join(gateware_dir, "*.init"))):
+        with open(filename) as f:
+            lines = f.read().split()
+        if not lines or len(lines) > 0x10000:
+            continue
+        try:
+            words = [int(line, 16) for line in lines]
+        except ValueError:
+            continue
+        word_bits = 4*len(lines[0])
+        if word_bits%32 and 32%word_bits:
+            continue
+        words = decode_ram_init_words(words, word_bits)
+        if words and all(word >> 16 == ram_init_marker >> 16 for word in words):
+            init_files[filename] = (word_bits//8, [word & 0xffff for word in words])
+    return init_files
+
+def map_ram_images(images_map):
+    images = []
+    for filename, offset in images_map.items():
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                images.append((offset, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)))
+    return images
+
+def read_ram(images, offset, length):
+    data = bytearray(length)
+    for base, image in images:
+        start = max(offset, base)
+        end   = min(offset + length, base + len(image))
+        if start < end:
+            data[start - offset:end - offset] = image[start - base:end - base]
+    return data
+
+def get_ram_init_hex(data, word_bytes):
+    # Little endian words, one per line.
+    words = bytearray(len(data))
+    for i in range(word_bytes):
+        words[i::word_bytes] = data[word_bytes - 1 - i::word_bytes]
+    return words.hex("\n", word_bytes) + "\n" if words else ""
+
+def write_ram_init(gateware_dir, ram_layout, chunk_size=1024*1024):
+    """Rewrite the RAM init files of the simulation from the memory-mapped images."""
+    init_files = find_ram_init_files(gateware_dir)
+    if not init_files:
+        raise ValueError("No RAM init file found in {}, is the SoC built with runtime_ram_init?".format(gateware_dir))
+    images = map_ram_images(get_ram_images_map(ram_layout))
+    size   = max([base + len(image) for base, image in images] + [0])
+    # Placeholder words are split between the files (SDRAM banks) with a period of period words.
+    period = sum(len(indexes) for word_bytes, indexes in init_files.values())
+    for filename, (word_bytes, indexes) in init_files.items():
+        with open(filename, "w") as f:
+            if indexes == list(range(period)):
+                for offset in range(0, size, chunk_size):
+                    f.write(get_ram_init_hex(read_ram(images, offset, chunk_size), word_bytes))
+                continue
+            runs = []
+            for index in indexes:
+                if runs and runs[-1][0] + runs[-1][1] == index:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([index, 1])
+            for row in range(0, size, period*4):
+                data = bytearray()
+                for index, count in runs:
+                    data += read_ram(images, row + index*4, count*4)
+                f.write(get_ram_init_hex(data, word_bytes))
+    for base, image in images:
+        image.close()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import binascii
+import queue
+import random
+import select
+import argparse
+import threading
+from collections import deque
+
+from layout import read_images_json
+
+# Serial boot uploader: loads the images of images.json through the LiteX BIOS serialboot (SFL)
+# protocol, with frames pipelining and resume on errors.
+
+# SFL protocol -------------------------------------------------------------------------------------
+
+sfl_magic_req = b"sL5DdSMmkekro\n"
+sfl_magic_ack = b"z6IHG7cYDID6o\n"
+
+sfl_payload_length = 255 # Max payload (address + data) of a frame.
+sfl_data_length    = sfl_payload_length - 4
+
+# Commands
+sfl_cmd_abort       = 0x00
+sfl_cmd_load        = 0x01
+sfl_cmd_jump        = 0x02
+sfl_cmd_load_no_crc = 0x03
+
+# Replies
+sfl_ack_success  = b"K"
+sfl_ack_crcerror = b"C"
+sfl_ack_unknown  = b"U"
+sfl_ack_error    = b"E"
+
+def crc16(data):
+    # CRC-16/XMODEM (polynomial 0x1021, init 0), as the BIOS.
+    return binascii.crc_hqx(data, 0)
+
+def sfl_frame(cmd, payload=b""):
+    """Frame: payload length, CRC16 (big endian) of cmd + payload, cmd, payload."""
+    assert len(payload) <= sfl_payload_length
+    data = bytes([cmd]) + payload
+    return bytes([len(payload)]) + crc16(data).to_bytes(2, "big") + data
+
+# Uploader -----------------------------------------------------------------------------------------
+
+class SFLError(Exception):
+    pass
+
+class SFLUploader:
+    """Uploads images to a BIOS in serialboot over port (pyserial-like read/write/timeout object).
+
+    window:         number of frames sent before waiting for their acknowledges.
+    no_crc:         use the load command without CRC check in the BIOS (faster on slow CPUs).
+    retries:        number of consecutive timeouts before waiting for the BIOS to restart serialboot.
+    resumes:        number of serialboot restarts waited for before giving up.
+    resume_timeout: time to wait for serialboot to restart (s).
+    """
+    def __init__(self, port, window=8, no_crc=False, timeout=1.0,
+        retries=8, resumes=2, resume_timeout=30.0, echo=sys.stdout.buffer):
+        self.port           = port
+        self.window         = window
+        self.no_crc         = no_crc
+        self.timeout        = timeout
+        self.retries        = retries
+        self.resumes        = resumes
+        self.resume_timeout = resume_timeout
+        self.echo           = echo
+        self.stats = {
+            "bytes":   0, # Image bytes uploaded.
+            "wire":    0, # Bytes sent over the link.
+            "retries": 0, # Frames sent again.
+            "resumes": 0, # Serialboot restarts.
+        }
+
+    # Link -----------------------------------------------------------------------------------------
+    def write(self, data):
+        self.port.write(data)
+        self.stats["wire"] += len(data)
+
+    def read(self, length, timeout=None):
+        # Read length bytes, returns less on timeout.
+        data     = b""
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        while len(data) < length and time.time() < deadline:
+            data += self.port.read(length - len(data))
+        return data
+
+    def wait_magic(self, timeout=None):
+        """Wait for the BIOS serialboot request (echoing the console), then acknowledge it. Returns
+        False when timeout (s) expires first."""
+        buf      = b""
+        deadline = None if timeout is None else time.time() + timeout
+        while not buf.endswith(sfl_magic_req):
+            if deadline is not None and time.time() > deadline:
+                return False
+            c = self.port.read(1)
+            if not c:
+                continue
+            buf = (buf + c)[-len(sfl_magic_req):]
+            if self.echo is not None:
+                self.echo.write(c)
+                self.echo.flush()
+        self.port.write(sfl_magic_ack)
+        return True
+
+    def resume(self):
+        if self.stats["resumes"] >= self.resumes:
+            raise SFLError("Link lost after {} serialboot restarts, giving up".format(self.resumes))
+        print("\n[serialboot] link lost, waiting for serialboot to restart (reset the board or type serialboot)...")
+        self.stats["resumes"] += 1
+        self.port.reset_input_buffer()
+        if not self.wait_magic(self.resume_timeout):
+            raise SFLError("serialboot did not restart within {:.0f}s".format(self.resume_timeout))
+
+    # Commands -------------------------------------------------------------------------------------
+    def command(self, cmd, payload=b""):
+        """Send a single frame, returns its reply byte."""
+        for _ in range(self.retries):
+            self.write(sfl_frame(cmd, payload))
+            reply = self.read(1)
+            if reply == sfl_ack_crcerror:
+                self.stats["retries"] += 1
+                continue
+            if reply == sfl_ack_error:
+                raise SFLError("Command 0x{:02x} failed".format(cmd))
+            if reply:
+                return reply
+            self.stats["retries"] += 1
+        raise SFLError("No reply to command 0x{:02x}".format(cmd))
+
+    def drain(self):
+        # Wait for the link to be quiet (late acknowledges) and discard the received data.
+        while self.read(1, timeout=self.timeout/4):
+            self.port.reset_input_buffer()
+
+    def send_frames(self, frames):
+        """Send LOAD frames by batches of window frames until they are all acknowledged.
+
+        Acknowledges carry no frame identifier and are matched by order within a batch: a frame
+        with a CRC error is queued again, a timeout (lost frame or acknowledge) makes the
+        acknowledges of the batch ambiguous and only this batch is sent again. An error reply is
+        fatal. After retries consecutive timeouts, waits for serialboot to restart.
+        """
+        pending  = deque(frames)
+        timeouts = 0
+        while pending:
+            batch = [pending.popleft() for _ in range(min(self.window, len(pending)))]
+            for frame in batch:
+                self.write(frame)
+            replies = self.read(len(batch))
+            if len(replies) < len(batch):
+                self.drain()
+                self.stats["retries"] += len(batch)
+                pending.extendleft(reversed(batch))
+                timeouts += 1
+                if timeouts >= self.retries:
+                    self.resume()
+                    timeouts = 0
+                continue
+            timeouts = 0
+            for frame, reply in zip(batch, replies):
+                reply = bytes([reply])
+                if reply == sfl_ack_success:
+                    continue
+                if reply == sfl_ack_crcerror:
+                    self.stats["retries"] += 1
+                    pending.append(frame)
+                    continue
+                if reply == sfl_ack_error:
+                    raise SFLError("Load error at 0x{:08x}".format(int.from_bytes(frame[4:8], "big")))
+                raise SFLError("Unexpected reply {!r}".format(reply))
+
+    # Upload ---------------------------------------------------------------------------------------
+    def upload(self, filename, address):
+        with open(filename, "rb") as f:
+            data = f.read()
+        cmd = sfl_cmd_load_no_crc if self.no_crc else sfl_cmd_load
+        print("[serialboot] uploading {} to 0x{:08x} ({} bytes)".format(filename, address, len(data)))
+        frames = []
+        for offset in range(0, len(data), sfl_data_length):
+            frame_address = address + offset
+            frames.append(sfl_frame(cmd, frame_address.to_bytes(4, "big") + data[offset:offset + sfl_data_length]))
+        self.send_frames(frames)
+        self.stats["bytes"] += len(data)
+
+    def boot(self, images, boot_address=None):
+        """Upload the images ({filename: address}) and jump to boot_address (default: address of
+        the last image)."""
+        start = time.time()
+        for filename, address in images.items():
+            self.upload(filename, address)
+        duration = time.time() - start
+        total    = self.stats["bytes"]
+        print("[serialboot] {} bytes in {:.2f}s: {:.1f} KiB/s effective, {:.1f} KiB/s on the link "
+            "({} frames resent, {} resumes)".format(
+            total, duration,
+            total/max(duration, 1e-9)/1024,
+            self.stats["wire"]/max(duration, 1e-9)/1024,
+            self.stats["retries"], self.stats["resumes"]))
+        if boot_address is None:
+            boot_address = list(images.values())[-1]
+        print("[serialboot] booting from 0x{:08x}".format(boot_address))
+        # Only sent again on CRC errors: the BIOS no longer answers serialboot frames after the jump.
+        for _ in range(self.retries):
+            self.write(sfl_frame(sfl_cmd_jump, boot_address.to_bytes(4, "big")))
+            reply = self.read(1)
+            if reply == sfl_ack_crcerror:
+                self.stats["retries"] += 1
+                continue
+            if not reply:
+                print("[serialboot] no acknowledge to the jump (lost?)")
+            elif reply != sfl_ack_success:
+                raise SFLError("Jump failed")
+            return
+        raise SFLError("Jump failed")
+
+def load_images(filename):
+    """images.json: {filename: address}, filenames relative to the directory of the json file."""
+    return read_images_json(filename)
+
+# BIOS stand-in ------------------------------------------------------------------------------------
+
+class SFLStandIn(threading.Thread):
+    """BIOS serialboot stand-in on a pty (tests/benchmarks without hardware).
+
+    RAM is a bytearray at base, error_rate corrupts the received frames (CRC errors), drop_rate
+    drops acknowledges (timeouts), latency delays each acknowledge (USB-UART turnaround).
+    """
+    def __init__(self, base=0x40000000, size=32*1024*1024, error_rate=0.0, drop_rate=0.0, latency=0.0):
+        threading.Thread.__init__(self, daemon=True)
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port       = os.ttyname(self.slave)
+        self.base       = base
+        self.ram        = bytearray(size)
+        self.error_rate = error_rate
+        self.drop_rate  = drop_rate
+        self.latency    = latency
+        self.jump       = None
+        self.rng        = random.Random(0)
+        self.replies    = queue.Queue()
+        threading.Thread(target=self.replier, daemon=True).start()
+
+    def read(self, length):
+        data = b""
+        while len(data) < length:
+            data += os.read(self.master, length - len(data))
+        return data
+
+    def reply(self, data):
+        if self.rng.random() < self.drop_rate:
+            return
+        # Delayed by the latency without blocking the frames reception (as a link turnaround).
+        self.replies.put((time.time() + self.latency, data))
+
+    def replier(self):
+        while True:
+            due, data = self.replies.get()
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.master, data)
+
+    def serialboot(self):
+        # Request repeated until acknowledged (the host may open/flush the port after the start).
+        buf = b""
+        while not buf.endswith(sfl_magic_ack):
+            if not select.select([self.master], [], [], 0.1)[0]:
+                os.write(self.master, b"Booting from serial...\n" + sfl_magic_req)
+                continue
+            buf = (buf + self.read(1))[-len(sfl_magic_ack):]
+
+    def run(self):
+        self.serialboot()
+        while True:
+            header  = bytearray(self.read(4))
+            payload = bytearray(self.read(header[0]))
+            if self.rng.random() < self.error_rate:
+                header[3] ^= 0x01
+            if crc16(bytes(header[3:4] + payload)) != int.from_bytes(header[1:3], "big"):
+                self.reply(sfl_ack_crcerror)
+                continue
+            cmd = header[3]
+            if cmd in [sfl_cmd_load, sfl_cmd_load_no_crc]:
+                address = int.from_bytes(payload[:4], "big") - self.base
+                self.ram[address:address + len(payload) - 4] = payload[4:]
+                self.reply(sfl_ack_success)
+            elif cmd == sfl_cmd_jump:
+                self.jump = int.from_bytes(payload[:4], "big")
+                self.reply(sfl_ack_success)
+                self.reply("Executing booted program at 0x{:08x}\n".format(self.jump).encode())
+                while not self.replies.empty():
+                    time.sleep(0.01)
+                return
+            else:
+                self.reply(sfl_ack_unknown)
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="LiteX BIOS serialboot uploader")
+    parser.add_argument("port", nargs="?",                          help="Serial port (e.g. /dev/ttyUSB1)")
+    parser.add_argument("--images",       default="images.json",    help="Images json file ({filename: address})")
+    parser.add_argument("--speed",        default=1e6, type=float,  help="Serial baudrate")
+    parser.add_argument("--window",       default=8,   type=int,    help="Frames sent ahead of their acknowledge (1: no pipelining)")
+    parser.add_argument("--no-crc",       action="store_true",      help="Don't check the frames CRC in the BIOS")
+    parser.add_argument("--timeout",      default=1.0, type=float,  help="Acknowledges timeout (s)")
+    parser.add_argument("--boot-address", default=None,             help="Jump address (default: address of the last image)")
+    parser.add_argument("--console",      action="store_true",      help="Print the console output after the jump")
+    parser.add_argument("--stand-in",     action="store_true",      help="Upload to a pty BIOS stand-in (no hardware)")
+    parser.add_argument("--stand-in-error-rate", default=0.0, type=float, help="Stand-in frames corruption rate")
+    parser.add_argument("--stand-in-drop-rate",  default=0.0, type=float, help="Stand-in acknowledges drop rate")
+    parser.add_argument("--stand-in-latency",    default=0.0, type=float, help="Stand-in acknowledge latency (s)")
+    args = parser.parse_args()
+
+    import serial
+
+    images = load_images(args.images)
+    stand_in = None
+    if args.stand_in:
+        stand_in = SFLStandIn(
+            base       = min(images.values()) & 0xff000000,
+            error_rate = args.stand_in_error_rate,
+            drop_rate  = args.stand_in_drop_rate,
+            latency    = args.stand_in_latency)
+        stand_in.start()
+        args.port = stand_in.port
+    if args.port is None:
+        parser.error("port is required (or --stand-in)")
+
+    port = serial.serial_for_url(args.port, baudrate=int(args.speed), timeout=0.05)
+    uploader = SFLUploader(port, window=args.window, no_crc=args.no_crc, timeout=args.timeout)
+    print("[serialboot] waiting for serialboot request (reset the board or type serialboot)...")
+    uploader.wait_magic()
+    try:
+        uploader.boot(images, None if args.boot_address is None else int(args.boot_address, 0))
+    except SFLError as e:
+        print("\n[serialboot] {}".format(e))
+        sys.exit(1)
+
+    if stand_in is not None:
+        stand_in.join()
+        for filename, address in images.items():
+            with open(filename, "rb") as f:
+                data = f.read()
+            offset = address - stand_in.base
+            status = "OK" if stand_in.ram[offset:offset + len(data)] == data else "MISMATCH"
+            print("[stand-in] {}: {}".format(filename, status))
+    elif args.console:
+        try:
+            while True:
+                data = port.read(256)
+                if data:
+                    sys.stdout.buffer.write(data)
+                    sys.stdout.buffer.flush()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 
+import re
+import sys
+import json
+import glob
+import shutil
+import hashlib
 import argparse
+import subprocess
+from functools import reduce
+from operator import add, or_
 
 from migen import *
+from migen.genlib.fifo import SyncFIFO
 
 from litex.build.generic_platform import *
 from litex.build.sim import SimPlatform
@@ -21,6 +31,12 @@ from litex.tools.litex_sim import sdram_module_nphases, get_sdram_phy_settings
 from liteeth.phy.model import LiteEthPHYModel
 from liteeth.core.mac import LiteEthMAC
 
+from compress import compress_images
+from layout import get_ram_images, plan_ram_layout, check_ram_layout, get_ram_region, get_ram_constants, get_mem_map
+from layout import get_initrd
+from raminit import get_ram_init_placeholder, get_sdram_init_period, write_ram_init
+from software import generate_dts, compile_dts, compile_emulator
+
 # IOs ----------------------------------------------------------------------------------------------
 
 _io = [
@@ -47,6 +63,7 @@ _io = [
         Subsignal("sink_ready", Pins(1)),
         Subsignal("sink_data",  Pins(8)),
     ),
+    ("sim_trace", 0, Pins(1)),
 ]
 
 # Platform -----------------------------------------------------------------------------------------
@@ -61,7 +78,216 @@ class Supervisor(Module, AutoCSR):
     def __init__(self):
         self._finish  = CSR()  # controlled from CPU
         self.finish = Signal() # controlled from logic
-        self.sync += If(self._finish.re | self.finish, Finish())
+        self.finishing = Signal()
+        self.comb += self.finishing.eq(self._finish.re | self.finish)
+        self.sync += If(self.finishing, Finish())
+
+# SDRAM Statistics ---------------------------------------------------------------------------------
+
+sdram_stats_latency_bins = [8, 16, 32, 64, 128, 256, 512] # read latency histogram (cycles)
+
+class SDRAMStats(Module, AutoCSR):
+    """Commands, row hits/misses/conflicts (DFI) and ports commands/read latencies, exposed
+    through CSRs and displayed on the simulation console on finish."""
+    def __init__(self, dfi, nbanks, ports=[]):
+        self.finish   = Signal()
+        self.counters = []
+        self.port_data_widths = [len(port.rdata.data) for port in ports]
+
+        # # #
+
+        # Cycles
+        self.add_counter("cycles", 1)
+
+        # DFI commands (all phases)
+        def command(phase, ras, cas, we):
+            return ((phase.cs_n != 2**len(phase.cs_n) - 1) &
+                (phase.ras_n == (not ras)) & (phase.cas_n == (not cas)) & (phase.we_n == (not we)))
+        acts   = [command(p, 1, 0, 0) for p in dfi.phases]
+        reads  = [command(p, 0, 1, 0) for p in dfi.phases]
+        writes = [command(p, 0, 1, 1) for p in dfi.phases]
+        pres   = [command(p, 1, 0, 1) for p in dfi.phases]
+        refs   = [command(p, 1, 1, 0) for p in dfi.phases]
+        self.add_counter("activates",  reduce(add, acts))
+        self.add_counter("reads",      reduce(add, reads))
+        self.add_counter("writes",     reduce(add, writes))
+        self.add_counter("precharges", reduce(add, pres))
+        self.add_counter("refreshes",  reduce(add, refs))
+
+        # Column commands classified from the open row of each bank: hits (row already open and
+        # accessed), misses (first access after activating an idle bank: never opened or closed by a
+        # precharge all/refresh, or same row reopened) and conflicts (first access after closing the
+        # row of the bank to activate another one).
+        close_all = Signal()
+        self.comb += close_all.eq(reduce(or_,
+            [pre & p.address[10] for pre, p in zip(pres, dfi.phases)] + refs))
+        hits, misses, conflicts = [], [], []
+        for b in range(nbanks):
+            act, col = Signal(), Signal()
+            act_row  = Signal(len(dfi.phases[0].address))
+            row      = Signal(len(dfi.phases[0].address)) # Open (or last opened) row.
+            row_valid, miss, conflict = Signal(), Signal(), Signal()
+            self.comb += [
+                act.eq(reduce(or_, [a & (p.bank == b) for a, p in zip(acts, dfi.phases)])),
+                act_row.eq(reduce(or_, [Mux(a & (p.bank == b), p.address, 0) for a, p in zip(acts, dfi.phases)])),
+                col.eq(reduce(or_, [(r | w) & (p.bank == b) for r, w, p in zip(reads, writes, dfi.phases)])),
+            ]
+            self.sync += [
+                If(act,
+                    row.eq(act_row),
+                    row_valid.eq(1),
+                    miss.eq(~row_valid | (row == act_row)),
+                    conflict.eq(row_valid & (row != act_row))
+                ).Elif(col,
+                    miss.eq(0),
+                    conflict.eq(0)
+                ),
+                If(close_all & ~act,
+                    row_valid.eq(0)
+                )
+            ]
+            hits.append(col & ~miss & ~conflict)
+            misses.append(col & miss)
+            conflicts.append(col & conflict)
+        self.add_counter("row_hits",      reduce(add, hits))
+        self.add_counter("row_misses",    reduce(add, misses))
+        self.add_counter("row_conflicts", reduce(add, conflicts))
+
+        # Ports commands and read latency histogram
+        timestamp = Signal(16)
+        self.sync += timestamp.eq(timestamp + 1)
+        for n, port in enumerate(ports):
+            read  = port.cmd.valid & port.cmd.ready & ~port.cmd.we
+            write = port.cmd.valid & port.cmd.ready &  port.cmd.we
+            self.add_counter("port{}_reads".format(n),  read)
+            self.add_counter("port{}_writes".format(n), write)
+            # Reads are returned in order: latency from the timestamp of the oldest read command.
+            fifo = SyncFIFO(len(timestamp), 64)
+            self.submodules += fifo
+            latency = Signal(16)
+            rdata   = Signal()
+            self.comb += [
+                fifo.din.eq(timestamp),
+                fifo.we.eq(read),
+                rdata.eq(port.rdata.valid & port.rdata.ready & fifo.readable),
+                fifo.re.eq(rdata),
+                latency.eq(timestamp - fifo.dout),
+            ]
+            bins = [latency < sdram_stats_latency_bins[0]]
+            for low, high in zip(sdram_stats_latency_bins, sdram_stats_latency_bins[1:]):
+                bins.append((latency >= low) & (latency < high))
+            bins.append(latency >= sdram_stats_latency_bins[-1])
+            for i, b in enumerate(bins):
+                self.add_counter("port{}_read_latency{}".format(n, i), rdata & b)
+
+    def add_counter(self, name, increment):
+        counter = Signal(32)
+        csr     = CSRStatus(32, name=name)
+        setattr(self, "_" + name, csr)
+        self.sync += counter.eq(counter + increment)
+        self.comb += csr.status.eq(counter)
+        self.counters.append((name, counter))
+
+    def do_finalize(self):
+        names, counters = zip(*self.counters)
+        self.sync += If(self.finish,
+            Display("SDRAM_STATS: " + " ".join("{}=%0d".format(name) for name in names), *counters)
+        )
+
+def get_sdram_stats(log, sys_clk_freq, port_data_widths=[]):
+    """SDRAM statistics report from the simulation console log."""
+    lines = re.findall(r"SDRAM_STATS: (.*)", log)
+    if not lines:
+        return None
+    counters = {k: int(v) for k, v in (item.split("=") for item in lines[-1].split())}
+    duration = counters["cycles"]/sys_clk_freq
+    columns  = counters["row_hits"] + counters["row_misses"] + counters["row_conflicts"]
+    stats = {
+        "cycles":         counters["cycles"],
+        "duration":       duration,
+        "commands":       {k: counters[k] for k in ["activates", "reads", "writes", "precharges", "refreshes"]},
+        "row_hits":       counters["row_hits"],
+        "row_misses":     counters["row_misses"],
+        "row_conflicts":  counters["row_conflicts"],
+        "row_hit_ratio":  counters["row_hits"]/columns if columns else None,
+        "ports":          [],
+    }
+    bins = ["<{}".format(sdram_stats_latency_bins[0])]
+    bins += ["{}-{}".format(low, high - 1) for low, high in zip(sdram_stats_latency_bins, sdram_stats_latency_bins[1:])]
+    bins += [">={}".format(sdram_stats_latency_bins[-1])]
+    for n, data_width in enumerate(port_data_widths):
+        reads  = counters["port{}_reads".format(n)]
+        writes = counters["port{}_writes".format(n)]
+        stats["ports"].append({
+            "reads":  reads,
+            "writes": writes,
+            "read_bandwidth":  reads*data_width//8/duration if duration else None, # bytes/s
+            "write_bandwidth": writes*data_width//8/duration if duration else None, # bytes/s
+            "read_latency":    {b: counters["port{}_read_latency{}".format(n, i)] for i, b in enumerate(bins)},
+        })
+    return stats
+
+# Trace Trigger ------------------------------------------------------------------------------------
+
+class TraceTrigger(Module):
+    """Enables the waveforms dump (sim_trace) for cycles cycles (0: until the end) once triggered."""
+    def __init__(self, cycles=0):
+        self.enable   = Signal()
+        self.triggers = []
+
+        # # #
+
+        self.trigger = trigger = Signal()
+        done = Signal()
+        self.sync += If(~done & trigger, self.enable.eq(1))
+        if cycles:
+            count = Signal(max=max(cycles, 2))
+            self.sync += If(self.enable,
+                count.eq(count + 1),
+                If(count == (cycles - 1),
+                    self.enable.eq(0),
+                    done.eq(1)
+                )
+            )
+
+    def add_bus_trigger(self, bus, address):
+        """Access of a Wishbone bus to address (for instruction buses: refill of the cache line
+        containing address, not its execution)."""
+        trigger = Signal()
+        self.comb += trigger.eq(bus.cyc & bus.stb & bus.ack & (bus.adr == (address >> 2)))
+        self.triggers.append(trigger)
+
+    def add_stream_trigger(self, valid, ready, data, string):
+        """String in a byte stream (console)."""
+        string  = string.encode()
+        trigger = Signal()
+        history = Signal(8*len(string))
+        self.sync += If(valid & ready, history.eq(Cat(data, history[:-8])))
+        self.comb += trigger.eq(history == int.from_bytes(string, "big"))
+        self.triggers.append(trigger)
+
+    def do_finalize(self):
+        self.comb += self.trigger.eq(reduce(or_, self.triggers))
+
+# Console Cycles -----------------------------------------------------------------------------------
+
+class ConsoleCycles(Module):
+    """Prints the cycles since reset when a string is written to a byte stream (console): simulated
+    time of the boot checkpoints, independent of the host."""
+    def __init__(self, valid, ready, data, strings):
+        self.cycles = cycles = Signal(64)
+        self.sync += cycles.eq(cycles + 1)
+        for n, string in enumerate(strings):
+            string  = string.encode()
+            history = Signal(8*len(string))
+            match   = Signal()
+            match_d = Signal()
+            self.sync += If(valid & ready, history.eq(Cat(data, history[:-8])))
+            self.comb += match.eq(history == int.from_bytes(string, "big"))
+            self.sync += [
+                match_d.eq(match),
+                If(match & ~match_d, Display("CONSOLE_CYCLES {}: %0d".format(n), cycles))
+            ]
 
 # SoCLinux -----------------------------------------------------------------------------------------
 
@@ -87,18 +313,25 @@ class SoCLinux(SoCSDRAM):
         sdram_module          = "MT48LC16M16",
         sdram_data_width      = 32,
         sdram_verbosity       = 0,
-        with_ethernet         = False):
+        with_ethernet         = False,
+        ram_layout            = None,
+        ram_layout_constants  = False,
+        runtime_ram_init      = False,
+        trace_triggers        = {},
+        trace_cycles          = 0,
+        console_cycles        = [],
+        with_sdram_stats      = False):
         platform     = Platform()
         sys_clk_freq = int(1e6)
 
+        if ram_layout is None:
+            ram_layout = plan_ram_layout(get_ram_images())
+
         ram_init = []
-        if init_memories:
-            ram_init = get_mem_data({
-                "buildroot/Image":       "0x00000000",
-                "buildroot/rootfs.cpio": "0x00800000",
-                "buildroot/rv32.dtb":    "0x01000000",
-                "emulator/emulator.bin": "0x01100000",
-                }, "little")
+        if runtime_ram_init:
+            ram_init = get_ram_init_placeholder(1)
+        elif init_memories:
+            ram_init = get_mem_data(get_mem_map(ram_layout), "little")
 
         # SoCSDRAM ----------------------------------------------------------------------------------
         SoCSDRAM.__init__(self, platform, clk_freq=sys_clk_freq,
@@ -108,7 +341,7 @@ class SoCLinux(SoCSDRAM):
             max_sdram_size           = 0x10000000, # Limit mapped SDRAM to 1GB.
             integrated_rom_size      = 0x8000,
             integrated_main_ram_size = 0x00000000 if with_sdram else 0x02000000, # 32MB
-            integrated_main_ram_init = [] if (with_sdram or not init_memories) else ram_init)
+            integrated_main_ram_init = [] if with_sdram else ram_init)
         self.add_constant("SIM", None)
 
         # Supervisor -------------------------------------------------------------------------------
@@ -118,9 +351,14 @@ class SoCLinux(SoCSDRAM):
         # CRG --------------------------------------------------------------------------------------
         self.submodules.crg = CRG(platform.request("sys_clk"))
 
-        # Machine mode emulator RAM ----------------------------------------------------------------
-        self.add_memory_region("emulator", self.mem_map["main_ram"] + 0x01100000, 0x4000, type="cached+linker")
+        # RAM layout / Machine mode emulator RAM ---------------------------------------------------
+        emulator = get_ram_region(ram_layout, "EMULATOR")
+        self.add_memory_region("emulator", self.mem_map["main_ram"] + emulator["offset"], emulator["size"],
+            type="cached+linker")
         self.add_constant("ROM_BOOT_ADDRESS", self.bus.regions["emulator"].origin)
+        if ram_layout_constants:
+            for name, value in get_ram_constants(ram_layout).items():
+                self.add_constant(name, value)
 
         # SDRAM ------------------------------------------------------------------------------------
         if with_sdram:
@@ -132,6 +370,10 @@ class SoCLinux(SoCSDRAM):
                 memtype    = sdram_module.memtype,
                 data_width = sdram_data_width,
                 clk_freq   = sdram_clk_freq)
+            if runtime_ram_init:
+                # One row of placeholder words for all the banks: the model splits the init in banks.
+                ram_init = get_ram_init_placeholder(get_sdram_init_period(sdram_module.geom_settings,
+                    phy_settings.databits))
             self.submodules.sdrphy = SDRAMPHYModel(
                 module    = sdram_module,
                 settings  = phy_settings,
@@ -146,6 +388,34 @@ class SoCLinux(SoCSDRAM):
             self.add_constant("MEMTEST_BUS_SIZE",  0)
             self.add_constant("MEMTEST_ADDR_SIZE", 0)
             self.add_constant("MEMTEST_DATA_SIZE", 0)
+            if with_sdram_stats:
+                self.submodules.sdram_stats = SDRAMStats(self.sdrphy.dfi,
+                    nbanks = 2**sdram_module.geom_settings.bankbits,
+                    ports  = self.sdram.crossbar.masters)
+                self.add_csr("sdram_stats")
+                self.comb += self.sdram_stats.finish.eq(self.supervisor.finishing)
+        check_ram_layout(ram_layout, self.bus.regions["main_ram"].size)
+
+        # Trace Trigger ----------------------------------------------------------------------------
+        if trace_triggers:
+            self.submodules.trace_trigger = TraceTrigger(trace_cycles)
+            if "fetch" in trace_triggers:
+                # VexRiscv internals (retired PC) are not visible from the SoC: I-cache refills.
+                self.trace_trigger.add_bus_trigger(self.cpu.ibus, trace_triggers["fetch"])
+            if "address" in trace_triggers:
+                self.trace_trigger.add_bus_trigger(self.cpu.dbus, trace_triggers["address"])
+            if "console" in trace_triggers:
+                serial = platform.lookup_request("serial")
+                self.trace_trigger.add_stream_trigger(
+                    serial.source_valid, serial.source_ready, serial.source_data, trace_triggers["console"])
+            # LiteX's simulator only dumps the waveforms while sim_trace is set.
+            self.comb += platform.request("sim_trace").eq(self.trace_trigger.enable)
+
+        # Console Cycles ---------------------------------------------------------------------------
+        if console_cycles:
+            serial = platform.lookup_request("serial")
+            self.submodules.console_cycles = ConsoleCycles(
+                serial.source_valid, serial.source_ready, serial.source_data, console_cycles)
 
         # Ethernet ---------------------------------------------------------------------------------
         if with_ethernet:
@@ -161,19 +431,212 @@ class SoCLinux(SoCSDRAM):
             self.add_csr("ethmac")
             self.add_interrupt("ethmac")
 
-    def generate_dts(self, board_name):
-        json = os.path.join("build", board_name, "csr.json")
-        dts = os.path.join("build", board_name, "{}.dts".format(board_name))
-        os.system("./json2dts.py {} > {}".format(json, dts))
-
-    def compile_dts(self, board_name):
-        dts = os.path.join("build", board_name, "{}.dts".format(board_name))
-        dtb = os.path.join("buildroot", "rv32.dtb")
-        os.system("dtc -O dtb -o {} {}".format(dtb, dts))
-
-    def compile_emulator(self, board_name):
-        os.environ["BOARD"] = board_name
-        os.system("cd emulator && make")
+# Trace signals filter -----------------------------------------------------------------------------
+
+def write_trace_filter(filename, scopes):
+    """Verilator configuration only tracing the given scopes (and their sub-scopes)."""
+    with open(filename, "w") as f:
+        f.write("`verilator_config\n")
+        f.write("tracing_off -scope \"*\"\n")
+        for scope in scopes:
+            f.write("tracing_on -scope \"{}\"\n".format(scope))
+            f.write("tracing_on -scope \"{}.*\"\n".format(scope))
+
+def get_sim(gateware_dir):
+    sims = [f for f in glob.glob(os.path.join(gateware_dir, "obj_dir", "V*")) if os.path.isfile(f) and os.access(f, os.X_OK)]
+    if not sims:
+        raise OSError("No simulator found in {}".format(os.path.join(gateware_dir, "obj_dir")))
+    return os.path.relpath(sims[0], gateware_dir)
+
+def run_sim(gateware_dir, checkpoint_at=None, checkpoint_dir=None, logfile=None):
+    """Run the compiled simulator (same as LiteX's run, without rebuilding)."""
+    if checkpoint_at is not None:
+        relay_sim([get_sim(gateware_dir)], gateware_dir,
+            pattern  = re.compile(checkpoint_at.encode()),
+            on_match = lambda pid: checkpoint_sim(pid, checkpoint_dir),
+            logfile  = logfile)
+        return
+    if logfile is not None:
+        relay_sim([get_sim(gateware_dir)], gateware_dir, logfile=logfile)
+        return
+    import termios
+    try:
+        termios_settings = termios.tcgetattr(sys.stdin.fileno())
+    except termios.error:
+        termios_settings = None
+    try:
+        subprocess.call([get_sim(gateware_dir)], cwd=gateware_dir)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if termios_settings is not None:
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSAFLUSH, termios_settings)
+
+# Checkpoint / Restore -----------------------------------------------------------------------------
+
+# The simulator process (CPU, RAM/SDRAM models, peripherals and sim modules) is checkpointed as a
+# whole with CRIU. It runs on a pseudo-terminal relayed to the console so that its terminal can be
+# migrated (--shell-job): on restore, the restored simulator gets a new one.
+
+def get_criu_command(*args):
+    return (["sudo"] if os.geteuid() != 0 else []) + ["criu", *args, "--shell-job"]
+
+def relay_sim(command, cwd=None, pattern=None, on_match=None, logfile=None):
+    """Run command on a pseudo-terminal relayed to stdin/stdout (and logfile), call on_match(pid)
+    once on pattern."""
+    import pty
+    import tty
+    import select
+    import termios
+    pid, fd = pty.fork()
+    if pid == 0:
+        if cwd is not None:
+            os.chdir(cwd)
+        os.execvp(command[0], command)
+    stdin  = sys.stdin.fileno()
+    stdout = sys.stdout.fileno()
+    termios_settings = None
+    if os.isatty(stdin):
+        termios_settings = termios.tcgetattr(stdin)
+        tty.setraw(stdin)
+    inputs = [fd, stdin]
+    output = b""
+    log    = open(logfile, "wb") if logfile is not None else None
+    try:
+        while True:
+            for i in select.select(inputs, [], [])[0]:
+                if i == stdin:
+                    data = os.read(stdin, 1024)
+                    if data:
+                        os.write(fd, data)
+                    else:
+                        inputs.remove(stdin)
+                    continue
+                try:
+                    data = os.read(fd, 4096)
+                except OSError: # EIO: simulator exited.
+                    data = b""
+                if not data:
+                    return os.waitpid(pid, 0)[1]
+                os.write(stdout, data)
+                if log is not None:
+                    log.write(data)
+                if pattern is not None:
+                    output = (output + data)[-4096:]
+                    if pattern.search(output):
+                        pattern = None
+                        on_match(pid)
+    finally:
+        if log is not None:
+            log.close()
+        if termios_settings is not None:
+            termios.tcsetattr(stdin, termios.TCSAFLUSH, termios_settings)
+
+def checkpoint_sim(pid, checkpoint_dir):
+    # Restore needs the same simulator/modules files: rebuilding the simulator invalidates the checkpoint.
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.makedirs(checkpoint_dir)
+    subprocess.check_call(get_criu_command("dump", "-t", str(pid), "-D", checkpoint_dir, "--log-file", "dump.log"))
+    print("\r\nCheckpoint saved to {}, restore with: ./sim.py --restore {}\r".format(checkpoint_dir, checkpoint_dir))
+
+def restore_sim(checkpoint_dir):
+    if not os.path.exists(os.path.join(checkpoint_dir, "inventory.img")):
+        raise OSError("No checkpoint found in {}".format(checkpoint_dir))
+    relay_sim(get_criu_command("restore", "-D", checkpoint_dir, "--log-file", "restore.log"))
+
+# Verilator model cache ----------------------------------------------------------------------------
+
+# Extensions of the files of the gateware directory not part of the key. Memory init files ($readmemh)
+# are read by the simulator at runtime: not part of the model, the RAM init files are rewritten with
+# the images before each run.
+verilator_cache_excludes = [".sh", ".vcd", ".fst", ".log", ".init"]
+
+def get_file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def get_verilator_key(args, kwargs, mods_dir):
+    # Key: generated files of the gateware directory (Verilog, C++ header/main, sim config...),
+    # sources (CPU...), build arguments, LiteX sim core and tools versions.
+    from litex.build.sim import verilator
+    files = {}
+    for name in sorted(os.listdir(".")):
+        if os.path.isfile(name) and os.path.splitext(name)[1] not in verilator_cache_excludes:
+            files[name] = get_file_hash(name)
+    core_dir = os.path.join(os.path.dirname(verilator.__file__), "core")
+    for root, dirs, names in sorted(os.walk(core_dir)):
+        for name in sorted(names):
+            files[os.path.relpath(os.path.join(root, name), core_dir)] = get_file_hash(os.path.join(root, name))
+    def encode(arg):
+        # Sources: (filename, language, library) tuples, hashed by content.
+        if isinstance(arg, (list, tuple)) and all(isinstance(a, (list, tuple)) and len(a) and os.path.isfile(str(a[0])) for a in arg):
+            return sorted([get_file_hash(a[0])] + [str(x) for x in a[1:]] for a in arg)
+        if isinstance(arg, (list, tuple)):
+            return [encode(a) for a in arg]
+        if isinstance(arg, (str, int, float, bool, type(None))):
+            return arg
+        # Other objects (platform...): their output is already in the generated files.
+        return type(arg).__name__
+    versions = {}
+    for tool in ["verilator", os.environ.get("CXX", "g++")]:
+        try:
+            versions[tool] = subprocess.check_output([tool, "--version"], stderr=subprocess.DEVNULL).decode()
+        except (OSError, subprocess.CalledProcessError):
+            versions[tool] = None
+    config = {
+        "files":      files,
+        "args":       [encode(a) for a in args],
+        "kwargs":     {k: encode(v) for k, v in sorted(kwargs.items())},
+        # Extra sim modules (ethernet_udp...): compiled from their sources (mods_dir: LiteX does not
+        # pass extra_mods_path to _build_sim).
+        "extra_mods": {os.path.relpath(os.path.join(root, name), mods_dir): get_file_hash(os.path.join(root, name))
+            for root, dirs, names in sorted(os.walk(mods_dir)) for name in sorted(names)},
+        "versions":   versions,
+        "env":        {k: os.environ.get(k) for k in ["CXXFLAGS", "LDFLAGS", "OBJCACHE"]},
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def enable_verilator_cache(cache_dir, mods_dir, cache_size=8):
+    """Reuse the compiled simulator (obj_dir/V* + modules) when the generated gateware, sim config
+    and compile flags are unchanged: wraps LiteX's Verilator build."""
+    from litex.build.sim import verilator
+    cache_dir  = os.path.abspath(cache_dir)
+    _build_sim = verilator._build_sim
+    def _cached_build_sim(*args, **kwargs):
+        key   = get_verilator_key(args, kwargs, mods_dir)
+        entry = os.path.join(cache_dir, key)
+        if os.path.exists(os.path.join(entry, "done")):
+            print("Verilator cache hit ({}), reusing the compiled simulator.".format(key[:16]))
+            shutil.rmtree("obj_dir", ignore_errors=True)
+            shutil.rmtree("modules", ignore_errors=True)
+            shutil.copytree(os.path.join(entry, "obj_dir"), "obj_dir")
+            shutil.copytree(os.path.join(entry, "modules"), "modules")
+            os.utime(entry)
+            return
+        _build_sim(*args, **kwargs)
+        # Only keep what is needed to run: simulator binary and modules (concurrent builds of the
+        # same model: the first one is kept).
+        tmp = "{}.{}.tmp".format(entry, os.getpid())
+        os.makedirs(os.path.join(tmp, "obj_dir"))
+        for name in os.listdir("obj_dir"):
+            filename = os.path.join("obj_dir", name)
+            if name.startswith("V") and os.path.isfile(filename) and os.access(filename, os.X_OK):
+                shutil.copy2(filename, os.path.join(tmp, "obj_dir"))
+        shutil.copytree("modules", os.path.join(tmp, "modules"))
+        open(os.path.join(tmp, "done"), "w").close()
+        if not os.path.exists(os.path.join(entry, "done")):
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                pass
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Keep the cache_size most recently used entries.
+        entries = sorted((os.path.join(cache_dir, e) for e in os.listdir(cache_dir) if not e.endswith(".tmp")),
+            key=os.path.getmtime, reverse=True)
+        for e in entries[cache_size:]:
+            shutil.rmtree(e, ignore_errors=True)
+    verilator._build_sim = _cached_build_sim
 
 # Build --------------------------------------------------------------------------------------------
 
@@ -183,48 +646,147 @@ def main():
     parser.add_argument("--sdram-module",         default="MT48LC16M16",   help="Select SDRAM chip")
     parser.add_argument("--sdram-data-width",     default=32,              help="Set SDRAM chip data width")
     parser.add_argument("--sdram-verbosity",      default=0,               help="Set SDRAM checker verbosity")
+    parser.add_argument("--sdram-stats",          action="store_true",     help="collect SDRAM statistics (CSRs, JSON report on finish)")
     parser.add_argument("--with-ethernet",        action="store_true",     help="enable Ethernet support")
     parser.add_argument("--local-ip",             default="192.168.1.50",  help="Local IP address of SoC (default=192.168.1.50)")
     parser.add_argument("--remote-ip",            default="192.168.1.100", help="Remote IP address of TFTP server (default=192.168.1.100)")
+    parser.add_argument("--eth-udp-port",         default=None,            help="exchange the Ethernet frames over UDP with simnet.py on this port (no tap0)")
     parser.add_argument("--trace",                action="store_true",     help="enable VCD tracing")
     parser.add_argument("--trace-start",          default=0,               help="cycle to start VCD tracing")
     parser.add_argument("--trace-end",            default=-1,              help="cycle to end VCD tracing")
+    parser.add_argument("--trace-fst",            action="store_true",     help="compressed FST waveforms instead of VCD")
+    parser.add_argument("--trace-signals",        action="append",         help="only trace this Verilator scope (ex: TOP.dut.VexRiscv), can be repeated")
+    parser.add_argument("--trace-trigger-fetch",  default=None,            help="start tracing on the I-cache refill of the line containing this instruction address")
+    parser.add_argument("--trace-trigger-address", default=None,           help="start tracing on a CPU data bus access to this address")
+    parser.add_argument("--trace-trigger-console", default=None,           help="start tracing when this string is written to the console")
+    parser.add_argument("--trace-cycles",         default=0,               help="cycles traced once triggered (0: until the end)")
+    parser.add_argument("--console-cycles",       action="append",         help="print the cycles since reset (CONSOLE_CYCLES n: cycles) when this string is written to the console, can be repeated")
     parser.add_argument("--opt-level",            default="O3",            help="compilation optimization level")
+    parser.add_argument("--output-dir",           default=None,            help="isolated build directory (SoC, images, emulator), for concurrent simulations")
+    parser.add_argument("--no-sim-cache",         action="store_true",     help="always recompile the Verilated model")
+    parser.add_argument("--sim-cache-dir",        default="build/.verilator_cache", help="compiled Verilated models cache")
+    parser.add_argument("--ccache",               action="store_true",     help="use ccache for the Verilated model C++ compilation")
+    parser.add_argument("--runtime-ram-init",     action="store_true",     help="load the images in RAM when the simulation starts (not in the gateware)")
+    parser.add_argument("--checkpoint-at",        default=None,            help="checkpoint the simulation (CRIU) when the console matches this regular expression")
+    parser.add_argument("--checkpoint-dir",       default=None,            help="checkpoint directory (default=<output-dir>/checkpoint)")
+    parser.add_argument("--restore",              default=None,            help="restore the simulation from a checkpoint directory")
+    parser.add_argument("--compress",             action="store_true",     help="boot from compressed images (LZ4 kernel, gzip rootfs)")
+    parser.add_argument("--emulator-stats",       action="store_true",     help="build the emulator with trap statistics (emulator_stats.py)")
+    parser.add_argument("--layout",               default="fixed",         choices=["fixed", "packed"], help="images layout: BIOS fixed offsets or packed from the images sizes")
+    parser.add_argument("--kernel-margin",        default="0x100000",      help="RAM reserved after the kernel Image (.bss, early allocations, packed layout)")
     args = parser.parse_args()
 
+    if args.restore is not None:
+        restore_sim(args.restore)
+        return
+
+    if args.sdram_stats and not args.with_sdram:
+        parser.error("--sdram-stats requires --with-sdram")
+
+    # Checkpointing and SDRAM statistics report need to run the simulator itself.
+    if args.checkpoint_at is not None or args.sdram_stats:
+        args.runtime_ram_init = True
+
     sim_config = SimConfig(default_clk="sys_clk")
     sim_config.add_module("serial2console", "serial")
-    if args.with_ethernet:
+    eth_kwargs = {}
+    if args.with_ethernet and args.eth_udp_port is not None:
+        # Userspace backend: frames as UDP datagrams to/from simnet.py (port + 1), unprivileged.
+        eth_udp_port = int(args.eth_udp_port)
+        sim_config.add_module("ethernet_udp", "eth", args={"host": "127.0.0.1",
+            "port": str(eth_udp_port), "remote_port": str(eth_udp_port + 1)})
+        eth_kwargs = {"extra_mods": ["ethernet_udp"], "extra_mods_path": os.path.abspath("sim_modules")}
+    elif args.with_ethernet:
         sim_config.add_module("ethernet", "eth", args={"interface": "tap0", "ip": args.remote_ip})
 
-    for i in range(2):
+    if not args.no_sim_cache:
+        enable_verilator_cache(args.sim_cache_dir, os.path.abspath("sim_modules"))
+    if args.ccache:
+        # Used by Verilator's generated Makefiles: partial rebuilds on cache misses.
+        os.environ["OBJCACHE"] = "ccache"
+
+    # Waveforms ------------------------------------------------------------------------------------
+    trace_triggers = {}
+    if args.trace_trigger_fetch is not None:
+        trace_triggers["fetch"] = int(args.trace_trigger_fetch, 0)
+    if args.trace_trigger_address is not None:
+        trace_triggers["address"] = int(args.trace_trigger_address, 0)
+    if args.trace_trigger_console is not None:
+        trace_triggers["console"] = args.trace_trigger_console
+    trace = args.trace or bool(trace_triggers) or args.trace_fst or args.trace_signals is not None
+    trace_kwargs = {"trace_fst": True} if args.trace_fst else {}
+
+    # Output directories (isolated simulations keep every output under output_dir) ---------------
+    cwd = os.getcwd()
+    if args.output_dir is not None:
+        build_dir    = args.output_dir
+        images_dir   = build_dir
+        emulator_dir = os.path.join(build_dir, "emulator")
+    else:
+        build_dir    = os.path.join("build", "sim")
+        images_dir   = "buildroot"
+        emulator_dir = "emulator"
+    checkpoint_dir = args.checkpoint_dir or os.path.join(build_dir, "checkpoint")
+
+    if args.compress:
+        compress_images(images_dir)
+    ram_layout = plan_ram_layout(get_ram_images(images_dir, emulator_dir, args.compress),
+        kernel_margin=int(args.kernel_margin, 0), policy=args.layout)
+
+    # With runtime RAM init, the gateware does not depend on the images: a single build, then the
+    # images are loaded in the RAM init files before running the simulator.
+    passes = [True] if args.runtime_ram_init else [False, True]
+    for i, compile_gateware in enumerate(passes):
         soc = SoCLinux(i!=0,
             with_sdram            = args.with_sdram,
             sdram_module          = args.sdram_module,
             sdram_data_width      = int(args.sdram_data_width),
             sdram_verbosity       = int(args.sdram_verbosity),
-            with_ethernet         = args.with_ethernet)
+            with_ethernet         = args.with_ethernet,
+            ram_layout            = ram_layout,
+            ram_layout_constants  = args.layout == "packed",
+            runtime_ram_init      = args.runtime_ram_init,
+            trace_triggers        = trace_triggers,
+            trace_cycles          = int(args.trace_cycles),
+            console_cycles        = args.console_cycles or [],
+            with_sdram_stats      = args.sdram_stats)
+        if args.trace_signals is not None:
+            trace_filter = os.path.abspath(os.path.join(build_dir, "trace_filter.vlt"))
+            os.makedirs(build_dir, exist_ok=True)
+            write_trace_filter(trace_filter, args.trace_signals)
+            soc.platform.add_source(trace_filter, "verilog") # .vlt: Verilator configuration file
         if args.with_ethernet:
-            for i in range(4):
-                soc.add_constant("LOCALIP{}".format(i+1), int(args.local_ip.split(".")[i]))
-            for i in range(4):
-                soc.add_constant("REMOTEIP{}".format(i+1), int(args.remote_ip.split(".")[i]))
-        board_name = "sim"
-        build_dir = os.path.join("build", board_name)
+            for n in range(4):
+                soc.add_constant("LOCALIP{}".format(n+1), int(args.local_ip.split(".")[n]))
+            for n in range(4):
+                soc.add_constant("REMOTEIP{}".format(n+1), int(args.remote_ip.split(".")[n]))
         builder = Builder(soc, output_dir=build_dir,
-            compile_gateware = i!=0,
+            compile_gateware = compile_gateware,
             csr_json         = os.path.join(build_dir, "csr.json"))
         builder.build(sim_config=sim_config,
-            run         = i!=0,
+            run         = compile_gateware and not args.runtime_ram_init,
             opt_level   = args.opt_level,
-            trace       = args.trace,
+            trace       = trace,
             trace_start = int(args.trace_start),
-            trace_end   = int(args.trace_end))
+            trace_end   = int(args.trace_end),
+            **trace_kwargs,
+            **eth_kwargs)
+        os.chdir(cwd)
         if i == 0:
-            os.chdir("..")
-            soc.generate_dts(board_name)
-            soc.compile_dts(board_name)
-            soc.compile_emulator(board_name)
+            generate_dts(build_dir, "sim", get_initrd(ram_layout))
+            compile_dts(build_dir, "sim", os.path.join(images_dir, "rv32.dtb"))
+            compile_emulator(build_dir, emulator_dir, args.emulator_stats)
+        if args.runtime_ram_init:
+            gateware_dir = os.path.join(build_dir, "gateware")
+            write_ram_init(gateware_dir, ram_layout)
+            logfile = os.path.join(build_dir, "sim.log") if args.sdram_stats else None
+            run_sim(gateware_dir, args.checkpoint_at, checkpoint_dir, logfile)
+            if args.sdram_stats:
+                with open(logfile, errors="replace") as f:
+                    sdram_stats = get_sdram_stats(f.read(), soc.clk_freq, soc.sdram_stats.port_data_widths)
+                if sdram_stats is not None:
+                    with open(os.path.join(build_dir, "sdram_stats.json"), "w") as f:
+                        json.dump(sdram_stats, f, indent=4)
 
 
 if __name__ == "__main__":
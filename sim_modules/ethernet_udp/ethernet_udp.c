@@ -0,0 +1,288 @@
+/* LiteX simulation module: userspace Ethernet backend. The frames of the simulated Ethernet PHY
+   (LiteEthPHYModel pads) are exchanged as UDP datagrams (one frame per datagram) with a host
+   network stack (simnet.py): no tap interface, no privileges. */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/socket.h>
+#include <netinet/in.h>
+#include <arpa/inet.h>
+#include "error.h"
+#include <event2/event.h>
+#include <json-c/json.h>
+#include "modules.h"
+
+#define ETH_FRAME_MAX 2048
+#define RX_QUEUE_MAX  1024
+
+struct eth_frame_s {
+	char data[ETH_FRAME_MAX];
+	size_t len;
+	struct eth_frame_s *next;
+};
+
+struct session_s {
+	char *tx;
+	char *tx_valid;
+	char *tx_ready;
+	char *rx;
+	char *rx_valid;
+	char *rx_ready;
+	char *sys_clk;
+	clk_edge_state_t edge;
+	int fd;
+	struct event *ev;
+	struct sockaddr_in remote;
+	char txbuf[ETH_FRAME_MAX];
+	size_t txlen;
+	char rxbuf[ETH_FRAME_MAX];
+	size_t rxlen;
+	size_t rxsent;
+	struct eth_frame_s *rxqueue;
+	struct eth_frame_s *rxqueue_last;
+	int rxqueue_len;
+};
+
+static struct event_base *base = NULL;
+
+static int litex_sim_module_get_args(char *args, char *arg, char **val)
+{
+	int ret = RC_OK;
+	json_object *jsobj = NULL;
+	json_object *obj = NULL;
+	char *value = NULL;
+	int r;
+
+	jsobj = json_tokener_parse(args);
+	if(NULL == jsobj) {
+		fprintf(stderr, "[ethernet_udp] Error parsing json arg: %s\n", args);
+		ret = RC_JSERROR;
+		goto out;
+	}
+	if(!json_object_is_type(jsobj, json_type_object)) {
+		fprintf(stderr, "[ethernet_udp] Arg must be type object: %s\n", args);
+		ret = RC_JSERROR;
+		goto out;
+	}
+	obj = NULL;
+	r = json_object_object_get_ex(jsobj, arg, &obj);
+	if(!r) {
+		fprintf(stderr, "[ethernet_udp] Could not find object: \"%s\" (%s)\n", arg, args);
+		ret = RC_JSERROR;
+		goto out;
+	}
+	value = strdup(json_object_get_string(obj));
+
+out:
+	*val = value;
+	return ret;
+}
+
+static int litex_sim_module_pads_get(struct pad_s *pads, char *name, void **signal)
+{
+	int ret = RC_OK;
+	void *sig = NULL;
+	int i;
+
+	if(!pads || !name || !signal) {
+		ret = RC_INVARG;
+		goto out;
+	}
+
+	i = 0;
+	while(pads[i].name) {
+		if(!strcmp(pads[i].name, name)) {
+			sig = (void*)pads[i].signal;
+			break;
+		}
+		i++;
+	}
+
+out:
+	*signal = sig;
+	return ret;
+}
+
+static int ethernet_udp_start(void *b)
+{
+	base = (struct event_base *)b;
+	printf("[ethernet_udp] loaded (%p)\n", base);
+	return RC_OK;
+}
+
+static void ethernet_udp_read(int fd, short event, void *arg)
+{
+	struct session_s *s = (struct session_s*)arg;
+	struct eth_frame_s *frame;
+	ssize_t len;
+
+	while(1) {
+		frame = malloc(sizeof(struct eth_frame_s));
+		if(!frame)
+			return;
+		len = recv(fd, frame->data, ETH_FRAME_MAX, 0);
+		/* Drop the frames when the PHY does not keep up (like a real link) */
+		if(len <= 0 || s->rxqueue_len >= RX_QUEUE_MAX) {
+			free(frame);
+			if(len <= 0)
+				return;
+			continue;
+		}
+		frame->len = len;
+		frame->next = NULL;
+		if(s->rxqueue_last)
+			s->rxqueue_last->next = frame;
+		else
+			s->rxqueue = frame;
+		s->rxqueue_last = frame;
+		s->rxqueue_len++;
+	}
+}
+
+static int ethernet_udp_new(void **sess, char *args)
+{
+	int ret = RC_OK;
+	char *host = NULL;
+	char *port = NULL;
+	char *remote_port = NULL;
+	struct session_s *s = NULL;
+	struct sockaddr_in local;
+
+	if(!sess) {
+		ret = RC_INVARG;
+		goto out;
+	}
+
+	s = (struct session_s*)malloc(sizeof(struct session_s));
+	if(!s) {
+		ret = RC_NOENMEM;
+		goto out;
+	}
+	memset(s, 0, sizeof(struct session_s));
+
+	ret = litex_sim_module_get_args(args, "host", &host);
+	if(RC_OK != ret)
+		goto out;
+	ret = litex_sim_module_get_args(args, "port", &port);
+	if(RC_OK != ret)
+		goto out;
+	ret = litex_sim_module_get_args(args, "remote_port", &remote_port);
+	if(RC_OK != ret)
+		goto out;
+
+	s->fd = socket(AF_INET, SOCK_DGRAM, 0);
+	if(s->fd < 0) {
+		perror("[ethernet_udp] socket");
+		ret = RC_ERROR;
+		goto out;
+	}
+	memset(&local, 0, sizeof(local));
+	local.sin_family = AF_INET;
+	local.sin_port = htons(atoi(port));
+	inet_pton(AF_INET, host, &local.sin_addr);
+	if(bind(s->fd, (struct sockaddr *)&local, sizeof(local)) < 0) {
+		perror("[ethernet_udp] bind");
+		ret = RC_ERROR;
+		goto out;
+	}
+	fcntl(s->fd, F_SETFL, fcntl(s->fd, F_GETFL) | O_NONBLOCK);
+	s->remote.sin_family = AF_INET;
+	s->remote.sin_port = htons(atoi(remote_port));
+	inet_pton(AF_INET, host, &s->remote.sin_addr);
+
+	s->ev = event_new(base, s->fd, EV_READ | EV_PERSIST, ethernet_udp_read, s);
+	event_add(s->ev, NULL);
+	printf("[ethernet_udp] frames on udp %s:%s <-> %s:%s\n", host, port, host, remote_port);
+
+out:
+	free(host);
+	free(port);
+	free(remote_port);
+	*sess = (void*)s;
+	return ret;
+}
+
+static int ethernet_udp_add_pads(void *sess, struct pad_list_s *plist)
+{
+	int ret = RC_OK;
+	struct session_s *s = (struct session_s*)sess;
+	struct pad_s *pads;
+
+	if(!sess || !plist) {
+		ret = RC_INVARG;
+		goto out;
+	}
+	pads = plist->pads;
+	if(!strcmp(plist->name, "eth")) {
+		litex_sim_module_pads_get(pads, "sink_data",    (void**)&s->rx);
+		litex_sim_module_pads_get(pads, "sink_valid",   (void**)&s->rx_valid);
+		litex_sim_module_pads_get(pads, "sink_ready",   (void**)&s->rx_ready);
+		litex_sim_module_pads_get(pads, "source_data",  (void**)&s->tx);
+		litex_sim_module_pads_get(pads, "source_valid", (void**)&s->tx_valid);
+		litex_sim_module_pads_get(pads, "source_ready", (void**)&s->tx_ready);
+	}
+	if(!strcmp(plist->name, "sys_clk"))
+		litex_sim_module_pads_get(pads, "sys_clk", (void**)&s->sys_clk);
+
+out:
+	return ret;
+}
+
+static int ethernet_udp_tick(void *sess, uint64_t time_ps)
+{
+	struct session_s *s = (struct session_s*)sess;
+	struct eth_frame_s *frame;
+
+	if(!clk_pos_edge(&s->edge, *s->sys_clk))
+		return RC_OK;
+
+	/* TX: one byte per cycle while valid, frame sent at the end of valid */
+	*s->tx_ready = 1;
+	if(*s->tx_valid == 1) {
+		if(s->txlen < ETH_FRAME_MAX)
+			s->txbuf[s->txlen++] = *s->tx;
+	} else if(s->txlen) {
+		sendto(s->fd, s->txbuf, s->txlen, 0, (struct sockaddr *)&s->remote, sizeof(s->remote));
+		s->txlen = 0;
+	}
+
+	/* RX: one byte per cycle, a cycle without valid between frames */
+	*s->rx_valid = 0;
+	if(s->rxlen) {
+		*s->rx_valid = 1;
+		*s->rx = s->rxbuf[s->rxsent++];
+		if(s->rxsent == s->rxlen) {
+			s->rxsent = 0;
+			s->rxlen = 0;
+		}
+	} else if(s->rxqueue) {
+		frame = s->rxqueue;
+		memcpy(s->rxbuf, frame->data, frame->len);
+		s->rxlen = frame->len;
+		s->rxqueue = frame->next;
+		if(!s->rxqueue)
+			s->rxqueue_last = NULL;
+		s->rxqueue_len--;
+		free(frame);
+	}
+	return RC_OK;
+}
+
+static struct ext_module_s ext_mod = {
+	"ethernet_udp",
+	ethernet_udp_start,
+	ethernet_udp_new,
+	ethernet_udp_add_pads,
+	NULL,
+	ethernet_udp_tick
+};
+
+int litex_sim_ext_module_init(int (*register_module)(struct ext_module_s *))
+{
+	int ret = RC_OK;
+	ret = register_module(&ext_mod);
+	return ret;
+}
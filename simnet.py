@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import json
+import struct
+import socket
+import asyncio
+import argparse
+
+from tftpd import TFTPTransfer, TFTPFiles, tftp_parse_request, tftp_negotiate, tftp_error_packet
+from tftpd import tftp_rrq, tftp_error_access, tftp_error_not_found, tftp_netboot_name
+from layout import get_ram_images
+
+# Userspace host network stack for the simulation: the frames of the simulated Ethernet PHY are
+# exchanged as UDP datagrams with the ethernet_udp sim module (sim.py --eth-udp-port), no tap
+# interface nor privileges needed. The host answers ARP and ICMP echo requests, serves the images
+# over TFTP (BIOS netboot, tftpd.TFTPTransfer) and measures the ICMP echo throughput of Linux.
+
+eth_type_ip  = 0x0800
+eth_type_arp = 0x0806
+
+ip_proto_icmp = 1
+ip_proto_udp  = 17
+
+icmp_echo_reply   = 0
+icmp_echo_request = 8
+
+eth_broadcast = b"\xff"*6
+
+# Packets ------------------------------------------------------------------------------------------
+
+def ip_checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    s = sum(struct.unpack("!{}H".format(len(data)//2), data))
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
+def eth_frame(dst, src, ethertype, payload):
+    frame = dst + src + struct.pack("!H", ethertype) + payload
+    return frame.ljust(60, b"\0") # Minimum frame size (without FCS).
+
+def arp_packet(op, sha, spa, tha, tpa):
+    return struct.pack("!HHBBH6s4s6s4s", 1, eth_type_ip, 6, 4, op, sha, spa, tha, tpa)
+
+def ip_packet(src, dst, proto, payload, ident=0):
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), ident & 0xffff, 0, 64, proto, 0,
+        src, dst)
+    return header[:10] + struct.pack("!H", ip_checksum(header)) + header[12:] + payload
+
+def udp_packet(sport, dport, payload):
+    return struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload # No checksum (IPv4).
+
+def icmp_packet(type, ident, seq, payload):
+    header = struct.pack("!BBHHH", type, 0, 0, ident, seq)
+    return header[:2] + struct.pack("!H", ip_checksum(header + payload)) + header[4:] + payload
+
+# Host stack ---------------------------------------------------------------------------------------
+
+class SimNetProtocol(asyncio.DatagramProtocol):
+    """Host side of the simulated Ethernet link (one Ethernet frame per datagram)."""
+    def __init__(self, sim_addr, mac, ip, files, max_blksize=1468, max_windowsize=64, timeout=1.0,
+        verbose=True):
+        self.sim_addr       = sim_addr
+        self.mac            = mac
+        self.ip             = ip
+        self.files          = files
+        self.max_blksize    = max_blksize # Fits in a 1500 bytes MTU.
+        self.max_windowsize = max_windowsize
+        self.timeout        = timeout
+        self.verbose        = verbose
+        self.arp_table      = {}
+        self.arp_waiters    = {}
+        self.transfers      = {} # (ip, port): [transfer, host port, timeout, timer, start]
+        self.next_port      = 50000
+        self.ident          = 0
+        self.echo_waiters   = {}
+        self.stats          = {"frames_rx": 0, "frames_tx": 0, "bytes_rx": 0, "bytes_tx": 0, "tftp": []}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        pass
+
+    # Frames ---------------------------------------------------------------------------------------
+
+    def send_frame(self, dst, ethertype, payload):
+        frame = eth_frame(dst, self.mac, ethertype, payload)
+        self.stats["frames_tx"] += 1
+        self.stats["bytes_tx"]  += len(frame)
+        self.transport.sendto(frame, self.sim_addr)
+
+    def send_ip(self, dst, proto, payload):
+        self.ident += 1
+        self.send_frame(self.arp_table.get(dst, eth_broadcast), eth_type_ip,
+            ip_packet(self.ip, dst, proto, payload, self.ident))
+
+    def datagram_received(self, frame, addr):
+        if len(frame) < 14:
+            return
+        self.stats["frames_rx"] += 1
+        self.stats["bytes_rx"]  += len(frame)
+        dst, src, ethertype = struct.unpack("!6s6sH", frame[:14])
+        if ethertype == eth_type_arp:
+            self.arp_received(frame[14:])
+        elif ethertype == eth_type_ip and dst in [self.mac, eth_broadcast]:
+            self.ip_received(src, frame[14:])
+
+    # ARP ------------------------------------------------------------------------------------------
+
+    def arp_received(self, packet):
+        if len(packet) < 28:
+            return
+        _, _, _, _, op, sha, spa, tha, tpa = struct.unpack("!HHBBH6s4s6s4s", packet[:28])
+        self.arp_table[spa] = sha
+        for future in self.arp_waiters.pop(spa, []):
+            if not future.done():
+                future.set_result(sha)
+        if op == 1 and tpa == self.ip:
+            self.send_frame(sha, eth_type_arp, arp_packet(2, self.mac, self.ip, sha, spa))
+
+    async def resolve(self, ip, retries=None):
+        """MAC address of ip (ARP requests every second)."""
+        while ip not in self.arp_table:
+            future = asyncio.get_event_loop().create_future()
+            self.arp_waiters.setdefault(ip, []).append(future)
+            self.send_frame(eth_broadcast, eth_type_arp, arp_packet(1, self.mac, self.ip, b"\0"*6, ip))
+            try:
+                await asyncio.wait_for(future, 1.0)
+            except asyncio.TimeoutError:
+                if retries is not None:
+                    retries -= 1
+                    if retries < 0:
+                        raise
+        return self.arp_table[ip]
+
+    # IPv4 -----------------------------------------------------------------------------------------
+
+    def ip_received(self, mac, packet):
+        if len(packet) < 20 or packet[0] >> 4 != 4:
+            return
+        ihl    = (packet[0] & 0xf)*4
+        length = struct.unpack("!H", packet[2:4])[0]
+        proto  = packet[9]
+        src, dst = packet[12:16], packet[16:20]
+        if dst != self.ip:
+            return
+        self.arp_table.setdefault(src, mac)
+        payload = packet[ihl:length]
+        if proto == ip_proto_icmp:
+            self.icmp_received(src, payload)
+        elif proto == ip_proto_udp and len(payload) >= 8:
+            sport, dport = struct.unpack("!HH", payload[:4])
+            self.udp_received(src, sport, dport, payload[8:])
+
+    def icmp_received(self, src, packet):
+        if len(packet) < 8:
+            return
+        type, _, _, ident, seq = struct.unpack("!BBHHH", packet[:8])
+        if type == icmp_echo_request:
+            self.send_ip(src, ip_proto_icmp, icmp_packet(icmp_echo_reply, ident, seq, packet[8:]))
+        elif type == icmp_echo_reply:
+            future = self.echo_waiters.pop((src, ident, seq), None)
+            if future is not None and not future.done():
+                future.set_result(time.time())
+
+    # TFTP (server) --------------------------------------------------------------------------------
+
+    def udp_received(self, src, sport, dport, data):
+        key = (src, sport)
+        if key in self.transfers and self.transfers[key][1] == dport:
+            self.tftp_send(key, self.transfers[key][0].receive(data))
+        elif dport == 69:
+            self.tftp_request(src, sport, data)
+
+    def tftp_request(self, src, sport, data):
+        try:
+            opcode, filename, mode, options = tftp_parse_request(data)
+        except (ValueError, struct.error):
+            return
+        if opcode != tftp_rrq:
+            self.send_ip(src, ip_proto_udp, udp_packet(69, sport,
+                tftp_error_packet(tftp_error_access, "Read only server")))
+            return
+        try:
+            content = self.files.get(filename)
+        except OSError:
+            content = None
+        if content is None:
+            self.send_ip(src, ip_proto_udp, udp_packet(69, sport,
+                tftp_error_packet(tftp_error_not_found, "File not found")))
+            return
+        blksize, windowsize, timeout, oack = tftp_negotiate(options, len(content),
+            self.max_blksize, self.max_windowsize)
+        transfer = TFTPTransfer(content, blksize, windowsize, oack)
+        transfer.filename = filename
+        if self.verbose:
+            print("[simnet] tftp {} (blksize {}, windowsize {})".format(filename, blksize, windowsize))
+        key  = (src, sport)
+        port = self.next_port
+        self.next_port = 50000 + (self.next_port - 50000 + 1) % 10000
+        self.transfers[key] = [transfer, port, timeout or self.timeout, None, time.time()]
+        self.tftp_send(key, transfer.start())
+
+    def tftp_send(self, key, packets):
+        transfer, port, timeout, timer, start = self.transfers[key]
+        for packet in packets:
+            self.send_ip(key[0], ip_proto_udp, udp_packet(port, key[1], packet))
+        if timer is not None:
+            timer.cancel()
+        if transfer.done:
+            del self.transfers[key]
+            self.tftp_done(transfer, time.time() - start)
+        else:
+            self.transfers[key][3] = asyncio.get_event_loop().call_later(timeout, self.tftp_timeout, key)
+
+    def tftp_timeout(self, key):
+        if key in self.transfers:
+            self.tftp_send(key, self.transfers[key][0].timeout())
+
+    def tftp_done(self, transfer, duration):
+        stats = {
+            "filename": transfer.filename,
+            "bytes":    len(transfer.data),
+            "duration": duration,
+            "error":    transfer.error,
+        }
+        self.stats["tftp"].append(stats)
+        if self.verbose:
+            if transfer.error is not None:
+                print("[simnet] tftp {}: {}".format(transfer.filename, transfer.error))
+            else:
+                print("[simnet] tftp {}: {} bytes in {:.2f}s ({:.1f} KiB/s)".format(transfer.filename,
+                    len(transfer.data), duration, len(transfer.data)/max(duration, 1e-9)/1024))
+
+    # ICMP echo (benchmark) ------------------------------------------------------------------------
+
+    async def echo(self, ip, ident, seq, payload, timeout):
+        future = asyncio.get_event_loop().create_future()
+        self.echo_waiters[(ip, ident, seq)] = future
+        self.send_ip(ip, ip_proto_icmp, icmp_packet(icmp_echo_request, ident, seq, payload))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.echo_waiters.pop((ip, ident, seq), None)
+            return False
+
+    async def ping(self, ip, count=1000, size=1000, window=8, timeout=5.0):
+        """ICMP echo throughput: count requests of size bytes, window requests in flight."""
+        # Wait for Linux to answer (boot, interface configuration).
+        await self.resolve(ip)
+        seq = 0
+        while not await self.echo(ip, 0x5a5a, seq, b"", 1.0):
+            seq += 1
+        payload = bytes(i & 0xff for i in range(size))
+        received = 0
+        queue = asyncio.Queue()
+        for seq in range(count):
+            queue.put_nowait(seq)
+        async def worker():
+            nonlocal received
+            while not queue.empty():
+                seq = queue.get_nowait()
+                if await self.echo(ip, 0x5a5b, seq, payload, timeout):
+                    received += 1
+        start = time.time()
+        await asyncio.gather(*[worker() for i in range(window)])
+        duration = time.time() - start
+        return {
+            "count":      count,
+            "received":   received,
+            "size":       size,
+            "window":     window,
+            "duration":   duration,
+            "pps":        received/duration,
+            "throughput": 2*received*size/duration, # bytes/s (RX + TX)
+        }
+
+# Run ----------------------------------------------------------------------------------------------
+
+def get_default_files(compressed=False):
+    # Images of the RAM layout (BIOS netboot filenames).
+    return TFTPFiles({tftp_netboot_name(image): image for name, image, reserve in get_ram_images(compressed=compressed)
+        if name != "LINUX"})
+
+def parse_mac(mac):
+    return bytes(int(b, 16) for b in mac.split(":"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Userspace host network stack for the simulation")
+    parser.add_argument("--host",      default="127.0.0.1",         help="UDP address of the frames")
+    parser.add_argument("--port",      default=2001, type=int,      help="UDP port of the host stack")
+    parser.add_argument("--sim-port",  default=2000, type=int,      help="UDP port of the simulation (sim.py --eth-udp-port)")
+    parser.add_argument("--mac",       default="10:e2:d5:00:00:01", help="Host MAC address")
+    parser.add_argument("--ip",        default="192.168.1.100",     help="Host IP address (sim.py --remote-ip)")
+    parser.add_argument("--images",    default=None, nargs="+",     help="images json files of the TFTP files (default: RAM images)")
+    parser.add_argument("--compress",  action="store_true",         help="serve the compressed images (default files)")
+    parser.add_argument("--ping",      default=None,                help="ICMP echo benchmark of this IP address (sim.py --local-ip)")
+    parser.add_argument("--count",     default=1000, type=int,      help="ICMP echo requests")
+    parser.add_argument("--size",      default=1000, type=int,      help="ICMP echo payload size")
+    parser.add_argument("--window",    default=8,    type=int,      help="ICMP echo requests in flight")
+    parser.add_argument("--report",    default=None,                help="JSON report of the TFTP transfers/benchmark")
+    args = parser.parse_args()
+
+    files = TFTPFiles.from_images(args.images) if args.images else get_default_files(args.compress)
+    loop = asyncio.get_event_loop()
+    transport, protocol = loop.run_until_complete(loop.create_datagram_endpoint(
+        lambda: SimNetProtocol((args.host, args.sim_port), parse_mac(args.mac), socket.inet_aton(args.ip), files),
+        local_addr=(args.host, args.port)))
+    print("[simnet] {} ({}) on udp {}:{} <-> {}:{}".format(args.ip, args.mac, args.host, args.port, args.host,
+        args.sim_port))
+    try:
+        if args.ping is not None:
+            stats = loop.run_until_complete(protocol.ping(socket.inet_aton(args.ping), args.count, args.size,
+                args.window))
+            protocol.stats["ping"] = stats
+            print("[simnet] ping {}: {}/{} replies in {:.2f}s: {:.1f} packets/s, {:.1f} KiB/s".format(args.ping,
+                stats["received"], stats["count"], stats["duration"], stats["pps"], stats["throughput"]/1024))
+        else:
+            loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.close()
+        if args.report is not None:
+            with open(args.report, "w") as f:
+                json.dump(protocol.stats, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 
 import os
-import subprocess
 
 from migen import *
 
 from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import AutoCSR
 
 from litex.soc.cores.gpio import GPIOOut, GPIOIn
 from litex.soc.cores.spi import SPIMaster
@@ -15,7 +15,11 @@ from litex.soc.cores.pwm import PWM
 from litex.soc.cores.icap import ICAPBitstream
 from litex.soc.cores.clock import S7MMCM
 
-from litevideo.output import VideoOut
+from litevideo.output import VideoOut, Driver
+from litevideo.output.core import VideoOutCore
+
+from cvt import parse_video_mode
+from layout import get_ram_images, plan_ram_layout, check_ram_layout, get_ram_region, get_ram_constants
 
 # Predefined values --------------------------------------------------------------------------------
 
@@ -55,8 +59,24 @@ video_resolutions = {
     }
 }
 
+# Highest pixel clock of the HDMI output of Artix7 FPGAs (serialized with a 5x pixel clock), boards
+# can set a lower limit (VIDEO_MAX_PIX_CLK: speed grade, HDMI transmitter...).
+video_max_pix_clk = 148.5e6
+
+# Framebuffer pixel formats (simple-framebuffer names) and their bits per pixel.
+video_formats = {
+    "a8b8g8r8" : 32,
+    "r5g6b5"   : 16,
+}
+
 # Helpers ------------------------------------------------------------------------------------------
 
+def get_video_settings(video):
+    """Predefined video_resolutions or CVT timings: WxH@Hz, WxH@HzR (reduced blanking)."""
+    if video in video_resolutions.keys():
+        return video_resolutions[video]
+    return parse_video_mode(video)
+
 def platform_request_all(platform, name):
     from litex.build.generic_platform import ConstraintError
     r = []
@@ -69,6 +89,27 @@ def platform_request_all(platform, name):
         raise ValueError
     return r
 
+# RGB565 Framebuffer -------------------------------------------------------------------------------
+
+class RGB565VideoOut(Module, AutoCSR):
+    """VideoOut reading 16-bit r5g6b5 pixels from DRAM (half the scan-out bandwidth of a8b8g8r8):
+    the 16-bit DMA of the YCbCr422 mode feeds the RGB driver through a RGB565 to RGB888 expander."""
+    def __init__(self, device, pads, dram_port, fifo_depth=512):
+        self.submodules.core   = core   = VideoOutCore(dram_port, mode="ycbcr422", fifo_depth=fifo_depth)
+        self.submodules.driver = driver = Driver(device, pads, mode="rgb")
+
+        # # #
+
+        pixel = core.source.data
+        r, g, b = pixel[11:16], pixel[5:11], pixel[0:5]
+        self.comb += [
+            core.source.connect(driver.sink, omit={"data"}),
+            # MSBs replicated in the LSBs: full intensity range.
+            driver.sink.data[0:8].eq(Cat(r[2:], r)),
+            driver.sink.data[8:16].eq(Cat(g[4:], g)),
+            driver.sink.data[16:24].eq(Cat(b[2:], b)),
+        ]
+
 # SoCLinux -----------------------------------------------------------------------------------------
 
 def SoCLinux(soc_cls, **kwargs):
@@ -98,10 +139,6 @@ def SoCLinux(soc_cls, **kwargs):
                 max_sdram_size = 0x40000000, # Limit mapped SDRAM to 1GB.
                 **kwargs)
 
-            # Add linker region for machine mode emulator
-            self.add_memory_region("emulator", self.mem_map["main_ram"] + 0x01100000, 0x4000,
-                type="cached+linker")
-
         # Leds -------------------------------------------------------------------------------------
         def add_leds(self):
             self.submodules.leds = GPIOOut(Cat(platform_request_all(self.platform, "user_led")))
@@ -136,15 +173,20 @@ def SoCLinux(soc_cls, **kwargs):
             self.add_csr("xadc")
 
         # Framebuffer (Xilinx only) ----------------------------------------------------------------
-        def add_framebuffer(self, video_settings):
+        def add_framebuffer(self, video_settings, video_format="a8b8g8r8", max_pix_clk=video_max_pix_clk):
             platform = self.platform
             assert platform.device[:4] == "xc7a"
+            assert video_format in video_formats.keys(), "Unsupported video format"
+            if video_settings["pix_clk"] > max_pix_clk:
+                raise ValueError("Pixel clock of {:.2f}MHz above the {:.2f}MHz supported, use reduced blanking"
+                    " or a lower resolution/refresh rate".format(video_settings["pix_clk"]/1e6, max_pix_clk/1e6))
             dram_port = self.sdram.crossbar.get_port(
                 mode         = "read",
                 data_width   = 32,
                 clock_domain = "pix",
                 reverse      = True)
-            framebuffer = VideoOut(
+            framebuffer_cls = {"a8b8g8r8": VideoOut, "r5g6b5": RGB565VideoOut}[video_format]
+            framebuffer = framebuffer_cls(
                 device    = platform.device,
                 pads      = platform.request("hdmi_out"),
                 dram_port = dram_port)
@@ -168,6 +210,7 @@ def SoCLinux(soc_cls, **kwargs):
             self.add_constant("litevideo_v_blanking",    video_settings["v-blanking"])
             self.add_constant("litevideo_v_sync",        video_settings["v-sync"])
             self.add_constant("litevideo_v_front_porch", video_settings["v-front-porch"])
+            self.add_constant("litevideo_bpp",           video_formats[video_format])
 
         # ICAP Bitstream (Xilinx only) -------------------------------------------------------------
         def add_icap_bitstream(self):
@@ -235,28 +278,26 @@ def SoCLinux(soc_cls, **kwargs):
             self.add_constant("REMOTEIP4", int(remote_ip[3]))
 
         # Boot configuration -----------------------------------------------------------------------
-        def configure_boot(self):
+        def configure_boot(self, flash_constants=None, ram_layout=None):
+            # RAM layout: linker region for machine mode emulator and, for layouts that differ
+            # from the BIOS fixed offsets (packed), images offsets (flash_constants/ram_layout
+            # constants are only added when given, the fixed layout keeps the BIOS defaults).
+            ram_constants = ram_layout is not None
+            if ram_layout is None:
+                ram_layout = plan_ram_layout(get_ram_images())
+            check_ram_layout(ram_layout, self.bus.regions["main_ram"].size)
+            emulator = get_ram_region(ram_layout, "EMULATOR")
+            self.add_memory_region("emulator", self.mem_map["main_ram"] + emulator["offset"], emulator["size"],
+                type="cached+linker")
+            if ram_constants:
+                for name, value in get_ram_constants(ram_layout).items():
+                    self.add_constant(name, value)
+
+            # SPI Flash boot.
             if hasattr(self, "spiflash"):
                 self.add_constant("FLASH_BOOT_ADDRESS", self.mem_map["spiflash"])
-
-        # DTS generation ---------------------------------------------------------------------------
-        def generate_dts(self, board_name):
-            json = os.path.join("build", board_name, "csr.json")
-            dts = os.path.join("build", board_name, "{}.dts".format(board_name))
-            subprocess.check_call(
-                "./json2dts.py {} > {}".format(json, dts), shell=True)
-
-        # DTS compilation --------------------------------------------------------------------------
-        def compile_dts(self, board_name):
-            dts = os.path.join("build", board_name, "{}.dts".format(board_name))
-            dtb = os.path.join("buildroot", "rv32.dtb")
-            subprocess.check_call(
-                "dtc -O dtb -o {} {}".format(dtb, dts), shell=True)
-
-        # Emulator compilation ---------------------------------------------------------------------
-        def compile_emulator(self, board_name):
-            os.environ["BOARD"] = board_name
-            subprocess.check_call("cd emulator && make", shell=True)
+                for name, value in (flash_constants or {}).items():
+                    self.add_constant(name, value)
 
         # Documentation generation -----------------------------------------------------------------
         def generate_doc(self, board_name):
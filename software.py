@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import subprocess
+
+import json2dts
+
+# Boot software of a SoC build (make.py boards, sim.py): DTS/DTB from the csr.json of the build
+# directory and machine mode emulator. No LiteX dependency: usable without the SoC being elaborated.
+
+# DTS generation -----------------------------------------------------------------------------------
+
+def generate_dts(build_dir, name, initrd=None):
+    """build_dir/csr.json --> build_dir/<name>.dts."""
+    json_file = os.path.join(build_dir, "csr.json")
+    dts_file  = os.path.join(build_dir, "{}.dts".format(name))
+    with open(json_file) as f:
+        dts = json2dts.generate_dts(json.load(f), initrd)
+    with open(dts_file, "w") as f:
+        f.write(dts + "\n")
+
+# DTS compilation ----------------------------------------------------------------------------------
+
+def compile_dts(build_dir, name, dtb=os.path.join("buildroot", "rv32.dtb")):
+    dts = os.path.join(build_dir, "{}.dts".format(name))
+    with open(dts) as f:
+        data = json2dts.dts_to_dtb(f.read())
+    with open(dtb, "wb") as f:
+        f.write(data)
+
+# Emulator compilation -----------------------------------------------------------------------------
+
+def compile_emulator(build_dir, output_dir="emulator", stats=False):
+    # Out-of-tree builds (output_dir != emulator) use the emulator sources through vpath.
+    emulator_dir = os.path.abspath("emulator")
+    os.makedirs(output_dir, exist_ok=True)
+    subprocess.check_call(
+        "make -C {} -f {}/Makefile BUILD_DIR={} EMULATOR_DIR={} EMULATOR_STATS={}".format(
+            output_dir, emulator_dir, os.path.abspath(build_dir), emulator_dir, int(stats)), shell=True)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "prog"))
+
+import bit_to_svf
+from bench_bit_to_svf import legacy_bit_to_svf
+
+def write_bitstream(filename, size):
+    # Random payload with the VERIFY_ID command/IDCODE of a LFE5U-45F near the start.
+    with open(filename, "wb") as f:
+        f.write(b"\xff"*16 + b"\xe2\x00\x00\x00\x41\x11\x20\x43" + os.urandom(size))
+
+# Tests --------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("size, row_size", [
+    (64*1024,     bit_to_svf.max_row_size), # Rows wrapped on several lines.
+    (64*1024 + 3, bit_to_svf.max_row_size), # Partial last row.
+    (1000,        320),                     # Rows filling the first line.
+    (1000,        344),                     # Argument moved to its own line.
+    (1000,        8),                       # Single byte rows.
+])
+def test_bit_to_svf(tmp_path, size, row_size):
+    bit_filename = str(tmp_path / "top.bit")
+    write_bitstream(bit_filename, size)
+    legacy_bit_to_svf(bit_filename, str(tmp_path / "legacy.svf"), row_size)
+    bit_to_svf.bit_to_svf(bit_filename, str(tmp_path / "top.svf"), row_size)
+    assert (tmp_path / "top.svf").read_bytes() == (tmp_path / "legacy.svf").read_bytes()
+
+def test_bit_to_svf_no_idcode(tmp_path):
+    bit_filename = str(tmp_path / "top.bit")
+    with open(bit_filename, "wb") as f:
+        f.write(b"\xff"*1024)
+    with pytest.raises(ValueError):
+        bit_to_svf.bit_to_svf(bit_filename, str(tmp_path / "top.svf"))
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flash import RecordingFlasher, flash_images
+
+sector_size = 4096
+
+def write_image(filename, data):
+    with open(filename, "wb") as f:
+        f.write(data)
+    return str(filename)
+
+def get_images(tmp_path):
+    kernel = write_image(tmp_path / "Image",  os.urandom(5*sector_size + 100))
+    rootfs = write_image(tmp_path / "rootfs", os.urandom(3*sector_size))
+    return {kernel: 0x00000000, rootfs: 0x00500000}
+
+def flash(tmp_path, regions, **kwargs):
+    flasher = RecordingFlasher(sector_size)
+    programmed = flash_images(flasher, regions, sector_size, str(tmp_path / "manifest.json"), **kwargs)
+    return programmed, flasher.commands
+
+# Tests --------------------------------------------------------------------------------------------
+
+def test_flash_images(tmp_path):
+    regions = get_images(tmp_path)
+    programmed, commands = flash(tmp_path, regions)
+    assert programmed == 9
+    assert commands == [
+        {"cmd": "erase", "address": 0x00000000, "length": 6*sector_size},
+        {"cmd": "write", "address": 0x00000000, "length": 5*sector_size + 100},
+        {"cmd": "erase", "address": 0x00500000, "length": 3*sector_size},
+        {"cmd": "write", "address": 0x00500000, "length": 3*sector_size},
+    ]
+
+def test_flash_images_unchanged(tmp_path):
+    regions = get_images(tmp_path)
+    flash(tmp_path, regions)
+    programmed, commands = flash(tmp_path, regions)
+    assert programmed == 0
+    assert commands == []
+
+def test_flash_images_changed_sectors(tmp_path):
+    regions = get_images(tmp_path)
+    kernel  = min(regions, key=regions.get)
+    flash(tmp_path, regions)
+    with open(kernel, "r+b") as f:
+        f.seek(2*sector_size + 10)
+        f.write(b"\x00"*sector_size)   # Sectors 2 and 3.
+        f.seek(5*sector_size)
+        f.write(b"\x00")               # Last (partial) sector.
+    programmed, commands = flash(tmp_path, regions)
+    assert programmed == 3
+    assert commands == [
+        {"cmd": "erase", "address": 2*sector_size, "length": 2*sector_size},
+        {"cmd": "write", "address": 2*sector_size, "length": 2*sector_size},
+        {"cmd": "erase", "address": 5*sector_size, "length": sector_size},
+        {"cmd": "write", "address": 5*sector_size, "length": 100},
+    ]
+
+def test_flash_images_full(tmp_path):
+    regions = get_images(tmp_path)
+    flash(tmp_path, regions)
+    programmed, commands = flash(tmp_path, regions, full=True)
+    assert programmed == 9
+    assert len(commands) == 4
+
+def test_flash_images_unaligned(tmp_path):
+    kernel = write_image(tmp_path / "Image", os.urandom(sector_size))
+    with pytest.raises(ValueError):
+        flash(tmp_path, {kernel: sector_size//2})
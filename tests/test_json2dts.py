@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import struct
+import shutil
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from json2dts import generate_dts, dts_to_dtb
+
+# Reference DTS files: output of the original json2dts.py script for the csr.json files.
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+json2dts = os.path.join(os.path.dirname(__file__), "..", "json2dts.py")
+
+def read_reference(board):
+    with open(os.path.join(data_dir, "{}.csr.json".format(board))) as f:
+        d = json.load(f)
+    with open(os.path.join(data_dir, "{}.dts".format(board))) as f:
+        dts = f.read()
+    return d, dts
+
+def read_dts(name):
+    with open(os.path.join(data_dir, "{}.dts".format(name))) as f:
+        return f.read()
+
+def read_dtb(dtb):
+    """(header, memory reservations, {path: {property: value}}) of a flattened device tree."""
+    header = struct.unpack(">10I", dtb[:40])
+    magic, totalsize, off_struct, off_strings, off_rsvmap = header[:5]
+    memreserve = []
+    for offset in range(off_rsvmap, off_struct, 16):
+        address, size = struct.unpack(">QQ", dtb[offset:offset+16])
+        if (address, size) == (0, 0):
+            break
+        memreserve.append((address, size))
+    def get_string(offset):
+        return dtb[off_strings + offset:dtb.index(b"\0", off_strings + offset)].decode()
+    nodes  = {}
+    path   = []
+    offset = off_struct
+    while True:
+        token, = struct.unpack(">I", dtb[offset:offset+4])
+        offset += 4
+        if token == 1: # FDT_BEGIN_NODE
+            end = dtb.index(b"\0", offset)
+            path.append(dtb[offset:end].decode())
+            nodes["/".join(path) or "/"] = {}
+            offset = (end + 4) & ~3
+        elif token == 3: # FDT_PROP
+            length, name = struct.unpack(">II", dtb[offset:offset+8])
+            nodes["/".join(path) or "/"][get_string(name)] = dtb[offset+8:offset+8+length]
+            offset = (offset + 8 + length + 3) & ~3
+        elif token == 2: # FDT_END_NODE
+            path.pop()
+        elif token == 9: # FDT_END
+            break
+    return header, memreserve, nodes
+
+# Tests --------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("board", ["arty", "sim"])
+def test_generate_dts(board):
+    d, dts = read_reference(board)
+    assert generate_dts(d) + "\n" == dts
+
+@pytest.mark.parametrize("board", ["arty", "sim"])
+def test_json2dts_cli(board):
+    d, dts = read_reference(board)
+    output = subprocess.check_output([sys.executable, json2dts, os.path.join(data_dir, "{}.csr.json".format(board))])
+    assert output.decode() == dts
+
+def test_json2dts_batch(tmp_path):
+    csr_jsons = []
+    for board in ["arty", "sim"]:
+        os.makedirs(str(tmp_path / board))
+        csr_jsons.append(str(tmp_path / board / "csr.json"))
+        shutil.copy(os.path.join(data_dir, "{}.csr.json".format(board)), csr_jsons[-1])
+    subprocess.check_call([sys.executable, json2dts] + csr_jsons, stdout=subprocess.DEVNULL)
+    for board in ["arty", "sim"]:
+        d, dts = read_reference(board)
+        assert (tmp_path / board / "{}.dts".format(board)).read_text() == dts
+
+def test_dtb_features():
+    header, memreserve, nodes = read_dtb(dts_to_dtb(read_dts("features")))
+    assert header[0] == 0xd00dfeed
+    assert header[5:8] == (17, 16, 0) # Version, last compatible version, boot CPU.
+    assert memreserve == [(0x40000000, 0x00100000), (0x41000000, 0x00002000)]
+    # String lists.
+    assert nodes["/"]["compatible"] == b"litex,test\0simple-bus\0"
+    # Phandles: allocated while walking the tree, skipping the explicit ones, then path references.
+    intc = nodes["/cpus/cpu@0/interrupt-controller"]
+    plic = nodes["/soc/interrupt-controller@f0c00000"]
+    clk  = nodes["/clock"]
+    assert intc["phandle"] == struct.pack(">I", 2)
+    assert plic["phandle"] == struct.pack(">I", 1)
+    assert clk["phandle"]  == struct.pack(">I", 3)
+    assert list(clk) == ["compatible", "#clock-cells", "clock-frequency", "phandle"]
+    assert nodes["/soc/serial@f0001000"]["interrupts-extended"] == struct.pack(">II", 2, 2)
+    assert nodes["/soc/serial@f0001000"]["clocks"] == struct.pack(">I", 3)
+    assert plic["interrupts-extended"] == struct.pack(">IIII", 2, 0xb, 2, 0x9)
+    assert nodes["/soc/serial@f0001000"]["mac-address"] == bytes.fromhex("0010e2d50000")
+    assert nodes["/chosen"]["stdout-path"] == b"/soc/serial@f0001000\0"
+    assert nodes["/aliases"]["serial0"] == b"/soc/serial@f0001000\0"
+
+@pytest.mark.parametrize("name", ["arty", "features"])
+def test_dtb_strings(name):
+    # Property names are stored once in the strings block, in order of first use. Like dtc, a name
+    # that is the suffix of a string already stored reuses it.
+    dtb = dts_to_dtb(read_dts(name))
+    off_strings, = struct.unpack(">I", dtb[12:16])
+    strings = []
+    for props in read_dtb(dtb)[2].values():
+        for prop in props:
+            if not any(s.endswith(prop.encode()) for s in strings):
+                strings.append(prop.encode())
+    assert dtb[off_strings:] == b"".join(s + b"\0" for s in strings)
+
+@pytest.mark.skipif(shutil.which("dtc") is None, reason="dtc not installed")
+@pytest.mark.parametrize("name", ["arty", "sim", "features"])
+def test_dtb_dtc(tmp_path, name):
+    # Byte-for-byte against dtc.
+    dts = read_dts(name)
+    (tmp_path / "board.dts").write_text(dts)
+    subprocess.check_call(["dtc", "-I", "dts", "-O", "dtb", "-o", str(tmp_path / "board.dtb"), str(tmp_path / "board.dts")],
+        stderr=subprocess.DEVNULL)
+    assert dts_to_dtb(dts) == (tmp_path / "board.dtb").read_bytes()
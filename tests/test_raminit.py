@@ -0,0 +1,110 @@
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from raminit import get_ram_init_placeholder, get_sdram_init_period, find_ram_init_files, write_ram_init
+
+GeomSettings = namedtuple("GeomSettings", "bankbits rowbits colbits")
+
+# SDRAM model init files ---------------------------------------------------------------------------
+
+def get_bank_init(init, nbanks, nrows, ncols, databits, data_width):
+    # Same packing/split as litedram's SDRAMPHYModel (ROW_BANK_COL).
+    model_column_size = ncols*databits//data_width
+    if data_width >= 32:
+        ratio = data_width//32
+        init  = [sum(init[i + j] << (32*j) for j in range(ratio)) for i in range(0, len(init), ratio)]
+    else:
+        ratio = 32//data_width
+        init  = [(word >> (data_width*j)) & (2**data_width - 1) for word in init for j in range(ratio)]
+    bank_init = [[] for i in range(nbanks)]
+    for row in range(nrows):
+        for bank in range(nbanks):
+            start = (row*nbanks + bank)*model_column_size
+            if start >= len(init):
+                break
+            bank_init[bank].extend(init[start:start + model_column_size])
+    return bank_init
+
+def write_init_file(filename, words, data_width):
+    # Migen $readmemh file.
+    with open(filename, "w") as f:
+        for word in words:
+            f.write("{:0{}x}\n".format(word, data_width//4))
+
+def read_init_file(filename):
+    with open(filename) as f:
+        return [int(line, 16) for line in f.read().split()]
+
+def read_sdram(gateware_dir, nbanks, ncols, databits, data_width):
+    # Memory contents seen through the model (inverse of get_bank_init).
+    banks = [read_init_file(os.path.join(gateware_dir, "mem_{}.init".format(bank))) for bank in range(nbanks)]
+    model_column_size = ncols*databits//data_width
+    data = bytearray()
+    for row in range(len(banks[0])//model_column_size):
+        for bank in range(nbanks):
+            for word in banks[bank][row*model_column_size:(row + 1)*model_column_size]:
+                data += word.to_bytes(data_width//8, "little")
+    return bytes(data)
+
+# Tests --------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("memtype, geom_settings, databits, nphases", [
+    ("SDR",  GeomSettings(bankbits=2, rowbits=13, colbits=9),  32, 1), # MT48LC16M16, 32-bit
+    ("SDR",  GeomSettings(bankbits=2, rowbits=13, colbits=9),  16, 1), # MT48LC16M16, 16-bit
+    ("DDR3", GeomSettings(bankbits=3, rowbits=14, colbits=10), 32, 4), # MT41K128M16, 32-bit
+    ("DDR3", GeomSettings(bankbits=3, rowbits=14, colbits=10), 16, 4), # MT41K128M16, 16-bit
+])
+def test_sdram_runtime_ram_init(tmp_path, memtype, geom_settings, databits, nphases):
+    dfi_databits = databits if memtype == "SDR" else 2*databits
+    data_width   = dfi_databits*nphases
+    nbanks       = 2**geom_settings.bankbits
+    ncols        = 2**geom_settings.colbits
+
+    # Gateware: bank init files generated from the placeholder.
+    gateware_dir = tmp_path / "gateware"
+    gateware_dir.mkdir()
+    placeholder = get_ram_init_placeholder(get_sdram_init_period(geom_settings, databits))
+    for bank, words in enumerate(get_bank_init(placeholder, nbanks, 2**geom_settings.rowbits, ncols, databits, data_width)):
+        write_init_file(str(gateware_dir / "mem_{}.init".format(bank)), words, data_width)
+    init_files = find_ram_init_files(str(gateware_dir))
+    assert sorted(init_files) == sorted(str(gateware_dir / "mem_{}.init".format(bank)) for bank in range(nbanks))
+
+    # Images: kernel at the base of the RAM, DTB at an offset not aligned on a row.
+    kernel = os.urandom(3*len(placeholder)*4 + 68)
+    dtb    = os.urandom(1000)
+    (tmp_path / "Image").write_bytes(kernel)
+    (tmp_path / "rv32.dtb").write_bytes(dtb)
+    dtb_offset = 5*len(placeholder)*4 + 12
+    ram_layout = [
+        {"name": "KERNEL",      "filename": str(tmp_path / "Image"),    "offset": 0,          "load": True},
+        {"name": "DEVICE_TREE", "filename": str(tmp_path / "rv32.dtb"), "offset": dtb_offset, "load": True},
+    ]
+    write_ram_init(str(gateware_dir), ram_layout)
+
+    ram = read_sdram(str(gateware_dir), nbanks, ncols, databits, data_width)
+    assert ram[:len(kernel)] == kernel
+    assert ram[dtb_offset:dtb_offset + len(dtb)] == dtb
+    assert ram[len(kernel):dtb_offset] == bytes(dtb_offset - len(kernel))
+
+def test_integrated_runtime_ram_init(tmp_path):
+    gateware_dir = tmp_path / "gateware"
+    gateware_dir.mkdir()
+    write_init_file(str(gateware_dir / "mem_1.init"), get_ram_init_placeholder(1), 32)
+    write_init_file(str(gateware_dir / "mem.init"), [0x13]*16, 32) # ROM: not a RAM init file.
+    image = os.urandom(4096 + 4)
+    (tmp_path / "Image").write_bytes(image)
+    write_ram_init(str(gateware_dir), [{"name": "KERNEL", "filename": str(tmp_path / "Image"), "offset": 0, "load": True}])
+    words = read_init_file(str(gateware_dir / "mem_1.init"))
+    ram   = b"".join(word.to_bytes(4, "little") for word in words)
+    assert ram[:len(image)] == image
+    assert ram[len(image):] == bytes(len(ram) - len(image))
+    assert read_init_file(str(gateware_dir / "mem.init")) == [0x13]*16
+
+def test_no_ram_init_file(tmp_path):
+    with pytest.raises(ValueError):
+        write_ram_init(str(tmp_path), [])
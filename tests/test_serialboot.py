@@ -0,0 +1,83 @@
+import os
+import sys
+import select
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from serialboot import SFLUploader, SFLStandIn, SFLError
+
+class PtyPort:
+    """Minimal pyserial-like port on the stand-in pty."""
+    def __init__(self, path, timeout=0.05):
+        import tty
+        self.fd      = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        self.timeout = timeout
+        tty.setraw(self.fd)
+
+    def read(self, length):
+        if not select.select([self.fd], [], [], self.timeout)[0]:
+            return b""
+        return os.read(self.fd, length)
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def reset_input_buffer(self):
+        while select.select([self.fd], [], [], 0)[0]:
+            os.read(self.fd, 4096)
+
+    def close(self):
+        os.close(self.fd)
+
+def boot(tmp_path, images, uploader_kwargs={}, **stand_in_kwargs):
+    stand_in = SFLStandIn(**stand_in_kwargs)
+    stand_in.start()
+    port     = PtyPort(stand_in.port)
+    uploader = SFLUploader(port, timeout=0.2, echo=None, **uploader_kwargs)
+    try:
+        assert uploader.wait_magic(timeout=5)
+        uploader.boot({str(tmp_path / name): address for name, (address, data) in images.items()})
+        stand_in.join(5)
+    finally:
+        port.close()
+    for name, (address, data) in images.items():
+        offset = address - stand_in.base
+        assert stand_in.ram[offset:offset + len(data)] == data
+    assert stand_in.jump == list(images.values())[-1][0]
+    return uploader
+
+def write_images(tmp_path, sizes):
+    images = {}
+    for n, (name, address, size) in enumerate(sizes):
+        data = os.urandom(size)
+        (tmp_path / name).write_bytes(data)
+        images[name] = (address, data)
+    return images
+
+def test_serialboot(tmp_path):
+    images   = write_images(tmp_path, [("Image", 0x40000000, 100000), ("emulator.bin", 0x41100000, 9000)])
+    uploader = boot(tmp_path, images)
+    assert uploader.stats["retries"] == 0
+
+def test_serialboot_drop_rate(tmp_path):
+    # Lost acknowledges: only the batches with a missing acknowledge are sent again.
+    images   = write_images(tmp_path, [("Image", 0x40000000, 200000), ("emulator.bin", 0x41100000, 9000)])
+    uploader = boot(tmp_path, images, drop_rate=0.01)
+    frames   = sum(-(-len(data)//251) for address, data in images.values())
+    assert 0 < uploader.stats["retries"] < frames//2
+    assert uploader.stats["resumes"] == 0
+
+def test_serialboot_error_rate(tmp_path):
+    # Corrupted frames: sent again on the BIOS CRC error reply.
+    images   = write_images(tmp_path, [("Image", 0x40000000, 100000), ("emulator.bin", 0x41100000, 9000)])
+    uploader = boot(tmp_path, images, error_rate=0.02)
+    assert uploader.stats["retries"] > 0
+
+def test_serialboot_link_lost(tmp_path):
+    # All the acknowledges lost: bounded resume, then error.
+    images = write_images(tmp_path, [("Image", 0x40000000, 10000)])
+    with pytest.raises(SFLError):
+        boot(tmp_path, images, uploader_kwargs={"retries": 2, "resumes": 1, "resume_timeout": 0.5}, drop_rate=1.0)
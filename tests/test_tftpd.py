@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import struct
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from layout import write_images_json
+from tftpd import TFTPFiles, TFTPTransfer, TFTPClientProtocol, tftp_server, tftp_ack, tftp_data
+
+def write_images(tmp_path, sizes):
+    images = {}
+    for n, (name, size) in enumerate(sizes.items()):
+        filename = str(tmp_path / name)
+        with open(filename, "wb") as f:
+            f.write(os.urandom(size))
+        images[filename] = 0x40000000 + n*0x00800000
+    write_images_json(images, str(tmp_path / "images.json"))
+    return TFTPFiles.from_images([str(tmp_path / "images.json")])
+
+class LossyClientProtocol(TFTPClientProtocol):
+    """Client dropping the first reception of the given DATA blocks."""
+    def __init__(self, *args, drop=[], **kwargs):
+        TFTPClientProtocol.__init__(self, *args, **kwargs)
+        self.drop = set(drop)
+
+    def datagram_received(self, data, addr):
+        if struct.unpack(">H", data[:2])[0] == tftp_data:
+            block = struct.unpack(">H", data[2:4])[0]
+            if block in self.drop:
+                self.drop.remove(block)
+                return
+        TFTPClientProtocol.datagram_received(self, data, addr)
+
+def get(files, names, options={}, client_kwargs={}, **server_kwargs):
+    # Loopback server, returns the data and the client protocols (negotiated blksize/windowsize).
+    async def run():
+        transport, server = await tftp_server(files, host="127.0.0.1", port=0, verbose=False, **server_kwargs)
+        addr    = transport.get_extra_info("sockname")
+        loop    = asyncio.get_event_loop()
+        clients = []
+        for name in names:
+            _, client = await loop.create_datagram_endpoint(
+                lambda: LossyClientProtocol(addr, name, options, **client_kwargs), local_addr=("127.0.0.1", 0))
+            clients.append(client)
+        try:
+            results = await asyncio.gather(*[client.future for client in clients])
+        finally:
+            transport.close()
+        return results, clients
+    return asyncio.run(run())
+
+# Tests --------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("options, blksize, windowsize", [
+    ({},                                    512,  1),  # Legacy client (no OACK).
+    ({"blksize": 1428},                     1428, 1),
+    ({"blksize": 1428, "windowsize": 16},   1428, 16),
+    ({"blksize": 100000, "windowsize": 99}, 8192, 32), # Capped by the server.
+])
+def test_tftpd_negotiation(tmp_path, options, blksize, windowsize):
+    # Image sizes: multiple of the block size (empty last block) and partial last block.
+    files = write_images(tmp_path, {"Image": 64*1024, "rootfs.cpio": 100*1024 + 7})
+    results, clients = get(files, ["Image", "rootfs.cpio"], options, max_blksize=8192, max_windowsize=32)
+    for name, data, client in zip(["Image", "rootfs.cpio"], results, clients):
+        assert data == files.get(name)[:]
+        assert client.blksize    == blksize
+        assert client.windowsize == windowsize
+
+def test_tftpd_netboot_names(tmp_path):
+    files = write_images(tmp_path, {"Image.lz4": 1000, "rootfs.cpio.gz": 2000})
+    results, clients = get(files, ["Image", "rootfs.cpio"], {"blksize": 1428})
+    assert results == [files.get("Image.lz4")[:], files.get("rootfs.cpio.gz")[:]]
+
+def test_tftpd_not_found(tmp_path):
+    files = write_images(tmp_path, {"Image": 1000})
+    with pytest.raises(IOError):
+        get(files, ["boot.json"])
+
+def test_tftpd_window_lost_first_block(tmp_path):
+    # First block of the second/third windows lost: the duplicate ACK restarts the window, without
+    # waiting for the (long) retransmit timeouts.
+    files = write_images(tmp_path, {"Image": 64*1024})
+    start = time.time()
+    results, clients = get(files, ["Image"], {"blksize": 512, "windowsize": 4},
+        client_kwargs={"drop": [5, 9], "timeout": 10}, timeout=10)
+    assert results == [files.get("Image")[:]]
+    assert time.time() - start < 5
+
+def test_tftp_transfer_window_duplicate_ack():
+    # Window of 4 blocks, block 5 (first of the second window) lost: the client acknowledges block 4
+    # for each of blocks 6..8, the window is only restarted once.
+    data     = os.urandom(10*8)
+    transfer = TFTPTransfer(data, blksize=8, windowsize=4)
+    blocks   = lambda packets: [struct.unpack(">HH", p[:4]) for p in packets]
+    transfer.start()
+    assert blocks(transfer.receive(struct.pack(">HH", tftp_ack, 4))) == [(tftp_data, n) for n in range(5, 9)]
+    assert blocks(transfer.receive(struct.pack(">HH", tftp_ack, 4))) == [(tftp_data, n) for n in range(5, 9)]
+    assert transfer.receive(struct.pack(">HH", tftp_ack, 4)) == []
+    assert transfer.receive(struct.pack(">HH", tftp_ack, 4)) == []
+    assert blocks(transfer.receive(struct.pack(">HH", tftp_ack, 8))) == [(tftp_data, n) for n in range(9, 12)]
+
+def test_tftp_transfer_window_lost_block():
+    # Window of 4 blocks, block 2 lost: the client acknowledges block 1, the window restarts after it.
+    data     = os.urandom(10*8)
+    transfer = TFTPTransfer(data, blksize=8, windowsize=4)
+    blocks   = lambda packets: [struct.unpack(">HH", p[:4]) for p in packets]
+    assert blocks(transfer.start()) == [(tftp_data, n) for n in range(1, 5)]
+    assert blocks(transfer.receive(struct.pack(">HH", tftp_ack, 1))) == [(tftp_data, n) for n in range(2, 6)]
+    assert blocks(transfer.receive(struct.pack(">HH", tftp_ack, 5))) == [(tftp_data, n) for n in range(6, 10)]
+    assert blocks(transfer.timeout()) == [(tftp_data, n) for n in range(6, 10)]
+    assert blocks(transfer.receive(struct.pack(">HH", tftp_ack, 9))) == [(tftp_data, n) for n in range(10, 12)]
+    assert transfer.receive(struct.pack(">HH", tftp_ack, 11)) == []
+    assert transfer.done and transfer.error is None
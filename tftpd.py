@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import time
+import json
+import struct
+import asyncio
+import argparse
+
+# TFTP server for the netboot of the boards (files of images.json), with blksize (RFC 2348), tsize
+# (RFC 2349) and windowsize (RFC 7440) options. The transfers are transport-agnostic state machines
+# (datagrams in, datagrams out) driven here by asyncio UDP endpoints.
+
+# TFTP protocol ------------------------------------------------------------------------------------
+
+tftp_rrq   = 1
+tftp_wrq   = 2
+tftp_data  = 3
+tftp_ack   = 4
+tftp_error = 5
+tftp_oack  = 6
+
+tftp_error_not_found     = 1
+tftp_error_access        = 2
+tftp_error_illegal       = 4
+tftp_error_unknown_tid   = 5
+tftp_error_options       = 8
+
+tftp_default_blksize    = 512
+tftp_default_windowsize = 1
+
+def tftp_error_packet(code, message):
+    return struct.pack(">HH", tftp_error, code) + message.encode() + b"\0"
+
+def tftp_request_packet(filename, options={}, opcode=tftp_rrq):
+    packet = struct.pack(">H", opcode) + filename.encode() + b"\0" + b"octet\0"
+    for k, v in options.items():
+        packet += "{}\0{}\0".format(k, v).encode()
+    return packet
+
+def tftp_parse_request(packet):
+    """Returns (opcode, filename, mode, options) of a RRQ/WRQ packet."""
+    opcode = struct.unpack(">H", packet[:2])[0]
+    fields = packet[2:].split(b"\0")
+    if len(fields) < 3 or fields[-1] != b"":
+        raise ValueError("Malformed request")
+    fields   = [f.decode(errors="replace") for f in fields[:-1]]
+    filename = fields[0]
+    mode     = fields[1].lower()
+    options  = {fields[i].lower(): fields[i + 1] for i in range(2, len(fields) - 1, 2)}
+    return opcode, filename, mode, options
+
+# TFTP transfer (server side) ----------------------------------------------------------------------
+
+class TFTPTransfer:
+    """Read transfer of data: receive() consumes a datagram from the client, start()/receive()/
+    timeout() return the datagrams to send to the client. done is set at the end of the transfer
+    (error set on failure)."""
+    def __init__(self, data, blksize=tftp_default_blksize, windowsize=tftp_default_windowsize,
+        oack=None, retries=5):
+        self.data       = data
+        self.blksize    = blksize
+        self.windowsize = windowsize
+        self.oack       = oack
+        self.retries    = retries
+        self.nblocks    = len(data)//blksize + 1 # Last block is shorter (possibly empty).
+        self.acked      = 0                      # Blocks acknowledged.
+        self.started    = oack is None           # OACK acknowledged (ACK of block 0).
+        self.restarted  = None                   # Block the window was restarted after (duplicate ACK).
+        self.tries      = 0
+        self.done       = False
+        self.error      = None
+
+    def block(self, n):
+        offset = (n - 1)*self.blksize
+        return struct.pack(">HH", tftp_data, n & 0xffff) + self.data[offset:offset + self.blksize]
+
+    def window(self):
+        if not self.started:
+            packet = struct.pack(">H", tftp_oack)
+            for k, v in self.oack.items():
+                packet += "{}\0{}\0".format(k, v).encode()
+            return [packet]
+        last = min(self.acked + self.windowsize, self.nblocks)
+        return [self.block(n) for n in range(self.acked + 1, last + 1)]
+
+    def start(self):
+        return self.window()
+
+    def receive(self, packet):
+        if self.done or len(packet) < 4:
+            return []
+        opcode, value = struct.unpack(">HH", packet[:4])
+        if opcode == tftp_error:
+            self.done  = True
+            self.error = "Client error {}: {}".format(value, packet[4:].rstrip(b"\0").decode(errors="replace"))
+            return []
+        if opcode != tftp_ack:
+            self.done  = True
+            self.error = "Illegal operation {}".format(opcode)
+            return [tftp_error_packet(tftp_error_illegal, "Illegal TFTP operation")]
+        if not self.started:
+            if value != 0:
+                return []
+            self.started = True
+            self.tries   = 0
+            return self.window()
+        # Block numbers roll over: find the acknowledged block in the window sent.
+        sent = min(self.acked + self.windowsize, self.nblocks)
+        for n in range(self.acked, sent + 1):
+            if n & 0xffff == value:
+                break
+        else:
+            return [] # Old/duplicate ACK.
+        if n == self.acked:
+            # Duplicate ACK of the last block acknowledged: first block of the window lost, restart the
+            # window (RFC 7440). Only once per block: the client can send a duplicate ACK for each of
+            # the following blocks of the window, and with windowsize 1 this is the Sorcerer's
+            # Apprentice bug.
+            if self.windowsize == 1 or self.restarted == n:
+                return []
+            self.restarted = n
+            return self.window()
+        self.acked = n
+        self.tries = 0
+        if self.acked == self.nblocks:
+            self.done = True
+            return []
+        # ACK of the last block of the window: next window. ACK of a block in the window (lost
+        # block): restart the window after it (RFC 7440).
+        return self.window()
+
+    def timeout(self):
+        self.tries += 1
+        if self.tries > self.retries:
+            self.done  = True
+            self.error = "Timeout"
+            return []
+        return self.window()
+
+def tftp_negotiate(options, size, max_blksize=65464, max_windowsize=64):
+    """Returns (blksize, windowsize, timeout, oack) from the options of a request."""
+    blksize    = tftp_default_blksize
+    windowsize = tftp_default_windowsize
+    timeout    = None
+    oack       = {}
+    for k, v in options.items():
+        try:
+            v = int(v)
+        except ValueError:
+            continue
+        if k == "blksize" and v >= 8:
+            blksize = min(v, max_blksize)
+            oack[k] = blksize
+        elif k == "windowsize" and v >= 1:
+            windowsize = min(v, max_windowsize)
+            oack[k] = windowsize
+        elif k == "tsize":
+            oack[k] = size
+        elif k == "timeout" and 1 <= v <= 255:
+            timeout = v
+            oack[k] = v
+    return blksize, windowsize, timeout, (oack or None)
+
+# Files --------------------------------------------------------------------------------------------
+
+# Compressed images (make.py --compress) are also served under the names requested by the BIOS
+# netboot: the emulator decompresses the LZ4 kernel, the kernel the gzip rootfs.
+tftp_compressed_suffixes = [".lz4", ".gz"]
+
+def tftp_netboot_name(path):
+    name = os.path.basename(path)
+    for suffix in tftp_compressed_suffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+class TFTPFiles:
+    """Files served: {name: path}, memory-mapped (shared by the transfers) and reloaded when
+    modified."""
+    def __init__(self, files):
+        self.files = files
+        self.cache = {}
+
+    @classmethod
+    def from_images(cls, filenames):
+        # Files of the images json files, served by path, by basename and by BIOS netboot name.
+        files = {}
+        for filename in filenames:
+            with open(filename) as f:
+                names = json.load(f).keys()
+            for name in names:
+                path = os.path.normpath(os.path.join(os.path.dirname(filename), name))
+                files[name] = path
+                files[os.path.basename(name)] = path
+        for path in list(files.values()):
+            files.setdefault(tftp_netboot_name(path), path)
+        return cls(files)
+
+    def get(self, name):
+        path = self.files.get(name.lstrip("/"))
+        if path is None:
+            return None
+        stat = os.stat(path)
+        key  = (stat.st_size, stat.st_mtime_ns)
+        if path not in self.cache or self.cache[path][0] != key:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+            self.cache[path] = (key, data)
+        return self.cache[path][1]
+
+# Server (asyncio) ---------------------------------------------------------------------------------
+
+class TFTPTransferProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server, transfer, addr, timeout):
+        self.server   = server
+        self.transfer = transfer
+        self.addr     = addr
+        self.timeout  = timeout
+        self.timer    = None
+        self.start    = time.time()
+
+    def send(self, packets):
+        for packet in packets:
+            self.transport.sendto(packet)
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.transfer.done:
+            self.transport.close()
+        else:
+            self.timer = asyncio.get_event_loop().call_later(self.timeout, self.on_timeout)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.send(self.transfer.start())
+
+    def datagram_received(self, data, addr):
+        self.send(self.transfer.receive(data))
+
+    def error_received(self, exc):
+        pass
+
+    def on_timeout(self):
+        self.timer = None
+        self.send(self.transfer.timeout())
+
+    def connection_lost(self, exc):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.server.transfer_done(self)
+
+class TFTPServerProtocol(asyncio.DatagramProtocol):
+    """Listening endpoint: each read request is served from a new endpoint (TID)."""
+    def __init__(self, files, max_blksize=65464, max_windowsize=64, timeout=1.0, verbose=True):
+        self.files          = files
+        self.max_blksize    = max_blksize
+        self.max_windowsize = max_windowsize
+        self.timeout        = timeout
+        self.verbose        = verbose
+        self.transfers      = set()
+        self.stats          = {"transfers": 0, "errors": 0, "bytes": 0}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            opcode, filename, mode, options = tftp_parse_request(data)
+        except (ValueError, struct.error):
+            return
+        if opcode != tftp_rrq:
+            self.transport.sendto(tftp_error_packet(tftp_error_access, "Read only server"), addr)
+            return
+        content = self.files.get(filename)
+        if content is None:
+            self.transport.sendto(tftp_error_packet(tftp_error_not_found, "File not found"), addr)
+            return
+        blksize, windowsize, timeout, oack = tftp_negotiate(options, len(content),
+            self.max_blksize, self.max_windowsize)
+        transfer = TFTPTransfer(content, blksize, windowsize, oack)
+        transfer.filename = filename
+        if self.verbose:
+            print("[tftpd] {}:{} {} (blksize {}, windowsize {})".format(addr[0], addr[1], filename,
+                blksize, windowsize))
+        loop = asyncio.get_event_loop()
+        local_addr = (self.transport.get_extra_info("sockname")[0], 0)
+        task = loop.create_datagram_endpoint(
+            lambda: TFTPTransferProtocol(self, transfer, addr, timeout or self.timeout),
+            local_addr=local_addr, remote_addr=addr)
+        self.transfers.add(asyncio.ensure_future(task))
+
+    def transfer_done(self, protocol):
+        transfer = protocol.transfer
+        self.stats["transfers"] += 1
+        if transfer.error is not None:
+            self.stats["errors"] += 1
+            if self.verbose:
+                print("[tftpd] {}: {}".format(transfer.filename, transfer.error))
+            return
+        self.stats["bytes"] += len(transfer.data)
+        if self.verbose:
+            duration = time.time() - protocol.start
+            print("[tftpd] {}: {} bytes in {:.2f}s ({:.1f} KiB/s)".format(transfer.filename,
+                len(transfer.data), duration, len(transfer.data)/max(duration, 1e-9)/1024))
+
+async def tftp_server(files, host="0.0.0.0", port=69, **kwargs):
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: TFTPServerProtocol(files, **kwargs), local_addr=(host, port))
+    return transport, protocol
+
+# Client (benchmark) -------------------------------------------------------------------------------
+
+class TFTPClientProtocol(asyncio.DatagramProtocol):
+    """Read request client, future set with the data received."""
+    def __init__(self, server, filename, options, timeout=1.0, retries=5):
+        self.server   = server
+        self.filename = filename
+        self.options  = options
+        self.timeout  = timeout
+        self.retries  = retries
+        self.future   = asyncio.get_event_loop().create_future()
+        self.blocks   = []
+        self.acked    = 0
+        self.timer    = None
+        self.tries    = 0
+        self.peer     = None
+        self.blksize    = tftp_default_blksize
+        self.windowsize = tftp_default_windowsize
+
+    def rearm(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_event_loop().call_later(self.timeout, self.on_timeout)
+
+    def send(self, packet, addr=None):
+        self.last = (packet, addr or self.peer)
+        self.transport.sendto(*self.last)
+        self.rearm()
+
+    def finish(self, result=None, error=None):
+        if self.timer is not None:
+            self.timer.cancel()
+        if not self.future.done():
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        self.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.send(tftp_request_packet(self.filename, self.options), self.server)
+
+    def ack(self, n):
+        self.acked = n
+        self.send(struct.pack(">HH", tftp_ack, n & 0xffff))
+
+    def datagram_received(self, data, addr):
+        if self.peer is None:
+            self.peer = addr
+        elif addr != self.peer:
+            self.transport.sendto(tftp_error_packet(tftp_error_unknown_tid, "Unknown transfer ID"), addr)
+            return
+        opcode = struct.unpack(">H", data[:2])[0]
+        if opcode == tftp_error:
+            self.finish(error=IOError(data[4:].rstrip(b"\0").decode(errors="replace")))
+        elif opcode == tftp_oack:
+            fields = data[2:].split(b"\0")[:-1]
+            oack   = {fields[i].decode(): fields[i + 1].decode() for i in range(0, len(fields) - 1, 2)}
+            self.blksize    = int(oack.get("blksize",    self.blksize))
+            self.windowsize = int(oack.get("windowsize", self.windowsize))
+            self.tries = 0
+            self.ack(0)
+        elif opcode == tftp_data:
+            n = len(self.blocks) + 1
+            if struct.unpack(">H", data[2:4])[0] != n & 0xffff:
+                # Out of order/duplicate: acknowledge the last block received in order.
+                self.ack(len(self.blocks))
+                return
+            self.tries = 0
+            self.blocks.append(data[4:])
+            if len(data) - 4 < self.blksize:
+                self.ack(n)
+                self.finish(b"".join(self.blocks))
+            elif n - self.acked >= self.windowsize:
+                self.ack(n)
+            else:
+                self.rearm()
+
+    def error_received(self, exc):
+        pass
+
+    def on_timeout(self):
+        self.tries += 1
+        if self.tries > self.retries:
+            self.finish(error=TimeoutError("TFTP timeout"))
+            return
+        self.transport.sendto(*self.last)
+        self.rearm()
+
+async def tftp_get(server, filename, options={}, **kwargs):
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: TFTPClientProtocol(server, filename, options, **kwargs),
+        local_addr=("127.0.0.1" if server[0].startswith("127.") else "0.0.0.0", 0))
+    return await protocol.future
+
+async def tftp_benchmark(files, clients, options, port=0):
+    transport, server = await tftp_server(files, host="127.0.0.1", port=port, verbose=False)
+    addr  = transport.get_extra_info("sockname")
+    names = sorted(set(os.path.basename(p) for p in files.files.values()))
+    start = time.time()
+    results = await asyncio.gather(*[tftp_get(addr, name, options) for _ in range(clients) for name in names])
+    duration = time.time() - start
+    transport.close()
+    for name, data in zip(names*clients, results):
+        assert data == files.get(name)[:], "{} mismatch".format(name)
+    return sum(len(r) for r in results), duration
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="TFTP server for the Linux images (netboot)")
+    parser.add_argument("--images",          required=True, nargs="+",  help="Images json file(s) listing the files served (build/<board>/images.json)")
+    parser.add_argument("--host",            default="0.0.0.0",         help="Listening address (--remote-ip of the boards)")
+    parser.add_argument("--port",            default=69, type=int,      help="Listening port")
+    parser.add_argument("--max-blksize",     default=65464, type=int,   help="Maximum negotiated block size")
+    parser.add_argument("--max-windowsize",  default=64, type=int,      help="Maximum negotiated window size")
+    parser.add_argument("--benchmark",       default=0, type=int,       help="Loopback benchmark with N concurrent clients")
+    args = parser.parse_args()
+
+    files = TFTPFiles.from_images(args.images)
+    loop  = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    if args.benchmark:
+        configs = [
+            ("legacy (512 bytes, window 1)",  {}),
+            ("blksize 1428, window 1",        {"blksize": 1428}),
+            ("blksize 1428, window 16",       {"blksize": 1428, "windowsize": 16}),
+            ("blksize 1428, window 64",       {"blksize": 1428, "windowsize": 64}),
+        ]
+        for name, options in configs:
+            size, duration = loop.run_until_complete(tftp_benchmark(files, args.benchmark, options))
+            print("{:32s}: {} clients, {} bytes in {:.2f}s ({:.1f} MiB/s)".format(
+                name, args.benchmark, size, duration, size/duration/(1024*1024)))
+        return
+
+    loop.run_until_complete(tftp_server(files, args.host, args.port,
+        max_blksize=args.max_blksize, max_windowsize=args.max_windowsize))
+    print("[tftpd] serving {} on {}:{}".format(", ".join(sorted(set(files.files.values()))), args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()